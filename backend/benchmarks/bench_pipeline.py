@@ -0,0 +1,224 @@
+"""End-to-end pipeline benchmark that runs fully offline: upload, ingest and analyze synthetic PDFs through the real
+FastAPI app with a fake LlmChat, a local fake Gemini server and an in-memory Mongo (see fakes.py / memory_mongo.py).
+
+Per scenario and size it reports ingest and analyze throughput (pages/sec), time to first event and first finding
+(from the analysis record's server-side timings), peak RSS of the process plus its PDF pool workers, LLM calls and
+Mongo operation counts. Pass --mongo-url to count operations against a real Mongo instead of the in-memory one.
+
+Run from backend/:  python -m benchmarks.bench_pipeline --pages 10 100 1000 5000 --json bench.json
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+os.environ.setdefault("GOOGLE_API_KEY_DEEP_DIVE", "benchmark")
+os.environ.setdefault("GOOGLE_API_KEY_ASSISTANT", "benchmark")
+
+import httpx  # noqa: E402
+
+import server  # noqa: E402
+from benchmarks.fakes import FakeGemini, FakeLlmChat, install_fake_llm  # noqa: E402
+from benchmarks.memory_mongo import CountingDatabase, MemoryClient  # noqa: E402
+from benchmarks.synthetic_pdf import make_pdf  # noqa: E402
+
+SCENARIOS = ("text", "pro")
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _rss_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/statm") as f: return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError): return None
+
+
+class RssSampler:
+    """Samples RSS of this process and the PDF pool workers; falls back to ru_maxrss where /proc is unavailable."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_self = self.peak_total = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def _sample(self) -> None:
+        own = _rss_bytes(os.getpid())
+        if own is None: own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        pool = server._pdf_pool
+        workers = sum(_rss_bytes(pid) or 0 for pid in (getattr(pool, "_processes", None) or {})) if pool is not None else 0
+        self.peak_self, self.peak_total = max(self.peak_self, own), max(self.peak_total, own + workers)
+
+    async def _run(self) -> None:
+        while True:
+            self._sample()
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self) -> "RssSampler":
+        self._sample()
+        self._task = asyncio.ensure_future(self._run())
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._task.cancel()
+        self._sample()
+
+    def report(self) -> Dict[str, float]:
+        return {"peak_rss_mb": round(self.peak_self / 2 ** 20, 1), "peak_rss_with_workers_mb": round(self.peak_total / 2 ** 20, 1)}
+
+
+def _sse(text: str) -> List[Dict[str, Any]]:
+    return [json.loads(line[6:]) for line in text.splitlines() if line.startswith("data: ")]
+
+
+async def _wait_until(fetch, done, timeout: float, interval: float = 0.05) -> Dict[str, Any]:
+    deadline = time.perf_counter() + timeout
+    while True:
+        state = await fetch()
+        if done(state): return state
+        if time.perf_counter() > deadline: raise TimeoutError(f"Timed out waiting for {state}")
+        await asyncio.sleep(interval)
+
+
+async def run_text(client: httpx.AsyncClient, pdf: Path, pages: int, args: argparse.Namespace) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    with open(pdf, "rb") as f: r = await client.post("/api/documents/upload", files={"file": (pdf.name, f, "application/pdf")})
+    r.raise_for_status()
+    doc_id = r.json()["id"]
+    upload_seconds = time.perf_counter() - t0
+
+    async def fetch():
+        # The list endpoint omits page text; GET /documents/{id} would re-read every page ingested so far on each poll.
+        return next(d for d in (await client.get("/api/documents")).json() if d["id"] == doc_id)
+    doc = await _wait_until(fetch, lambda d: d.get("status") != "processing", args.timeout)
+    if doc.get("status") != "ready": raise RuntimeError(f"Ingest failed: {doc.get('error')}")
+    ingest_seconds = time.perf_counter() - t0
+
+    t1 = time.perf_counter()
+    r = await client.post("/api/analyze/stream", json={"document_ids": [doc_id], "query": "indemnification clause", "speed": args.speed, "concurrency": args.concurrency})
+    analyze_seconds = time.perf_counter() - t1
+    events = _sse(r.text)
+    errors = [e for e in events if e.get("type") == "error"]
+    analysis = (await client.get(f"/api/analyses/{events[0]['analysis_id']}")).json()
+    await client.delete(f"/api/documents/{doc_id}")
+    return {"upload_seconds": upload_seconds, "ingest_seconds": ingest_seconds, "analyze_seconds": analyze_seconds, "findings": len(analysis.get("findings") or []),
+            "batches": max((e.get("total_batches", 0) for e in events if e.get("type") == "progress"), default=0), "errors": len(errors), "timings": analysis.get("timings") or {}}
+
+
+async def run_pro(client: httpx.AsyncClient, pdf: Path, pages: int, args: argparse.Namespace) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    size = pdf.stat().st_size
+    init = (await client.post("/api/pro/upload/init", json={"filename": pdf.name, "size_bytes": size})).json()
+    upload_id, chunk = init["upload_id"], init["chunk_size"]
+    with open(pdf, "rb") as f:
+        for offset in range(0, size, chunk):
+            f.seek(offset)
+            body = f.read(chunk)
+            (await client.post(f"/api/pro/upload/{upload_id}/chunk", params={"offset": offset}, content=body, headers={"X-Chunk-Sha256": hashlib.sha256(body).hexdigest()})).raise_for_status()
+    r = await client.post("/api/pro/upload/complete", json={"upload_id": upload_id, "gemini_api_key": "benchmark"})
+    r.raise_for_status()
+    doc_id = r.json()["pro_document_id"]
+    upload_seconds = time.perf_counter() - t0
+
+    async def fetch():
+        return (await client.get(f"/api/pro/documents/{doc_id}/ingest")).json()
+    state = await _wait_until(fetch, lambda s: s.get("status") != "processing", args.timeout)
+    if state.get("status") != "ready": raise RuntimeError(f"Ingest failed: {state.get('error')}")
+    ingest_seconds = time.perf_counter() - t0
+
+    t1 = time.perf_counter()
+    r = await client.post("/api/pro/analyze/stream", json={"pro_document_id": doc_id, "query": "indemnification clause", "gemini_api_key": "benchmark", "concurrency": args.concurrency})
+    analyze_seconds = time.perf_counter() - t1
+    events = _sse(r.text)
+    analysis = (await client.get(f"/api/pro/analyses/{events[0]['analysis_id']}")).json()
+    await client.delete(f"/api/pro/documents/{doc_id}")
+    result = analysis.get("result") or {}
+    return {"upload_seconds": upload_seconds, "ingest_seconds": ingest_seconds, "analyze_seconds": analyze_seconds, "findings": len(result.get("findings") or []),
+            "batches": len(analysis.get("batches") or []) or 1, "errors": sum(1 for e in events if e.get("type") == "error"), "timings": analysis.get("timings") or {}}
+
+
+async def run_case(client: httpx.AsyncClient, scenario: str, pages: int, pdf: Path, fake: FakeGemini, db: CountingDatabase, args: argparse.Namespace) -> Dict[str, Any]:
+    db.stats.reset()
+    server.rate_limiter.buckets.clear()
+    llm_before, gemini_before = dict(FakeLlmChat.calls), dict(fake.calls)
+    with RssSampler() as rss:
+        run = await (run_text if scenario == "text" else run_pro)(client, pdf, pages, args)
+    timings = run.pop("timings")
+    llm_calls = {k: v - llm_before.get(k, 0) for k, v in FakeLlmChat.calls.items() if v - llm_before.get(k, 0)}
+    gemini_calls = {k: v - gemini_before.get(k, 0) for k, v in fake.calls.items() if v - gemini_before.get(k, 0)}
+    rnd = lambda v: round(v, 3) if isinstance(v, float) else v
+    return {"scenario": scenario, "pages": pages, **{k: rnd(v) for k, v in run.items()},
+            "ingest_pages_per_sec": round(pages / run["ingest_seconds"], 1), "analyze_pages_per_sec": round(pages / run["analyze_seconds"], 1),
+            "first_event_seconds": timings.get("first_event_seconds"), "first_finding_seconds": timings.get("first_finding_seconds"), "stages": timings.get("stages", {}),
+            **rss.report(), "llm_calls": llm_calls, "gemini_calls": gemini_calls, "mongo": db.stats.snapshot()}
+
+
+async def main(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    install_fake_llm(latency=args.llm_latency, jitter=args.llm_jitter)
+    server.LLM_RATE_LIMIT_RPM, server.LLM_RATE_LIMIT_TPM = args.rpm, args.tpm
+    server.LLM_GENERATION_MODE = args.generation_mode
+    server.PRO_INGEST_POLL_SECONDS = 0.05
+    work = Path(tempfile.mkdtemp(prefix="deepdive-bench-"))
+    server.UPLOAD_DIR, server.PRO_UPLOAD_DIR = work / "uploads", work / "pro_uploads"
+    server.UPLOAD_DIR.mkdir()
+    server.PRO_UPLOAD_DIR.mkdir()
+    if args.mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        server.client = AsyncIOMotorClient(args.mongo_url)
+    else: server.client = MemoryClient(latency=args.mongo_latency)
+    db = server.db = CountingDatabase(server.client[f"{os.environ['DB_NAME']}_{int(time.time())}" if args.mongo_url else os.environ["DB_NAME"]])
+    results = []
+    try:
+        async with FakeGemini(generate_latency=args.gemini_latency, upload_latency=args.upload_latency) as fake:
+            fake.patch(server)
+            await server.app.router.startup()
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+                for i, pages in enumerate(args.pages):
+                    pdf = make_pdf(work / f"synthetic_{pages}.pdf", pages, args.words_per_page, seed=args.seed + i)
+                    for scenario in args.scenarios:
+                        result = await run_case(client, scenario, pages, pdf, fake, db, args)
+                        results.append(result)
+                        print(f"{scenario:>5} {pages:>6} pages  ingest {result['ingest_seconds']:>8.2f}s ({result['ingest_pages_per_sec']:>8.1f} p/s)  "
+                              f"analyze {result['analyze_seconds']:>8.2f}s ({result['analyze_pages_per_sec']:>8.1f} p/s)  first finding {result['first_finding_seconds']}s  "
+                              f"peak RSS {result['peak_rss_with_workers_mb']} MB  mongo ops {result['mongo']['total']}", flush=True)
+                    pdf.unlink()
+    finally:
+        if args.mongo_url: await server.client.drop_database(db.name)
+        await server.app.router.shutdown()
+        shutil.rmtree(work, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--words-per-page", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--speed", default="balanced", choices=sorted(server.DEEP_SCAN_SPEED_TOKEN_BUDGETS))
+    parser.add_argument("--concurrency", type=int, default=4, help="batches in flight per analysis")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per fake LlmChat call")
+    parser.add_argument("--generation-mode", default="stream", choices=("stream", "blocking"), help="stream: Gemini deep scans and pro batches use streamGenerateContent")
+    parser.add_argument("--llm-jitter", type=float, default=0.05)
+    parser.add_argument("--gemini-latency", type=float, default=0.5, help="seconds per fake (stream)generateContent call")
+    parser.add_argument("--upload-latency", type=float, default=0.05, help="seconds per fake Files API upload")
+    parser.add_argument("--mongo-latency", type=float, default=0.0, help="simulated round trip per in-memory Mongo operation")
+    parser.add_argument("--mongo-url", help="count operations against this Mongo instead of the in-memory stand-in")
+    parser.add_argument("--rpm", type=int, default=1_000_000, help="rate limiter RPM (default effectively unlimited)")
+    parser.add_argument("--tpm", type=int, default=1_000_000_000)
+    parser.add_argument("--timeout", type=float, default=1800)
+    parser.add_argument("--json", type=Path, help="also write the results to this file")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    results = asyncio.run(main(args))
+    if args.json: args.json.write_text(json.dumps(results, indent=2))
@@ -0,0 +1,109 @@
+"""Compare the single-pass PDF splitter against the previous re-serialising implementation.
+
+Run from backend/:  python -m benchmarks.bench_split_pdf --pages 5000
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+
+import PyPDF2  # noqa: E402
+
+import server  # noqa: E402
+from benchmarks.synthetic_pdf import make_pdf  # noqa: E402
+
+
+def legacy_split_pdf_by_pages(src_path: Path, out_dir: Path, max_pages_per_file: int = server.GEMINI_FILE_MAX_PAGES, max_size_mb: int = server.GEMINI_FILE_MAX_SIZE_MB) -> List[Dict[str, Any]]:
+    # The splitter as it was before the single-pass rewrite, kept verbatim for comparison.
+    out_dir.mkdir(parents=True, exist_ok=True)
+    max_size_bytes = max_size_mb * 1024 * 1024
+    with open(src_path, "rb") as f:
+        reader = PyPDF2.PdfReader(f, strict=False)
+        total = len(reader.pages)
+        parts = []
+        part_idx = 0
+        start = 1
+        while start <= total:
+            writer = PyPDF2.PdfWriter()
+            current_page = start
+            while current_page <= total and (current_page - start + 1) <= max_pages_per_file:
+                writer.add_page(reader.pages[current_page - 1])
+                if len(writer.pages) % 50 == 0 or current_page == total:
+                    buffer = io.BytesIO()
+                    writer.write(buffer)
+                    current_size = buffer.tell()
+                    if current_size >= max_size_bytes and len(writer.pages) > 1:
+                        if current_page > start:
+                            current_page -= 1
+                            writer = PyPDF2.PdfWriter()
+                            for p in range(start - 1, current_page): writer.add_page(reader.pages[p])
+                        break
+                current_page += 1
+            end = current_page if current_page <= total else total
+            if len(writer.pages) == 0:
+                writer.add_page(reader.pages[start - 1])
+                end = start
+            part_idx += 1
+            out_path = out_dir / f"part_{part_idx}_{start}-{end}.pdf"
+            with open(out_path, "wb") as out_f: writer.write(out_f)
+            actual_size = out_path.stat().st_size
+            parts.append({"part_index": part_idx, "start_page": start, "end_page": end, "local_path": str(out_path), "size_bytes": actual_size})
+            start = end + 1
+    return parts
+
+
+def _summary(name: str, seconds: float, parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {"name": name, "seconds": round(seconds, 3), "parts": [[p["start_page"], p["end_page"], p["size_bytes"]] for p in parts]}
+
+
+def _run(src: Path, work: Path, max_pages: int, max_size_mb: int, skip_legacy: bool) -> List[Dict[str, Any]]:
+    runs = [("single_pass", lambda out: server._split_pdf_by_pages(src, out, max_pages, max_size_mb)),
+            ("single_pass_parallel", lambda out: asyncio.run(server.split_pdf_by_pages_parallel(src, out, max_pages, max_size_mb)))]
+    if not skip_legacy: runs.append(("legacy", lambda out: legacy_split_pdf_by_pages(src, out, max_pages, max_size_mb)))
+    results = []
+    for name, fn in runs:
+        out = work / f"{name}_{max_pages}_{max_size_mb}"
+        t0 = time.perf_counter()
+        parts = fn(out)
+        summary = _summary(name, time.perf_counter() - t0, parts)
+        results.append(summary)
+        print(f"  {name:>20}: {summary['seconds']:8.2f}s  parts={[(s, e, round(b / 1e6, 1)) for s, e, b in summary['parts']]}")
+        shutil.rmtree(out, ignore_errors=True)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=5000)
+    parser.add_argument("--words-per-page", type=int, default=1000, help="~9.5 KB per page at the default")
+    parser.add_argument("--size-bound-mb", type=int, default=5, help="size limit for the size-bound scenario")
+    parser.add_argument("--skip-legacy", action="store_true")
+    parser.add_argument("--json", type=Path, help="write results to this file")
+    args = parser.parse_args()
+
+    work = Path(tempfile.mkdtemp(prefix="bench_split_"))
+    try:
+        src = make_pdf(work / "source.pdf", args.pages, args.words_per_page)
+        results = {"pages": args.pages, "source_bytes": src.stat().st_size, "pool_workers": server.PDF_POOL_WORKERS, "scenarios": {}}
+        print(f"source: {args.pages} pages, {results['source_bytes'] / 1e6:.1f} MB, {server.PDF_POOL_WORKERS} pool workers")
+        scenarios = {"page_bound": (server.GEMINI_FILE_MAX_PAGES, server.GEMINI_FILE_MAX_SIZE_MB), "size_bound": (server.GEMINI_FILE_MAX_PAGES, args.size_bound_mb)}
+        for scenario, (max_pages, max_size_mb) in scenarios.items():
+            print(f"{scenario} (max {max_pages} pages, {max_size_mb} MB):")
+            results["scenarios"][scenario] = _run(src, work, max_pages, max_size_mb, args.skip_legacy)
+        if server._pdf_pool is not None: server._pdf_pool.shutdown()
+        if args.json: args.json.write_text(json.dumps(results, indent=2))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""Offline stand-ins for the LLM providers: a fake `emergentintegrations` LlmChat and a local Gemini REST server.
+
+Both answer in the shapes server.py parses, after a configurable latency, so the benchmarks measure our own
+overhead (PDF work, batching, Mongo traffic, scheduling) rather than a provider's.
+"""
+import asyncio
+import json
+import random
+import re
+import sys
+import types
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+_PAGE_RE = re.compile(r"PAGE (\d+) \(")
+_GLOBAL_PAGE_RE = re.compile(r"\[GLOBAL PAGE (\d+)\]")
+_PAGE_RANGE_RE = re.compile(r"pages (\d+) to (\d+)")
+
+
+class FakeUserMessage:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeLlmChat:
+    """LlmChat look-alike; class attributes hold the knobs and counters because server.py builds one per call."""
+
+    latency = 0.2
+    jitter = 0.0
+    match_every = 7
+    calls: Counter = Counter()
+
+    def __init__(self, api_key: str, session_id: str, system_message: str):
+        self.session_id, self.system_message = session_id, system_message
+
+    def with_model(self, provider: str, model: str) -> "FakeLlmChat":
+        self.model = model
+        return self
+
+    async def send_message(self, message: FakeUserMessage) -> str:
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if self.session_id.startswith("rubric-"):
+            FakeLlmChat.calls["rubric"] += 1
+            return json.dumps({"rubric_text": "Pages that mention the query terms.", "rubric_json": {"must": [], "should": []}})
+        pages = [int(n) for n in _PAGE_RE.findall(message.text)]
+        if pages:
+            FakeLlmChat.calls["deep_scan"] += 1
+            results = [{"page_number": n, "status": "match" if n % self.match_every == 0 else "no_match", "page_summary": f"Synthetic page {n}",
+                        "findings": [{"text": f"quote from page {n}", "relevance": "synthetic", "confidence": "high"}] if n % self.match_every == 0 else []} for n in pages]
+            return json.dumps({"page_results": results, "batch_thinking": f"{len(pages)} pages scanned"})
+        FakeLlmChat.calls["chat"] += 1
+        return "Synthetic answer citing [Page 1]."
+
+
+def install_fake_llm(latency: float = 0.2, jitter: float = 0.0, match_every: int = 7) -> None:
+    """Register FakeLlmChat as `emergentintegrations.llm.chat` so server.py's lazy imports pick it up."""
+    FakeLlmChat.latency, FakeLlmChat.jitter, FakeLlmChat.match_every = latency, jitter, match_every
+    FakeLlmChat.calls = Counter()
+    chat = types.ModuleType("emergentintegrations.llm.chat")
+    chat.LlmChat, chat.UserMessage = FakeLlmChat, FakeUserMessage
+    llm = types.ModuleType("emergentintegrations.llm")
+    llm.chat = chat
+    root = types.ModuleType("emergentintegrations")
+    root.llm = llm
+    sys.modules.update({"emergentintegrations": root, "emergentintegrations.llm": llm, "emergentintegrations.llm.chat": chat})
+
+
+class FakeGemini:
+    """Local aiohttp server for the Gemini Files, models, countTokens, (stream)generateContent and cachedContents endpoints.
+
+    Use as `async with FakeGemini(...) as fake: fake.patch(server)`.
+    """
+
+    def __init__(self, generate_latency: float = 0.5, upload_latency: float = 0.05, tokens_per_page: int = 650, match_every: int = 7, stream_chunks: int = 8):
+        self.generate_latency, self.upload_latency, self.stream_chunks = generate_latency, upload_latency, stream_chunks
+        self.tokens_per_page, self.match_every = tokens_per_page, match_every
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.caches: Dict[str, Dict[str, Any]] = {}
+        self.cache_create_status: Optional[int] = None  # set to e.g. 400 to make cachedContents.create fail
+        self.calls: Counter = Counter()
+        self.base = ""
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_post("/upload/v1beta/files", self._start_upload)
+        app.router.add_post("/upload-session/{id}", self._finish_upload)
+        app.router.add_get("/v1beta/files/{id}", self._get_file)
+        app.router.add_delete("/v1beta/files/{id}", self._delete_file)
+        app.router.add_get("/v1beta/models", self._models)
+        app.router.add_post("/v1beta/models/{model}", self._model_call)
+        app.router.add_post("/v1beta/cachedContents", self._create_cache)
+        app.router.add_delete("/v1beta/cachedContents/{id}", self._delete_cache)
+        self._app = app
+        self._runner: Optional[web.AppRunner] = None
+
+    async def __aenter__(self) -> "FakeGemini":
+        self._runner = web.AppRunner(self._app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.base = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self._runner.cleanup()
+
+    def patch(self, server_module: Any) -> None:
+        server_module.GEMINI_BASE_URL = self.base
+        server_module.GEMINI_FILES_UPLOAD_URL = f"{self.base}/upload/v1beta/files"
+        server_module.GEMINI_FILES_URL = f"{self.base}/v1beta/files"
+
+    async def _start_upload(self, request: web.Request) -> web.Response:
+        self.calls["upload_start"] += 1
+        return web.json_response({}, headers={"x-goog-upload-url": f"{self.base}/upload-session/{uuid.uuid4().hex[:12]}"})
+
+    async def _finish_upload(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        self.calls["upload_finish"] += 1
+        await asyncio.sleep(self.upload_latency)
+        file_id = request.match_info["id"]
+        # Synthetic PDFs write one "/Type /Page " dictionary per page; good enough for token estimates.
+        self.files[file_id] = {"pages": max(1, body.count(b"/Type /Page ")), "size": len(body)}
+        expires = (datetime.now(timezone.utc) + timedelta(hours=48)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return web.json_response({"file": {"name": f"files/{file_id}", "uri": f"{self.base}/v1beta/files/{file_id}", "state": "ACTIVE", "expirationTime": expires, "sizeBytes": str(len(body))}})
+
+    async def _get_file(self, request: web.Request) -> web.Response:
+        self.calls["file_get"] += 1
+        file_id = request.match_info["id"]
+        if file_id not in self.files: return web.json_response({"error": {"code": 404, "message": "File not found"}}, status=404)
+        return web.json_response({"name": f"files/{file_id}", "state": "ACTIVE"})
+
+    async def _delete_file(self, request: web.Request) -> web.Response:
+        self.calls["file_delete"] += 1
+        self.files.pop(request.match_info["id"], None)
+        return web.json_response({})
+
+    async def _models(self, request: web.Request) -> web.Response:
+        self.calls["models"] += 1
+        names = ("gemini-2.5-pro", "gemini-2.5-flash", "gemini-1.5-pro")
+        return web.json_response({"models": [{"name": f"models/{n}", "supportedGenerationMethods": ["generateContent", "streamGenerateContent", "countTokens", "createCachedContent"]} for n in names]})
+
+    def _file_tokens(self, parts: List[Dict[str, Any]]) -> int:
+        tokens = 0
+        for p in parts:
+            if "fileData" in p: tokens += self.files.get(p["fileData"]["fileUri"].rsplit("/", 1)[-1], {"pages": 1})["pages"] * self.tokens_per_page
+            else: tokens += len(p.get("text", "")) // 4
+        return tokens
+
+    async def _model_call(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        model, _, method = request.match_info["model"].partition(":")
+        parts = body["contents"][0]["parts"]
+        if method == "countTokens":
+            self.calls["count_tokens"] += 1
+            return web.json_response({"totalTokens": self._file_tokens(parts)})
+        self.calls["generate"] += 1
+        if body.get("cachedContent"):
+            self.calls["generate_cached"] += 1
+            if body["cachedContent"] not in self.caches: return web.json_response({"error": {"code": 404, "message": "CachedContent not found"}}, status=404)
+        text = "\n".join(p.get("text", "") for p in parts)
+        scan_pages = [int(n) for n in _PAGE_RE.findall(text)]
+        if scan_pages:
+            # Deep-scan prompt (sent here when scans stream from Gemini directly): same answer as FakeLlmChat.
+            self.calls["deep_scan"] += 1
+            results = [{"page_number": n, "status": "match" if n % self.match_every == 0 else "no_match", "page_summary": f"Synthetic page {n}",
+                        "findings": [{"text": f"quote from page {n}", "relevance": "synthetic", "confidence": "high"}] if n % self.match_every == 0 else []} for n in scan_pages]
+            report, hits = {"page_results": results, "batch_thinking": f"{len(scan_pages)} pages scanned"}, scan_pages
+        else:
+            pages = [int(n) for n in _GLOBAL_PAGE_RE.findall(text)]
+            if not pages:
+                span = _PAGE_RANGE_RE.search(text)
+                pages = list(range(int(span.group(1)), int(span.group(2)) + 1)) if span else [1]
+            hits = [n for n in pages if n % self.match_every == 0] or pages[:1]
+            report = {"doc_type": "synthetic", "structure": {}, "notes": f"{len(pages)} pages",
+                      "findings": [{"global_page": n, "section": "body", "quote": f"quote from page {n}", "why_relevant": "synthetic", "confidence": "high"} for n in hits]}
+        usage = {"promptTokenCount": self._file_tokens(parts), "candidatesTokenCount": 50 * len(hits)}
+        if method == "streamGenerateContent": return await self._stream(request, json.dumps(report), usage)
+        await asyncio.sleep(self.generate_latency)
+        return web.json_response({"candidates": [{"content": {"parts": [{"text": json.dumps(report)}]}}], "usageMetadata": usage})
+
+    async def _stream(self, request: web.Request, text: str, usage: Dict[str, Any]) -> web.StreamResponse:
+        # alt=sse: the text goes out in `stream_chunks` slices spread evenly over generate_latency.
+        self.calls["generate_stream"] += 1
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        step = max(1, -(-len(text) // self.stream_chunks))
+        for i in range(0, len(text), step):
+            await asyncio.sleep(self.generate_latency / self.stream_chunks)
+            chunk = {"candidates": [{"content": {"parts": [{"text": text[i:i + step]}], "role": "model"}}]}
+            if i + step >= len(text): chunk["usageMetadata"] = usage
+            await resp.write(f"data: {json.dumps(chunk)}\r\n\r\n".encode())
+        await resp.write_eof()
+        return resp
+
+    async def _create_cache(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.calls["cache_create"] += 1
+        if self.cache_create_status: return web.json_response({"error": {"code": self.cache_create_status, "message": "Cached content is too small"}}, status=self.cache_create_status)
+        name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+        ttl = int(str(body.get("ttl", "3600s")).rstrip("s"))
+        self.caches[name] = body
+        return web.json_response({"name": name, "model": body["model"], "expireTime": (datetime.now(timezone.utc) + timedelta(seconds=ttl)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")})
+
+    async def _delete_cache(self, request: web.Request) -> web.Response:
+        self.calls["cache_delete"] += 1
+        self.caches.pop(f"cachedContents/{request.match_info['id']}", None)
+        return web.json_response({})
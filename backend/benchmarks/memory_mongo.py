@@ -0,0 +1,440 @@
+"""In-memory stand-in for the slice of the motor API that server.py uses, plus a counting wrapper for any motor database.
+
+Only what the app calls is implemented: equality/range/$in/$exists filters on dotted paths, top-level projections,
+$set/$unset/$inc/$push/$addToSet/$setOnInsert updates with upserts, unique indexes, sort/skip/limit cursors,
+find_one_and_update, find_one_and_delete and bulk_write. It is a benchmarking aid, not a general Mongo emulator.
+"""
+import asyncio
+import copy
+import itertools
+import time
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+_MISSING = object()
+
+
+def _get_path(doc: Any, path: str) -> Any:
+    keys = path.split(".")
+    for i, key in enumerate(keys):
+        if isinstance(doc, dict): doc = doc.get(key, _MISSING)
+        elif isinstance(doc, list) and key.isdigit(): doc = doc[int(key)] if int(key) < len(doc) else _MISSING
+        elif isinstance(doc, list):
+            # "parts.state" over an array of sub-documents yields every element's value, as Mongo matches it.
+            rest = ".".join(keys[i:])
+            values = [_get_path(d, rest) for d in doc if isinstance(d, dict)]
+            return [v for v in values if v is not _MISSING] or _MISSING
+        else: return _MISSING
+        if doc is _MISSING: return _MISSING
+    return doc
+
+
+def _set_path(doc: Any, path: str, value: Any) -> None:
+    # Numeric segments index into arrays ("parts.3.state"), as in Mongo's dotted update paths.
+    keys = path.split(".")
+    for key in keys[:-1]:
+        if isinstance(doc, list): doc = doc[int(key)]
+        else:
+            if doc.get(key) is None: doc[key] = {}
+            doc = doc[key]
+    if isinstance(doc, list): doc[int(keys[-1])] = value
+    else: doc[keys[-1]] = value
+
+
+def _unset_path(doc: Any, path: str) -> None:
+    keys = path.split(".")
+    for key in keys[:-1]:
+        doc = _get_path(doc, key)
+        if not isinstance(doc, (dict, list)): return
+    if isinstance(doc, dict): doc.pop(keys[-1], None)
+
+
+def _sort_key(value: Any) -> Tuple[int, Any]:
+    # Mongo orders missing/None before numbers before strings; good enough for the fields the app sorts on.
+    if value is _MISSING or value is None: return (0, 0)
+    if isinstance(value, (int, float)): return (1, value)
+    if isinstance(value, str): return (2, value)
+    return (3, str(value))
+
+
+def _match_value(value: Any, cond: Any) -> bool:
+    if isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond):
+        return all(_match_operator(value, op, arg) for op, arg in cond.items())
+    if isinstance(value, list) and not isinstance(cond, list): return cond in value
+    return (None if value is _MISSING else value) == cond
+
+
+def _match_operator(value: Any, op: str, arg: Any) -> bool:
+    if op == "$exists": return (value is not _MISSING) == bool(arg)
+    if op == "$eq": return _match_value(value, arg)
+    if op == "$ne": return not _match_value(value, arg)
+    if op == "$in": return any(_match_value(value, a) for a in arg)
+    if op == "$nin": return not any(_match_value(value, a) for a in arg)
+    if op in ("$gt", "$gte", "$lt", "$lte"):
+        values = value if isinstance(value, list) else [value]
+        for v in values:
+            if v is _MISSING or v is None: continue
+            try:
+                if (op == "$gt" and v > arg) or (op == "$gte" and v >= arg) or (op == "$lt" and v < arg) or (op == "$lte" and v <= arg): return True
+            except TypeError: continue
+        return False
+    raise NotImplementedError(f"memory_mongo: unsupported query operator {op}")
+
+
+def _matches(doc: dict, query: Optional[dict]) -> bool:
+    for key, cond in (query or {}).items():
+        if key == "$and":
+            if not all(_matches(doc, q) for q in cond): return False
+        elif key == "$or":
+            if not any(_matches(doc, q) for q in cond): return False
+        elif not _match_value(_get_path(doc, key), cond): return False
+    return True
+
+
+def _project(doc: dict, projection: Optional[dict]) -> dict:
+    doc = copy.deepcopy(doc)
+    if not projection: return doc
+    include_id = bool(projection.get("_id", 1))
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if any(fields.values()):
+        out = {}
+        for path in fields:
+            value = _get_path(doc, path)
+            if value is not _MISSING: _set_path(out, path, value)
+    else:
+        out = doc
+        for path in fields: _unset_path(out, path)
+    if include_id and "_id" in doc: out["_id"] = doc["_id"]
+    elif not include_id: out.pop("_id", None)
+    return out
+
+
+def _apply_update(doc: dict, update: dict, inserting: bool = False) -> None:
+    if not any(k.startswith("$") for k in update):
+        keep_id = doc.get("_id")
+        doc.clear()
+        doc.update(copy.deepcopy(update))
+        if keep_id is not None: doc["_id"] = keep_id
+        return
+    for op, fields in update.items():
+        if op == "$setOnInsert" and not inserting: continue
+        for path, arg in fields.items():
+            if op in ("$set", "$setOnInsert"): _set_path(doc, path, copy.deepcopy(arg))
+            elif op == "$unset": _unset_path(doc, path)
+            elif op == "$inc":
+                current = _get_path(doc, path)
+                _set_path(doc, path, (0 if current is _MISSING or current is None else current) + arg)
+            elif op in ("$push", "$addToSet"):
+                current = _get_path(doc, path)
+                if current is _MISSING or current is None:
+                    current = []
+                    _set_path(doc, path, current)
+                items = arg["$each"] if isinstance(arg, dict) and "$each" in arg else [arg]
+                for item in items:
+                    if op == "$push" or item not in current: current.append(copy.deepcopy(item))
+            elif op == "$pull":
+                current = _get_path(doc, path)
+                if isinstance(current, list): current[:] = [v for v in current if not _match_value(v, arg)]
+            else: raise NotImplementedError(f"memory_mongo: unsupported update operator {op}")
+
+
+class MemoryCursor:
+    """Lazy find() cursor: filters, sorts and slices when first iterated."""
+
+    def __init__(self, collection: "MemoryCollection", query: Optional[dict], projection: Optional[dict]):
+        self._collection, self._query, self._projection = collection, query, projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip, self._limit = 0, 0
+        self._results: Optional[Iterable[dict]] = None
+
+    def sort(self, key_or_list, direction: int = 1) -> "MemoryCursor":
+        self._sort = [(key_or_list, direction)] if isinstance(key_or_list, str) else list(key_or_list)
+        return self
+
+    def skip(self, n: int) -> "MemoryCursor":
+        self._skip = n
+        return self
+
+    def limit(self, n: int) -> "MemoryCursor":
+        self._limit = n
+        return self
+
+    def batch_size(self, n: int) -> "MemoryCursor":
+        return self
+
+    async def _materialise(self) -> Iterable[dict]:
+        if self._results is None:
+            await self._collection._db._tick()
+            docs = [d for d in self._collection._docs if _matches(d, self._query)]
+            for key, direction in reversed(self._sort): docs.sort(key=lambda d: _sort_key(_get_path(d, key)), reverse=direction < 0)
+            docs = docs[self._skip:self._skip + self._limit if self._limit else None]
+            self._results = iter([_project(d, self._projection) for d in docs])
+        return self._results
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        results = await self._materialise()
+        return list(itertools.islice(results, length)) if length else list(results)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        try: return next(await self._materialise())
+        except StopIteration: raise StopAsyncIteration
+
+
+class MemoryCollection:
+    """One collection: a list of documents plus hash maps for the unique indexes declared through create_index."""
+
+    def __init__(self, db: "MemoryDatabase", name: str):
+        self._db, self.name = db, name
+        self._docs: List[dict] = []
+        self._unique: Dict[Tuple[str, ...], Dict[str, dict]] = {}
+
+    @staticmethod
+    def _index_key(doc: dict, fields: Tuple[str, ...]) -> Optional[str]:
+        values = tuple(_get_path(doc, f) for f in fields)
+        return None if all(v is _MISSING for v in values) else repr(values)
+
+    def _index(self, doc: dict, previous: Optional[dict] = None) -> None:
+        # `previous` is the stored document an update is about to overwrite in place; it stays the mapped object.
+        # Checks every unique index before touching any, so a duplicate leaves the maps unchanged.
+        moves = []
+        for fields, entries in self._unique.items():
+            new_key, old_key = self._index_key(doc, fields), self._index_key(previous, fields) if previous is not None else None
+            if new_key == old_key and previous is not None: continue
+            if new_key is not None and new_key in entries:
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {'_'.join(fields)}")
+            moves.append((entries, old_key, new_key))
+        for entries, old_key, new_key in moves:
+            if old_key is not None: entries.pop(old_key, None)
+            if new_key is not None: entries[new_key] = doc if previous is None else previous
+
+    def _insert(self, doc: dict) -> ObjectId:
+        doc.setdefault("_id", ObjectId())
+        stored = copy.deepcopy(doc)
+        self._index(stored)
+        self._docs.append(stored)
+        return doc["_id"]
+
+    def _update(self, query: dict, update: dict, upsert: bool, many: bool) -> SimpleNamespace:
+        matched = [d for d in self._docs if _matches(d, query)]
+        if not many: matched = matched[:1]
+        for d in matched:
+            updated = copy.deepcopy(d)
+            _apply_update(updated, update)
+            self._index(updated, previous=d)
+            d.clear()
+            d.update(updated)
+        upserted_id = None
+        if not matched and upsert:
+            doc = {k: v for k, v in (query or {}).items() if not k.startswith("$") and "." not in k and not isinstance(v, dict)}
+            _apply_update(doc, update, inserting=True)
+            upserted_id = self._insert(doc)
+        return SimpleNamespace(matched_count=len(matched), modified_count=len(matched), upserted_id=upserted_id, acknowledged=True)
+
+    def _delete(self, query: dict, many: bool) -> SimpleNamespace:
+        matched = [d for d in self._docs if _matches(d, query)]
+        if not many: matched = matched[:1]
+        ids = {id(d) for d in matched}
+        for fields, entries in self._unique.items():
+            for d in matched: entries.pop(self._index_key(d, fields), None)
+        self._docs = [d for d in self._docs if id(d) not in ids]
+        return SimpleNamespace(deleted_count=len(matched), acknowledged=True)
+
+    async def create_index(self, keys, unique: bool = False, **kwargs) -> str:
+        fields = (keys,) if isinstance(keys, str) else tuple(k for k, _ in keys)
+        if unique and fields not in self._unique:
+            self._unique[fields] = {}
+            for d in self._docs: self._index(d)
+        return "_".join(f"{f}_1" for f in fields)
+
+    async def insert_one(self, doc: dict) -> SimpleNamespace:
+        await self._db._tick()
+        return SimpleNamespace(inserted_id=self._insert(doc), acknowledged=True)
+
+    async def insert_many(self, docs: List[dict], ordered: bool = True) -> SimpleNamespace:
+        await self._db._tick()
+        return SimpleNamespace(inserted_ids=[self._insert(d) for d in docs], acknowledged=True)
+
+    async def find_one(self, query: Optional[dict] = None, projection: Optional[dict] = None) -> Optional[dict]:
+        await self._db._tick()
+        for d in self._docs:
+            if _matches(d, query): return _project(d, projection)
+        return None
+
+    def find(self, query: Optional[dict] = None, projection: Optional[dict] = None) -> MemoryCursor:
+        return MemoryCursor(self, query, projection)
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False) -> SimpleNamespace:
+        await self._db._tick()
+        return self._update(query, update, upsert, many=False)
+
+    async def update_many(self, query: dict, update: dict, upsert: bool = False) -> SimpleNamespace:
+        await self._db._tick()
+        return self._update(query, update, upsert, many=True)
+
+    async def replace_one(self, query: dict, replacement: dict, upsert: bool = False) -> SimpleNamespace:
+        await self._db._tick()
+        return self._update(query, replacement, upsert, many=False)
+
+    async def find_one_and_update(self, query: dict, update: dict, projection: Optional[dict] = None, sort=None, upsert: bool = False, return_document: bool = False) -> Optional[dict]:
+        await self._db._tick()
+        docs = [d for d in self._docs if _matches(d, query)]
+        for key, direction in reversed([(sort, 1)] if isinstance(sort, str) else list(sort or [])): docs.sort(key=lambda d: _sort_key(_get_path(d, key)), reverse=direction < 0)
+        if not docs:
+            if not upsert: return None
+            result = self._update(query, update, True, many=False)
+            return self._find_by_id(result.upserted_id, projection) if return_document else None
+        before = _project(docs[0], projection)
+        self._update({"_id": docs[0]["_id"]}, update, False, many=False)
+        return self._find_by_id(docs[0]["_id"], projection) if return_document else before
+
+    async def find_one_and_delete(self, query: dict, projection: Optional[dict] = None) -> Optional[dict]:
+        await self._db._tick()
+        doc = next((d for d in self._docs if _matches(d, query)), None)
+        if doc is None: return None
+        before = _project(doc, projection)
+        self._delete({"_id": doc["_id"]}, many=False)
+        return before
+
+    def _find_by_id(self, _id: Any, projection: Optional[dict]) -> Optional[dict]:
+        return next((_project(d, projection) for d in self._docs if d.get("_id") == _id), None)
+
+    async def delete_one(self, query: dict) -> SimpleNamespace:
+        await self._db._tick()
+        return self._delete(query, many=False)
+
+    async def delete_many(self, query: dict) -> SimpleNamespace:
+        await self._db._tick()
+        return self._delete(query, many=True)
+
+    async def count_documents(self, query: dict) -> int:
+        await self._db._tick()
+        return sum(1 for d in self._docs if _matches(d, query))
+
+    async def estimated_document_count(self) -> int:
+        await self._db._tick()
+        return len(self._docs)
+
+    async def distinct(self, key: str, query: Optional[dict] = None) -> List[Any]:
+        await self._db._tick()
+        out = []
+        for d in self._docs:
+            v = _get_path(d, key)
+            if v is not _MISSING and _matches(d, query) and v not in out: out.append(v)
+        return out
+
+    async def bulk_write(self, requests: List[Any], ordered: bool = True) -> SimpleNamespace:
+        await self._db._tick()
+        counts = Counter()
+        for r in requests:
+            if isinstance(r, InsertOne): self._insert(r._doc); counts["inserted"] += 1
+            elif isinstance(r, (UpdateOne, UpdateMany, ReplaceOne)):
+                res = self._update(r._filter, r._doc, r._upsert, many=isinstance(r, UpdateMany))
+                counts["matched"] += res.matched_count
+                counts["upserted"] += res.upserted_id is not None
+            elif isinstance(r, (DeleteOne, DeleteMany)): counts["deleted"] += self._delete(r._filter, many=isinstance(r, DeleteMany)).deleted_count
+            else: raise NotImplementedError(f"memory_mongo: unsupported bulk op {type(r).__name__}")
+        return SimpleNamespace(inserted_count=counts["inserted"], matched_count=counts["matched"], modified_count=counts["matched"], deleted_count=counts["deleted"], upserted_count=counts["upserted"], acknowledged=True)
+
+
+class MemoryDatabase:
+    """Collections are created on first access, like Mongo; `latency` adds a simulated round trip to every operation."""
+
+    def __init__(self, name: str, latency: float = 0.0):
+        self.name, self.latency = name, latency
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    async def _tick(self) -> None:
+        await asyncio.sleep(self.latency)
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self._collections: self._collections[name] = MemoryCollection(self, name)
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"): raise AttributeError(name)
+        return self[name]
+
+    async def command(self, name: str, *args, **kwargs) -> dict:
+        return {"ok": 1.0}
+
+    async def list_collection_names(self) -> List[str]:
+        return list(self._collections)
+
+
+class MemoryClient:
+    """Drop-in for AsyncIOMotorClient(...) in the benchmarks."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._dbs: Dict[str, MemoryDatabase] = {}
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        if name not in self._dbs: self._dbs[name] = MemoryDatabase(name, self.latency)
+        return self._dbs[name]
+
+    def get_database(self, name: str) -> MemoryDatabase:
+        return self[name]
+
+    def close(self) -> None:
+        pass
+
+
+class _CountingCollection:
+    def __init__(self, collection: Any, stats: "MongoOpStats"):
+        self._collection, self._stats = collection, stats
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._collection, name)
+        if name.startswith("_") or not callable(attr): return attr
+        stats, collection_name = self._stats, self._collection.name
+
+        def call(*args, **kwargs):
+            stats.record(collection_name, name, args)
+            return attr(*args, **kwargs)
+        return call
+
+
+class MongoOpStats:
+    """Per collection/operation counters; bulk_write and insert_many also count the documents they carry."""
+
+    def __init__(self):
+        self.ops: Counter = Counter()
+        self.documents: Counter = Counter()
+        self.started = time.perf_counter()
+
+    def record(self, collection: str, op: str, args: tuple) -> None:
+        self.ops[f"{collection}.{op}"] += 1
+        if op in ("insert_many", "bulk_write") and args: self.documents[f"{collection}.{op}"] += len(args[0])
+
+    def reset(self) -> None:
+        self.ops.clear()
+        self.documents.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        by_op: Dict[str, int] = defaultdict(int)
+        for key, n in self.ops.items(): by_op[key.split(".", 1)[1]] += n
+        return {"total": sum(self.ops.values()), "by_operation": dict(sorted(by_op.items())), "by_collection_operation": dict(sorted(self.ops.items())), "documents_written": dict(sorted(self.documents.items()))}
+
+
+class CountingDatabase:
+    """Wraps a motor (or MemoryDatabase) handle and counts every collection method call into `stats`."""
+
+    def __init__(self, db: Any, stats: Optional[MongoOpStats] = None):
+        self._db = db
+        self.stats = stats or MongoOpStats()
+
+    def __getitem__(self, name: str) -> _CountingCollection:
+        return _CountingCollection(self._db[name], self.stats)
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"): raise AttributeError(name)
+        if name in ("command", "list_collection_names", "name"): return getattr(self._db, name)
+        return self[name]
@@ -0,0 +1,60 @@
+"""Synthetic PDF generator for the benchmarks: N text pages sharing one font, written without PyPDF2."""
+import argparse
+import random
+from pathlib import Path
+
+_WORDS = ("agreement party indemnification clause liability notice court record exhibit schedule termination "
+          "payment warranty breach remedy jurisdiction witness statement filing motion order evidence").split()
+
+
+def _page_text_lines(page_number: int, words_per_page: int, rng: random.Random):
+    words = [rng.choice(_WORDS) for _ in range(words_per_page)]
+    line = []
+    yield f"Page {page_number}"
+    for w in words:
+        line.append(w)
+        if len(line) == 12:
+            yield " ".join(line)
+            line = []
+    if line: yield " ".join(line)
+
+
+def make_pdf(path: Path, pages: int, words_per_page: int = 300, seed: int = 0) -> Path:
+    """Write a PDF with `pages` pages of extractable text; roughly 7 bytes per word per page."""
+    rng = random.Random(seed)
+    path = Path(path)
+    offsets = {}
+    with open(path, "wb") as f:
+        def obj(num: int, body: bytes) -> None:
+            offsets[num] = f.tell()
+            f.write(b"%d 0 obj\n" % num + body + b"\nendobj\n")
+
+        f.write(b"%PDF-1.4\n")
+        obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        obj(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+        kids = []
+        for i in range(pages):
+            page_id, content_id = 4 + 2 * i, 5 + 2 * i
+            ops = ["BT /F1 9 Tf 11 TL 40 760 Td"]
+            for line in _page_text_lines(i + 1, words_per_page, rng): ops.append(f"({line}) Tj T*")
+            ops.append("ET")
+            stream = "\n".join(ops).encode("latin-1")
+            obj(content_id, b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+            obj(page_id, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>".encode())
+            kids.append(f"{page_id} 0 R")
+        obj(2, f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>".encode())
+        xref = f.tell()
+        size = max(offsets) + 1
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+        for num in range(1, size): f.write(b"%010d 00000 n \n" % offsets[num])
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref))
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("out", type=Path)
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--words-per-page", type=int, default=300)
+    args = parser.parse_args()
+    make_pdf(args.out, args.pages, args.words_per_page)
@@ -1,20 +1,36 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Request
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterator, Literal, Tuple, Union
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import aiofiles
 import PyPDF2
 import io
 import json
 import asyncio
+import base64
+import collections
+import contextlib
+import contextvars
+import functools
+import time
+import math
+import mmap
+import multiprocessing
+import re
+import socket
+import hashlib
+import random
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ProcessPoolExecutor
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -34,20 +50,257 @@ UPLOAD_DIR.mkdir(exist_ok=True)
 app = FastAPI()
 
 # Gemini Files/Content API endpoints
-GEMINI_BASE_URL = "https://generativelanguage.googleapis.com"
+GEMINI_BASE_URL = os.environ.get('GEMINI_BASE_URL', "https://generativelanguage.googleapis.com").rstrip('/')  # override to point at a local fake
 GEMINI_FILES_UPLOAD_URL = f"{GEMINI_BASE_URL}/upload/v1beta/files"
 GEMINI_FILES_URL = f"{GEMINI_BASE_URL}/v1beta/files"
+GEMINI_GENERATION_CONFIG = {"temperature": 0.2, "maxOutputTokens": 8192, "responseMimeType": "application/json"}  # every generate call, streamed or not
+
+# Shared Gemini HTTP pool and model catalogue cache
+GEMINI_HTTP_POOL_LIMIT = int(os.environ.get('GEMINI_HTTP_POOL_LIMIT', '100'))
+GEMINI_HTTP_POOL_LIMIT_PER_HOST = int(os.environ.get('GEMINI_HTTP_POOL_LIMIT_PER_HOST', '32'))
+GEMINI_HTTP_KEEPALIVE_SECONDS = float(os.environ.get('GEMINI_HTTP_KEEPALIVE_SECONDS', '60'))
+GEMINI_MODELS_CACHE_TTL_SECONDS = float(os.environ.get('GEMINI_MODELS_CACHE_TTL_SECONDS', '600'))
+_http_session = None
+_gemini_models_cache: Dict[str, Any] = {}  # api_key -> (expires_at, models)
+_gemini_pro_model_cache: Dict[Any, Any] = {}  # (api_key, preferred, exclude) -> (expires_at, model)
+_gemini_models_inflight: Dict[str, asyncio.Future] = {}  # api_key -> in-flight models.list fetch
+
+# Gemini context caching for pro chat follow-ups (one cachedContents handle per pro document)
+PRO_CHAT_CACHE_TTL_SECONDS = int(os.environ.get('PRO_CHAT_CACHE_TTL_SECONDS', '3600'))
+PRO_CHAT_CACHE_REFRESH_MARGIN_SECONDS = 120  # recreate handles this close to expiry rather than race it
+PRO_CHAT_CACHE_RETRY_SECONDS = 900  # after a failed create (e.g. below the minimum cacheable size), wait before retrying
+_pro_chat_cache_inflight: Dict[str, asyncio.Future] = {}
+
+# Pro chunked uploads
+PRO_UPLOAD_DEFAULT_CHUNK_BYTES = 5 * 1024 * 1024
+PRO_UPLOAD_MAX_CHUNK_BYTES = 64 * 1024 * 1024  # each chunk body is read into memory
+PRO_UPLOAD_MAX_BYTES = int(os.environ.get('PRO_UPLOAD_MAX_BYTES', str(2 * 1024 ** 3)))  # the temp file is preallocated to size_bytes
+
+# Pro background ingestion (Gemini part uploads)
+PRO_INGEST_UPLOAD_CONCURRENCY = int(os.environ.get('PRO_INGEST_UPLOAD_CONCURRENCY', '3'))
+PRO_INGEST_PART_RETRIES = 3
+PRO_INGEST_RETRY_BASE_SECONDS = 2.0
+PRO_INGEST_POLL_SECONDS = 2.0
+PRO_INGEST_ACTIVE_TIMEOUT_SECONDS = 300
+PRO_PART_EXPIRY_MARGIN_SECONDS = 600  # re-upload parts this close to Gemini's 48h expiry before a request uses them
 
 # Pro scan constraints
 GEMINI_FILE_MAX_PAGES = 1000
 GEMINI_FILE_MAX_SIZE_MB = 45  # Gemini limit is 50MB, use 45MB for safety
 PRO_TOKEN_SAFETY_LIMIT = 1_900_000
-TOKENS_PER_PAGE_ESTIMATE = 1000  # rough heuristic used to trigger batch mode
 BATCH_OVERLAP_PAGES = 50
 BATCH_TARGET_PAGES = 2000
 
+# Measured token counts for pro documents (token-budget batch mode)
+PRO_TOKENIZER = os.environ.get('PRO_TOKENIZER', 'tiktoken')  # tiktoken | approx (chars/4 stand-in, no downloads)
+PDF_PAGE_IMAGE_TOKENS = 258  # Gemini bills every native PDF page as one image on top of its text
+PRO_WINDOW_PAGE_OVERHEAD_TOKENS = 8  # "[GLOBAL PAGE n]" marker per page in a text window
+PRO_WINDOW_PROMPT_RESERVE_TOKENS = 20_000  # instructions + output headroom kept out of each window
+_text_encoders: Dict[str, Any] = {}
+_pro_token_inflight: Dict[str, asyncio.Future] = {}
+_pro_refresh_inflight: Dict[str, asyncio.Future] = {}
+PRO_PART_CONCURRENCY = int(os.environ.get('PRO_PART_CONCURRENCY', '4'))
+PRO_MERGE_FAN_IN = 4  # partial reports combined per merge call
+
+# Text deep-scan batching: pages are packed up to a token budget chosen by `speed`
+DEEP_SCAN_SPEED_TOKEN_BUDGETS = {"thorough": 6000, "balanced": 12000, "fast": 24000}
+DEEP_SCAN_PROVIDER_CONTEXT_TOKENS = {"openai": 128_000, "anthropic": 200_000, "gemini": 1_000_000}
+DEEP_SCAN_MAX_PAGES_PER_BATCH = 40  # bounds the page_results the model has to write back
+DEEP_SCAN_PAGE_OVERHEAD_TOKENS = 30  # "=== PAGE n (w words) ===" banner
+DEEP_SCAN_EMPTY_PAGE_WORDS = 3  # pages under this many words are logged as empty without a model call
+
+# Text deep-scan concurrency (batches in flight per document)
+DEEP_SCAN_DEFAULT_CONCURRENCY = int(os.environ.get('DEEP_SCAN_CONCURRENCY', '1'))
+DEEP_SCAN_MAX_CONCURRENCY = int(os.environ.get('DEEP_SCAN_MAX_CONCURRENCY', '8'))
+
+# PDF parsing runs in a process pool so PyPDF2 never blocks the event loop
+PDF_POOL_WORKERS = int(os.environ.get('PDF_POOL_WORKERS', str(os.cpu_count() or 2)))
+# Never fork: by the time the pool starts, motor and aiohttp threads are running in this process.
+PDF_POOL_START_METHOD = os.environ.get('PDF_POOL_START_METHOD', 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+PDF_EXTRACT_PAGES_PER_TASK = 200
+PDF_SPLIT_SIZE_SAFETY = 0.95  # fraction of the size limit the estimate may fill
+PDF_OBJECT_OVERHEAD_BYTES = 40  # "n 0 obj ... endobj" framing plus the xref row
+PDF_FILE_OVERHEAD_BYTES = 4096  # header, page tree, trailer
+DOCUMENT_PAGES_INSERT_BATCH = 500
+UPLOAD_STREAM_CHUNK_BYTES = int(os.environ.get('UPLOAD_STREAM_CHUNK_BYTES', str(1024 * 1024)))  # /documents/upload copies the body to disk in chunks this size
+
+# List endpoints: keyset pagination over (sort field, id); the next page's cursor is returned in X-Next-Cursor.
+# Defaults match the old unpaginated responses (100 items, 1000 status checks); smaller pages are opt-in via ?limit=.
+LIST_DEFAULT_LIMIT = int(os.environ.get('LIST_DEFAULT_LIMIT', '100'))
+STATUS_LIST_DEFAULT_LIMIT = int(os.environ.get('STATUS_LIST_DEFAULT_LIMIT', '1000'))
+LIST_MAX_LIMIT = int(os.environ.get('LIST_MAX_LIMIT', '1000'))
+LIST_NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# Per collection: the sort fields a listing accepts (first is the default; each has an (field, id) index) and the
+# summary fields it returns. Findings, results, page logs and part metadata are only served by the /{id} routes.
+LISTINGS = {
+    "documents": {"sorts": ("uploaded_at", "filename"), "fields": ("id", "filename", "total_pages", "total_words", "uploaded_at", "status", "error", "ingested_pages")},
+    "analyses": {"sorts": ("analyzed_at",), "fields": ("id", "document_ids", "document_names", "query", "model", "speed", "relevance_mode", "prefilter", "status", "error", "analyzed_at", "page_coverage", "total_findings", "progress")},
+    "pro_documents": {"sorts": ("created_at", "filename"), "fields": ("id", "filename", "total_pages", "size_bytes", "created_at", "status", "error", "ingest")},
+    "pro_analyses": {"sorts": ("created_at",), "fields": ("id", "pro_document_id", "document_name", "query", "mode", "model_used", "batch_mode", "token_batch_mode", "estimated_tokens", "status", "error", "created_at", "total_findings")},
+    "status_checks": {"sorts": ("timestamp",), "fields": ("id", "client_name", "timestamp")},
+}
+
+# Retrieval-based /chat context
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.environ.get('CHAT_CONTEXT_TOKEN_BUDGET', '12500'))  # ~50k characters of page text per turn
+CHAT_CONTEXT_MAX_PAGES = 40
+CHAT_CONTEXT_CACHE_SESSIONS = 256
+CHAT_CONTEXT_CACHE_PAGES = 400  # page texts kept per session across turns
+_chat_context_cache: "collections.OrderedDict[str, Any]" = collections.OrderedDict()  # session_id -> prepared context
+
+# Local BM25 page prefilter for deep scans
+PREFILTER_DEFAULT_TOP_K = 25
+PREFILTER_DEFAULT_CONTEXT_PAGES = 1
+BM25_K1 = 1.5
+BM25_B = 0.75
+PAGE_INDEX_MAX_PAGES = int(os.environ.get('PAGE_INDEX_MAX_PAGES', '50000'))  # pages whose postings a worker keeps in memory
+PAGE_INDEX_IDLE_SECONDS = int(os.environ.get('PAGE_INDEX_IDLE_SECONDS', '1800'))
+
+# Content-addressed cache of per-batch deep-scan results
+BATCH_CACHE_VERSION = 1  # bump when the deep-scan prompt changes so stale results are not replayed
+BATCH_CACHE_TTL_SECONDS = int(os.environ.get('BATCH_CACHE_TTL_SECONDS', str(30 * 24 * 3600)))
+BATCH_CACHE_MAX_ENTRIES = int(os.environ.get('BATCH_CACHE_MAX_ENTRIES', '50000'))
+BATCH_CACHE_EVICT_EVERY = 200  # writes between size-based eviction sweeps
+_batch_cache_writes = 0
+
+# Rubric memoization: in-process LRU in front of the rubric_cache collection
+RUBRIC_CACHE_TTL_SECONDS = int(os.environ.get('RUBRIC_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+RUBRIC_CACHE_LRU_SIZE = 512
+_rubric_lru: "collections.OrderedDict[str, Any]" = collections.OrderedDict()  # key -> (expires_at, rubric)
+_rubric_inflight: Dict[str, asyncio.Future] = {}
+
+# Write-behind persistence of analysis progress
+ANALYSIS_FLUSH_MAX_ITEMS = int(os.environ.get('ANALYSIS_FLUSH_MAX_ITEMS', '200'))
+ANALYSIS_FLUSH_INTERVAL_SECONDS = float(os.environ.get('ANALYSIS_FLUSH_INTERVAL_SECONDS', '2.0'))
+
+# Durable analysis jobs: analyses run as background tasks that checkpoint per batch, hold a lease while running and
+# are resumed by any worker once the lease lapses. SSE clients replay/tail the job's numbered events (Last-Event-ID).
+ANALYSIS_EVENTS_TTL_SECONDS = int(os.environ.get('ANALYSIS_EVENTS_TTL_SECONDS', str(7 * 24 * 3600)))
+ANALYSIS_EVENTS_POLL_SECONDS = float(os.environ.get('ANALYSIS_EVENTS_POLL_SECONDS', '1.0'))  # tailing a job that runs on another worker
+ANALYSIS_LEASE_SECONDS = int(os.environ.get('ANALYSIS_LEASE_SECONDS', '60'))
+ANALYSIS_RESUME_SWEEP_SECONDS = int(os.environ.get('ANALYSIS_RESUME_SWEEP_SECONDS', '30'))
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+_analysis_jobs: Dict[str, Any] = {}  # analysis_id -> AnalysisJob running in this worker
+_analysis_resume_task: Optional[asyncio.Task] = None
+
+# Process-wide LLM quota: token buckets per (API key, model) plus retry/backoff on 429 and 5xx
+LLM_RATE_LIMIT_RPM = int(os.environ.get('LLM_RATE_LIMIT_RPM', '150'))
+LLM_RATE_LIMIT_TPM = int(os.environ.get('LLM_RATE_LIMIT_TPM', '2000000'))
+LLM_RATE_LIMITS = json.loads(os.environ.get('LLM_RATE_LIMITS') or '{}')  # {"gemini-2.5-pro": {"rpm": 150, "tpm": 2000000}}
+LLM_RETRY_MAX_ATTEMPTS = int(os.environ.get('LLM_RETRY_MAX_ATTEMPTS', '5'))
+LLM_RETRY_BASE_SECONDS = 1.0
+LLM_RETRY_MAX_SECONDS = 60.0
+LLM_OUTPUT_TOKEN_RESERVE = 2000  # charged to the TPM bucket on top of the prompt estimate
+LLM_THROTTLE_REPORT_SECONDS = 0.5  # queue waits longer than this are reported to the caller
+LLM_SCHEDULER_CONCURRENCY = int(os.environ.get('LLM_SCHEDULER_CONCURRENCY', '8'))  # batch LLM calls in flight across all analyses
+LLM_GENERATION_MODE = os.environ.get('LLM_GENERATION_MODE', 'stream')  # stream | blocking; stream emits findings while a batch is still generating
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_background_tasks: set = set()
+
 api_router = APIRouter(prefix="/api")
 
+# Metrics: in-process counters and histograms, exposed at /api/metrics in Prometheus text format
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+_analysis_timings: contextvars.ContextVar = contextvars.ContextVar("analysis_timings", default=None)
+_scheduler_lane: contextvars.ContextVar = contextvars.ContextVar("scheduler_lane", default=("default", 0))  # (analysis id, priority)
+
+class MetricsRegistry:
+    """Minimal Prometheus registry: labelled counters and fixed-bucket histograms, rendered as text format 0.0.4."""
+
+    def __init__(self):
+        self.counters: Dict[str, Dict[Any, float]] = collections.defaultdict(dict)
+        self.histograms: Dict[str, Dict[Any, List[float]]] = collections.defaultdict(dict)  # labels -> bucket counts + [sum, count]
+        self.help: Dict[str, str] = {}
+
+    def inc(self, name: str, value: float = 1.0, help: str = "", **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        self.counters[name][key] = self.counters[name].get(key, 0.0) + value
+        if help: self.help.setdefault(name, help)
+
+    def observe(self, name: str, value: float, help: str = "", **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        series = self.histograms[name].get(key)
+        if series is None: series = self.histograms[name][key] = [0.0] * (len(METRICS_LATENCY_BUCKETS) + 2)
+        for i, bound in enumerate(METRICS_LATENCY_BUCKETS):
+            if value <= bound: series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+        if help: self.help.setdefault(name, help)
+
+    @staticmethod
+    def _labels(pairs: Any) -> str:
+        if not pairs: return ""
+        escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+        return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+    def render(self, gauges: Optional[List[Any]] = None) -> str:
+        lines = []
+        for name, series in sorted(self.counters.items()):
+            lines += [f"# HELP {name} {self.help.get(name, name)}", f"# TYPE {name} counter"]
+            lines += [f"{name}{self._labels(k)} {v:g}" for k, v in sorted(series.items())]
+        for name, series in sorted(self.histograms.items()):
+            lines += [f"# HELP {name} {self.help.get(name, name)}", f"# TYPE {name} histogram"]
+            for k, values in sorted(series.items()):
+                for bound, count in zip(METRICS_LATENCY_BUCKETS, values):
+                    lines.append(f"{name}_bucket{self._labels(k + (('le', f'{bound:g}'),))} {count:g}")
+                lines.append(f"{name}_bucket{self._labels(k + (('le', '+Inf'),))} {values[-1]:g}")
+                lines.append(f"{name}_sum{self._labels(k)} {values[-2]:.6f}")
+                lines.append(f"{name}_count{self._labels(k)} {values[-1]:g}")
+        for name, help_text, samples in gauges or []:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            lines += [f"{name}{self._labels(tuple(sorted(labels.items())))} {value:g}" for labels, value in samples]
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+def _observe_stage(stage: str, seconds: float, error: bool = False) -> None:
+    # Feeds the process-wide histogram and, inside an analysis request, that analysis' own stage breakdown.
+    metrics.observe("deepdive_stage_seconds", seconds, help="Wall time per pipeline stage", stage=stage)
+    if error: metrics.inc("deepdive_stage_errors_total", help="Pipeline stages that raised", stage=stage)
+    timings = _analysis_timings.get()
+    if timings is not None:
+        entry = timings["stages"].setdefault(stage, {"seconds": 0.0, "count": 0})
+        entry["seconds"] += seconds
+        entry["count"] += 1
+
+class StageTimer:
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _observe_stage(self.stage, time.perf_counter() - self.started, error=exc_type is not None)
+        return False
+
+def _instrumented(stage: str):
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with StageTimer(stage): return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _start_analysis_timings(endpoint: str, stored: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    # stored: the summary saved on the analysis record, so the background job (and every resumed attempt) keeps
+    # counting from the original request instead of restarting the clock. Wall-clock based for that reason.
+    stored = stored or {}
+    timings = {"endpoint": endpoint, "started": stored.get("started_at") or time.time(), "stages": {k: {"seconds": v["seconds"], "count": v["count"]} for k, v in (stored.get("stages") or {}).items()}, "first_event_seconds": stored.get("first_event_seconds"), "first_finding_seconds": stored.get("first_finding_seconds")}
+    _analysis_timings.set(timings)
+    return timings
+
+def _mark_analysis_timing(timings: Dict[str, Any], key: str) -> bool:
+    # key: first_event_seconds | first_finding_seconds; only the first occurrence counts (returns whether this was it).
+    if timings[key] is not None: return False
+    timings[key] = time.time() - timings["started"]
+    metrics.observe(f"deepdive_{key}", timings[key], help=f"Seconds from request to {key[:-8].replace('_', ' ')}", endpoint=timings["endpoint"])
+    return True
+
+def _analysis_timings_summary(timings: Dict[str, Any]) -> Dict[str, Any]:
+    rnd = lambda v: round(v, 4) if v is not None else None
+    return {"endpoint": timings["endpoint"], "started_at": timings["started"], "total_seconds": rnd(time.time() - timings["started"]), "first_event_seconds": rnd(timings["first_event_seconds"]), "first_finding_seconds": rnd(timings["first_finding_seconds"]), "stages": {k: {"seconds": rnd(v["seconds"]), "count": v["count"]} for k, v in timings["stages"].items()}}
+
 # Define Models (Existing)
 class StatusCheck(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -68,6 +321,12 @@ class AnalyzeRequest(BaseModel):
     page_end: Optional[int] = None    # End page (inclusive)
     relevance_mode: str = "normal"  # normal | strict
     rubric_text: Optional[str] = None  # auto-generated, user-editable rubric
+    concurrency: Optional[int] = None  # batches in flight per document (defaults to DEEP_SCAN_CONCURRENCY)
+    prefilter: Optional[Literal["bm25"]] = None  # bm25: only send top-scoring pages to the model
+    prefilter_top_k: int = PREFILTER_DEFAULT_TOP_K
+    prefilter_context_pages: int = PREFILTER_DEFAULT_CONTEXT_PAGES  # neighbours sent on each side of a hit
+    bypass_cache: bool = False  # force a re-scan instead of replaying cached batch results
+    priority: int = 0  # higher wins scheduler slots first when analyses compete for LLM capacity
 
 class ChatRequest(BaseModel):
     session_id: Optional[str] = None
@@ -84,7 +343,8 @@ class RubricResponse(BaseModel):
 
 class ProUploadInitRequest(BaseModel):
     filename: str
-    size_bytes: int
+    size_bytes: int = Field(gt=0, le=PRO_UPLOAD_MAX_BYTES)
+    chunk_size: Optional[int] = Field(default=None, gt=0, le=PRO_UPLOAD_MAX_CHUNK_BYTES)  # bytes per chunk when chunks are addressed by index
 
 class ProUploadCompleteRequest(BaseModel):
     upload_id: str
@@ -95,6 +355,8 @@ class ProAnalyzeRequest(BaseModel):
     query: str
     gemini_api_key: str
     deep_dive: bool = True
+    concurrency: Optional[int] = None  # part analyses in flight (defaults to PRO_PART_CONCURRENCY)
+    priority: int = 0  # higher wins scheduler slots first when analyses compete for LLM capacity
 
 class ProChatRequest(BaseModel):
     session_id: Optional[str] = None
@@ -106,57 +368,102 @@ class ProChatRequest(BaseModel):
 async def _gemini_request_headers(api_key: str) -> Dict[str, str]:
     return {"x-goog-api-key": api_key}
 
-async def gemini_files_resumable_upload(api_key: str, file_path: Path, display_name: str) -> Dict[str, Any]:
+async def _get_http_session():
+    # One keep-alive connection pool for the lifetime of the app; closed in the shutdown hook.
     import aiohttp
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(limit=GEMINI_HTTP_POOL_LIMIT, limit_per_host=GEMINI_HTTP_POOL_LIMIT_PER_HOST, keepalive_timeout=GEMINI_HTTP_KEEPALIVE_SECONDS)
+        _http_session = aiohttp.ClientSession(connector=connector)
+    return _http_session
+
+@_instrumented("gemini_upload")
+async def gemini_files_resumable_upload(api_key: str, file_path: Path, display_name: str) -> Dict[str, Any]:
     mime_type = "application/pdf"
     size_bytes = file_path.stat().st_size
-    async with aiohttp.ClientSession() as session:
-        start_headers = {
-            **(await _gemini_request_headers(api_key)),
-            "X-Goog-Upload-Protocol": "resumable",
-            "X-Goog-Upload-Command": "start",
-            "X-Goog-Upload-Header-Content-Length": str(size_bytes),
-            "X-Goog-Upload-Header-Content-Type": mime_type,
-            "Content-Type": "application/json",
-        }
-        start_body = {"file": {"display_name": display_name}}
-        async with session.post(GEMINI_FILES_UPLOAD_URL, headers=start_headers, json=start_body) as resp:
-            if resp.status >= 400:
-                raise HTTPException(status_code=500, detail=f"Gemini file upload init failed: {await resp.text()}")
-            upload_url = resp.headers.get("x-goog-upload-url") or resp.headers.get("X-Goog-Upload-URL")
-            if not upload_url:
-                raise HTTPException(status_code=500, detail="Gemini file upload init failed: missing upload URL")
-        
-        upload_headers = {
-            "Content-Length": str(size_bytes),
-            "X-Goog-Upload-Offset": "0",
-            "X-Goog-Upload-Command": "upload, finalize",
-        }
-        with open(file_path, "rb") as f:
-            async with session.post(upload_url, headers=upload_headers, data=f) as resp2:
-                if resp2.status >= 400:
-                    raise HTTPException(status_code=500, detail=f"Gemini file upload finalize failed: {await resp2.text()}")
-                payload = await resp2.json()
+    session = await _get_http_session()
+    start_headers = {
+        **(await _gemini_request_headers(api_key)),
+        "X-Goog-Upload-Protocol": "resumable",
+        "X-Goog-Upload-Command": "start",
+        "X-Goog-Upload-Header-Content-Length": str(size_bytes),
+        "X-Goog-Upload-Header-Content-Type": mime_type,
+        "Content-Type": "application/json",
+    }
+    start_body = {"file": {"display_name": display_name}}
+    async with session.post(GEMINI_FILES_UPLOAD_URL, headers=start_headers, json=start_body) as resp:
+        if resp.status >= 400:
+            raise HTTPException(status_code=500, detail=f"Gemini file upload init failed: {await resp.text()}")
+        upload_url = resp.headers.get("x-goog-upload-url") or resp.headers.get("X-Goog-Upload-URL")
+        if not upload_url:
+            raise HTTPException(status_code=500, detail="Gemini file upload init failed: missing upload URL")
+    
+    upload_headers = {
+        "Content-Length": str(size_bytes),
+        "X-Goog-Upload-Offset": "0",
+        "X-Goog-Upload-Command": "upload, finalize",
+    }
+    with open(file_path, "rb") as f:
+        async with session.post(upload_url, headers=upload_headers, data=f) as resp2:
+            if resp2.status >= 400:
+                raise HTTPException(status_code=500, detail=f"Gemini file upload finalize failed: {await resp2.text()}")
+            payload = await resp2.json()
+    metrics.inc("deepdive_gemini_upload_bytes_total", size_bytes, help="Bytes uploaded to the Gemini Files API")
     return payload.get("file") or payload
 
-async def gemini_files_delete(api_key: str, file_name: str) -> None:
-    import aiohttp
-    async with aiohttp.ClientSession() as session:
-        async with session.delete(f"{GEMINI_FILES_URL}/{file_name}", headers=await _gemini_request_headers(api_key)) as resp:
-            if resp.status >= 400:
-                raise HTTPException(status_code=500, detail=f"Gemini files.delete failed: {await resp.text()}")
+def _gemini_file_url(file_name: str) -> str:
+    # files.create returns names like "files/abc123"; GEMINI_FILES_URL already ends in /files.
+    return f"{GEMINI_FILES_URL}/{(file_name or '').split('/')[-1]}"
 
-async def gemini_models_list(api_key: str) -> List[Dict[str, Any]]:
-    import aiohttp
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{GEMINI_BASE_URL}/v1beta/models", headers=await _gemini_request_headers(api_key)) as resp:
-            data = await resp.json(content_type=None)
-            if resp.status >= 400:
-                raise HTTPException(status_code=500, detail={"message": "models.list failed", "data": data})
-            return data.get('models', [])
+async def gemini_files_get(api_key: str, file_name: str) -> Dict[str, Any]:
+    session = await _get_http_session()
+    async with session.get(_gemini_file_url(file_name), headers=await _gemini_request_headers(api_key)) as resp:
+        data = await resp.json(content_type=None)
+        if resp.status >= 400:
+            raise HTTPException(status_code=500, detail={"message": "files.get failed", "data": data})
+        return data
+
+async def gemini_files_delete(api_key: str, file_name: str) -> None:
+    session = await _get_http_session()
+    async with session.delete(_gemini_file_url(file_name), headers=await _gemini_request_headers(api_key)) as resp:
+        if resp.status >= 400:
+            raise HTTPException(status_code=500, detail=f"Gemini files.delete failed: {await resp.text()}")
+
+async def gemini_models_list(api_key: str, use_cache: bool = True) -> List[Dict[str, Any]]:
+    cached = _gemini_models_cache.get(api_key)
+    if use_cache and cached and cached[0] > time.monotonic(): return cached[1]
+    # Single-flight per key: concurrent misses for one key share a fetch; other keys never wait on it.
+    task = _gemini_models_inflight.get(api_key)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_gemini_models(api_key))
+        _gemini_models_inflight[api_key] = task
+        task.add_done_callback(lambda _: _gemini_models_inflight.pop(api_key, None))
+    return await asyncio.shield(task)
+
+async def _fetch_gemini_models(api_key: str) -> List[Dict[str, Any]]:
+    session = await _get_http_session()
+    async with session.get(f"{GEMINI_BASE_URL}/v1beta/models", headers=await _gemini_request_headers(api_key)) as resp:
+        data = await resp.json(content_type=None)
+        if resp.status >= 400:
+            raise HTTPException(status_code=500, detail={"message": "models.list failed", "data": data})
+        models = data.get('models', [])
+    _gemini_models_cache[api_key] = (time.monotonic() + GEMINI_MODELS_CACHE_TTL_SECONDS, models)
+    return models
+
+def _invalidate_gemini_model_cache(api_key: str) -> None:
+    _gemini_models_cache.pop(api_key, None)
+    for key in [k for k in _gemini_pro_model_cache if k[0] == api_key]: _gemini_pro_model_cache.pop(key, None)
 
 async def gemini_select_pro_model(api_key: str, preferred: str = "gemini-1.5-pro", exclude: Optional[List[str]] = None) -> str:
     exclude = exclude or []
+    cache_key = (api_key, preferred, tuple(sorted(exclude)))
+    cached = _gemini_pro_model_cache.get(cache_key)
+    if cached and cached[0] > time.monotonic(): return cached[1]
+    model = await _resolve_pro_model(api_key, preferred, exclude)
+    _gemini_pro_model_cache[cache_key] = (time.monotonic() + GEMINI_MODELS_CACHE_TTL_SECONDS, model)
+    return model
+
+async def _resolve_pro_model(api_key: str, preferred: str, exclude: List[str]) -> str:
     models = await gemini_models_list(api_key)
     def norm(name: str) -> str: return (name or '').replace('models/', '')
     usable = []
@@ -176,8 +483,278 @@ async def gemini_select_pro_model(api_key: str, preferred: str = "gemini-1.5-pro
     all_names = [norm(m.get('name','')) for m in models]
     raise HTTPException(status_code=500, detail={"message": "No Pro models available", "available_models": all_names[:80]})
 
-async def gemini_generate_content_with_files(api_key: str, model_preferred: str, system_instruction: str, user_text: str, file_uris: List[Dict[str, str]]) -> Dict[str, Any]:
+class LlmRetryableError(Exception):
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[float] = None, data: Any = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.data = data
+
+class RateLimiter:
+    """Process-wide token buckets per (API key, model): one for requests per minute, one for tokens per minute.
+
+    Callers queue FIFO per bucket. A 429 pauses the whole bucket for its Retry-After, so concurrent analyses back
+    off together instead of stampeding the quota. A request larger than the TPM budget waits for a full bucket and
+    drives it negative rather than waiting forever.
+    """
+
+    def __init__(self):
+        self.buckets: Dict[Any, Dict[str, Any]] = {}
+
+    def _bucket(self, api_key: str, model: str) -> Dict[str, Any]:
+        key = (hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12], model)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            limits = LLM_RATE_LIMITS.get(model, {})
+            rpm, tpm = float(limits.get("rpm", LLM_RATE_LIMIT_RPM)), float(limits.get("tpm", LLM_RATE_LIMIT_TPM))
+            bucket = self.buckets[key] = {"key": key, "rpm": rpm, "tpm": tpm, "requests": rpm, "tokens": tpm, "updated": time.monotonic(), "paused_until": 0.0, "lock": asyncio.Lock(), "waiting": 0, "granted": 0, "throttled": 0, "retries": 0, "wait_seconds": 0.0}
+        return bucket
+
+    def _refill(self, bucket: Dict[str, Any], now: float) -> None:
+        elapsed = now - bucket["updated"]
+        bucket["requests"] = min(bucket["rpm"], bucket["requests"] + elapsed * bucket["rpm"] / 60)
+        bucket["tokens"] = min(bucket["tpm"], bucket["tokens"] + elapsed * bucket["tpm"] / 60)
+        bucket["updated"] = now
+
+    async def acquire(self, api_key: str, model: str, tokens: int = 0) -> float:
+        """Waits for one request slot and `tokens` of TPM budget; returns the seconds spent queued."""
+        bucket = self._bucket(api_key, model)
+        started = time.monotonic()
+        bucket["waiting"] += 1
+        try:
+            async with bucket["lock"]:
+                while True:
+                    now = time.monotonic()
+                    self._refill(bucket, now)
+                    need = min(tokens, bucket["tpm"])
+                    wait = max(bucket["paused_until"] - now,
+                               (1 - bucket["requests"]) * 60 / bucket["rpm"] if bucket["requests"] < 1 else 0,
+                               (need - bucket["tokens"]) * 60 / bucket["tpm"] if bucket["tokens"] < need else 0)
+                    if wait <= 0: break
+                    await asyncio.sleep(wait)
+                bucket["requests"] -= 1
+                bucket["tokens"] -= tokens
+                bucket["granted"] += 1
+        finally:
+            bucket["waiting"] -= 1
+        waited = time.monotonic() - started
+        bucket["wait_seconds"] += waited
+        return waited
+
+    def penalize(self, api_key: str, model: str, seconds: float) -> None:
+        bucket = self._bucket(api_key, model)
+        bucket["paused_until"] = max(bucket["paused_until"], time.monotonic() + seconds)
+        bucket["throttled"] += 1
+
+    def note_retry(self, api_key: str, model: str) -> None:
+        self._bucket(api_key, model)["retries"] += 1
+
+    def queue_depth(self, api_key: str, model: str) -> int:
+        return self._bucket(api_key, model)["waiting"]
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [{"key": b["key"][0], "model": b["key"][1], "rpm": b["rpm"], "tpm": b["tpm"], "queue_depth": b["waiting"], "paused_seconds": round(max(0.0, b["paused_until"] - now), 2), "granted": b["granted"], "throttled": b["throttled"], "retries": b["retries"], "wait_seconds": round(b["wait_seconds"], 2)} for b in self.buckets.values()]
+
+rate_limiter = RateLimiter()
+
+class BatchScheduler:
+    """Process-wide pool of slots for LLM batch calls, shared fairly by every running analysis.
+
+    Each analysis is a lane (set via _scheduler_lane). A freed slot goes to the highest-priority lane with a batch
+    waiting; among equals, to the lane with the fewest batches running, then the one served longest ago. A 5-page
+    request therefore gets the next free slot even while a 3,000-page scan keeps the pool saturated. Batches within
+    a lane keep their FIFO order.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self.running = 0
+        self.granted = 0
+        self.lanes: Dict[str, Dict[str, Any]] = {}
+
+    def _lane(self, lane_id: str, priority: int) -> Dict[str, Any]:
+        lane = self.lanes.get(lane_id)
+        if lane is None: lane = self.lanes[lane_id] = {"id": lane_id, "priority": priority, "running": 0, "waiters": collections.deque(), "served_at": 0.0, "granted": 0, "wait_seconds": 0.0}
+        return lane
+
+    def _dispatch(self) -> None:
+        while self.running < self.capacity:
+            ready = [lane for lane in self.lanes.values() if lane["waiters"]]
+            if not ready: return
+            lane = min(ready, key=lambda l: (-l["priority"], l["running"], l["served_at"]))
+            future, _ = lane["waiters"].popleft()
+            if future.done(): continue
+            future.set_result(None)
+            self.running += 1
+            self.granted += 1
+            lane["running"] += 1
+            lane["granted"] += 1
+            lane["served_at"] = time.monotonic()
+
+    def _release(self, lane: Dict[str, Any]) -> None:
+        self.running -= 1
+        lane["running"] -= 1
+        if not lane["running"] and not lane["waiters"]: self.lanes.pop(lane["id"], None)
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Holds one pool slot for the body; the wait is recorded as the analysis' scheduler_wait stage."""
+        lane = self._lane(*_scheduler_lane.get())
+        future = asyncio.get_running_loop().create_future()
+        started = time.monotonic()
+        lane["waiters"].append((future, started))
+        self._dispatch()
+        try: await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled(): self._release(lane)
+            else:
+                lane["waiters"] = collections.deque(w for w in lane["waiters"] if w[0] is not future)
+                if not lane["running"] and not lane["waiters"]: self.lanes.pop(lane["id"], None)
+            raise
+        waited = time.monotonic() - started
+        lane["wait_seconds"] += waited
+        _observe_stage("scheduler_wait", waited)
+        try: yield waited
+        finally: self._release(lane)
+
+    def queue_depth(self) -> int:
+        return sum(len(lane["waiters"]) for lane in self.lanes.values())
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        lanes = [{"analysis_id": l["id"], "priority": l["priority"], "running": l["running"], "queued": len(l["waiters"]), "oldest_wait_seconds": round(now - l["waiters"][0][1], 2) if l["waiters"] else 0.0, "granted": l["granted"], "wait_seconds": round(l["wait_seconds"], 2)} for l in self.lanes.values()]
+        return {"capacity": self.capacity, "running": self.running, "queued": self.queue_depth(), "granted": self.granted, "lanes": sorted(lanes, key=lambda l: (-l["priority"], l["analysis_id"]))}
+
+batch_scheduler = BatchScheduler(LLM_SCHEDULER_CONCURRENCY)
+
+_RETRYABLE_LLM_ERROR_RE = re.compile(r"\b(429|500|502|503|504)\b|rate.?limit|resource.?exhausted|quota|overloaded|unavailable|timed? ?out", re.I)
+_RETRY_DELAY_RE = re.compile(r"retry(?:Delay)?[\"\':\s]+(?:in\s+)?(\d+(?:\.\d+)?)s", re.I)
+
+def _retry_after_seconds(value: Any) -> Optional[float]:
+    # Retry-After is either delta-seconds or an HTTP date.
+    if value is None: return None
+    try: return max(0.0, float(value))
+    except (TypeError, ValueError): pass
+    try: return max(0.0, (parsedate_to_datetime(str(value)) - datetime.now(timezone.utc)).total_seconds())
+    except Exception: return None
+
+def _gemini_retry_after(resp: Any, data: Any) -> Optional[float]:
+    # Prefer the Retry-After header; Gemini quota errors otherwise carry RetryInfo.retryDelay ("12s") in the body.
+    header = _retry_after_seconds(resp.headers.get("Retry-After"))
+    if header is not None: return header
+    delay = _RETRY_DELAY_RE.search(json.dumps(data) if not isinstance(data, str) else data)
+    return float(delay.group(1)) if delay else None
+
+def _llm_error_status(e: Exception) -> Optional[int]:
+    # The upstream HTTP status when the exception carries one: aiohttp ClientResponseError.status, SDK errors'
+    # status_code, or the status / Gemini error.code inside one of our HTTPException details (whose own 500 is ours).
+    if not isinstance(e, HTTPException):
+        for attr in ("status", "status_code"):
+            value = getattr(e, attr, None)
+            if isinstance(value, int): return value
+        return None
+    detail = e.detail
+    while isinstance(detail, dict):
+        if isinstance(detail.get("status"), int): return detail["status"]
+        error = (detail.get("data") or {}).get("error") if isinstance(detail.get("data"), dict) else detail.get("error")
+        if isinstance(error, dict) and isinstance(error.get("code"), int): return error["code"]
+        detail = detail.get("fallback_error")
+    return None
+
+def _classify_llm_error(e: Exception) -> Any:
+    """Returns (retryable, status, retry_after_seconds) for an exception raised by an LLM call.
+
+    Decided by exception type or HTTP status wherever one is available; the message text is only consulted for
+    exceptions that carry neither (e.g. provider SDK errors flattened to a string).
+    """
     import aiohttp
+    if isinstance(e, LlmRetryableError): return True, e.status, e.retry_after
+    if isinstance(e, (asyncio.TimeoutError, ConnectionError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)): return True, None, None
+    text = str(getattr(e, 'detail', None) or e)
+    status = _llm_error_status(e)
+    if status is not None:
+        delay = _RETRY_DELAY_RE.search(text)
+        return status in (408, 429) or status >= 500, status, float(delay.group(1)) if delay else None
+    if not _RETRYABLE_LLM_ERROR_RE.search(text): return False, None, None
+    status = next((int(m) for m in re.findall(r"\b(429|500|502|503|504)\b", text)), None)
+    delay = _RETRY_DELAY_RE.search(text)
+    return True, status, float(delay.group(1)) if delay else None
+
+def _observe_llm_call(model: str, seconds: float, outcome: str) -> None:
+    metrics.observe("deepdive_llm_call_seconds", seconds, help="Latency of individual LLM calls (one per attempt)", model=model, outcome=outcome)
+    _observe_stage("llm_call", seconds, error=outcome == "error")
+
+async def _call_llm_with_retry(api_key: str, model: str, tokens: int, call, on_event=None, scheduled: bool = False):
+    # call: zero-argument coroutine factory (a fresh attempt each time). on_event receives "throttled" events so
+    # callers can tell queueing/backoff apart from failure; the last retryable error is re-raised when attempts run out.
+    # scheduled: each attempt holds a batch_scheduler slot, taken after the rate-limit wait and released before any
+    # backoff, so a throttled key or model never sits on global capacity while it sleeps.
+    tokens = int(tokens) + LLM_OUTPUT_TOKEN_RESERVE
+    metrics.inc("deepdive_llm_estimated_tokens_total", tokens, help="Prompt + reserved output tokens charged to the rate limiter", model=model)
+    for attempt in range(1, LLM_RETRY_MAX_ATTEMPTS + 1):
+        waited = await rate_limiter.acquire(api_key, model, tokens)
+        _observe_stage("llm_queue_wait", waited)
+        if waited >= LLM_THROTTLE_REPORT_SECONDS and on_event: on_event({"type": "throttled", "reason": "rate_limit", "model": model, "waited_seconds": round(waited, 2), "queue_depth": rate_limiter.queue_depth(api_key, model)})
+        started = time.perf_counter()
+        try:
+            if scheduled:
+                async with batch_scheduler.slot():
+                    started = time.perf_counter()
+                    result = await call()
+            else: result = await call()
+            _observe_llm_call(model, time.perf_counter() - started, "ok")
+            return result
+        except Exception as e:
+            retryable, status, retry_after = _classify_llm_error(e)
+            _observe_llm_call(model, time.perf_counter() - started, "retry" if retryable and attempt < LLM_RETRY_MAX_ATTEMPTS else "error")
+            if not retryable or attempt == LLM_RETRY_MAX_ATTEMPTS: raise
+            # Equal jitter: never less than half the exponential step, so retries cannot collapse to zero.
+            step = min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+            delay = retry_after if retry_after is not None else step / 2 + random.uniform(0, step / 2)
+            rate_limiter.note_retry(api_key, model)
+            if on_event: on_event({"type": "throttled", "reason": f"http_{status}" if status else "transient_error", "model": model, "attempt": attempt, "retry_in_seconds": round(delay, 2), "queue_depth": rate_limiter.queue_depth(api_key, model)})
+            # A 429 pauses the shared bucket (everyone waits in acquire); other errors only delay this caller.
+            if status == 429: rate_limiter.penalize(api_key, model, delay)
+            else: await asyncio.sleep(delay)
+
+async def _gemini_stream_generate(api_key: str, model: str, payload: Dict[str, Any], on_text) -> Any:
+    # streamGenerateContent?alt=sse: each event carries the next slice of the candidate text, handed to on_text as it
+    # arrives. Returns (status, data) with the slices folded back into one generateContent-shaped response; quota and
+    # server errors, before or during the stream, raise LlmRetryableError.
+    session = await _get_http_session()
+    async with session.post(f"{GEMINI_BASE_URL}/v1beta/models/{model}:streamGenerateContent", params={"alt": "sse"}, headers={**(await _gemini_request_headers(api_key)), "Content-Type": "application/json"}, json=payload) as resp:
+        if resp.status >= 400:
+            data = await resp.json(content_type=None)
+            if resp.status == 429 or resp.status >= 500:
+                raise LlmRetryableError(f"Gemini streamGenerateContent {resp.status}", resp.status, _gemini_retry_after(resp, data), data)
+            return resp.status, data
+        texts, last = [], {}
+        async for line in resp.content:
+            if not line.startswith(b"data:"): continue
+            chunk = json.loads(line[5:])
+            if chunk.get("error"):
+                code = int(chunk["error"].get("code") or 500)
+                if code == 429 or code >= 500: raise LlmRetryableError(f"Gemini streamGenerateContent {code} mid-stream", code, _gemini_retry_after(resp, chunk), chunk)
+                return code, chunk
+            text = _extract_candidate_json_text(chunk)
+            if text:
+                texts.append(text)
+                on_text(text)
+            last = chunk
+    candidate = (last.get("candidates") or [{}])[0]
+    return resp.status, {**last, "candidates": [{**candidate, "content": {**candidate.get("content", {}), "parts": [{"text": "".join(texts)}]}}]}
+
+@_instrumented("gemini_generate")
+async def gemini_generate_content_with_files(api_key: str, model_preferred: str, system_instruction: str, user_text: str, file_uris: List[Dict[str, str]], estimated_tokens: int = 0, on_event=None, on_item=None, item_key: str = "findings", scheduled: bool = False) -> Dict[str, Any]:
+    # scheduled: every attempt takes a batch_scheduler slot (see _call_llm_with_retry); analyses set it, chat does not.
+    # on_item: called with each element of the response's top-level `item_key` array as soon as it has streamed in
+    # (LLM_GENERATION_MODE=stream); the returned response is the complete one either way. If an attempt fails after
+    # streaming some elements, on_event gets {"type": "stream_reset"} before the retry streams its own.
+    on_reset = (lambda count: on_event({"type": "stream_reset", "retracted": count})) if on_event else None
+    next_attempt = _item_streamer(item_key, on_item, on_reset) if on_item and LLM_GENERATION_MODE == "stream" else None
+
     def _payload(model: str) -> Dict[str, Any]:
         parts = []
         for fu in file_uris:
@@ -185,7 +762,7 @@ async def gemini_generate_content_with_files(api_key: str, model_preferred: str,
         parts.append({"text": user_text})
         payload = {
             "contents": [{"role": "user", "parts": parts}],
-            "generationConfig": {"temperature": 0.2, "maxOutputTokens": 8192, "responseMimeType": "application/json"},
+            "generationConfig": dict(GEMINI_GENERATION_CONFIG),
         }
         if system_instruction and system_instruction.strip():
             payload["systemInstruction"] = {"parts": [{"text": system_instruction}]}
@@ -194,24 +771,107 @@ async def gemini_generate_content_with_files(api_key: str, model_preferred: str,
     async def _call(model: str) -> Dict[str, Any]:
         url = f"{GEMINI_BASE_URL}/v1beta/models/{model}:generateContent"
         payload = _payload(model)
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers={**(await _gemini_request_headers(api_key)), "Content-Type": "application/json"}, json=payload) as resp:
-                data = await resp.json(content_type=None)
-                if resp.status >= 400: return {"__error__": True, "status": resp.status, "data": data}
-                return data
+        if next_attempt:
+            status, data = await _gemini_stream_generate(api_key, model, payload, next_attempt()[1])
+            return {"__error__": True, "status": status, "data": data} if status >= 400 else data
+        session = await _get_http_session()
+        async with session.post(url, headers={**(await _gemini_request_headers(api_key)), "Content-Type": "application/json"}, json=payload) as resp:
+            data = await resp.json(content_type=None)
+            if resp.status == 429 or resp.status >= 500:
+                raise LlmRetryableError(f"Gemini generateContent {resp.status}", resp.status, _gemini_retry_after(resp, data), data)
+            if resp.status >= 400: return {"__error__": True, "status": resp.status, "data": data}
+            return data
+
+    async def _call_with_retry(model: str) -> Dict[str, Any]:
+        # Quota and server errors are retried on the same model; only hard errors fall through to the fallback model.
+        tokens = estimated_tokens or (len(user_text) + len(system_instruction or "")) // 4
+        try: return await _call_llm_with_retry(api_key, model, tokens, lambda: _call(model), on_event, scheduled)
+        except LlmRetryableError as e: return {"__error__": True, "status": e.status, "data": e.data}
 
     initial_model = await gemini_select_pro_model(api_key, preferred=model_preferred)
-    first = await _call(initial_model)
+    first = await _call_with_retry(initial_model)
     if first.get("__error__"):
+        # A 404 means the cached catalogue is stale (model retired); refresh before picking the fallback.
+        if first.get("status") == 404: _invalidate_gemini_model_cache(api_key)
         fallback_model = await gemini_select_pro_model(api_key, preferred=model_preferred, exclude=[initial_model])
-        second = await _call(fallback_model)
+        second = await _call_with_retry(fallback_model)
         if second.get("__error__"):
             raise HTTPException(status_code=500, detail={"preferred_error": first, "fallback_error": second})
         second["__model_used__"] = fallback_model
+        _record_gemini_usage(second, fallback_model)
         return second
     first["__model_used__"] = initial_model
+    _record_gemini_usage(first, initial_model)
     return first
 
+async def gemini_count_tokens(api_key: str, file_uris: List[Dict[str, str]], text: Optional[str] = None) -> int:
+    model = await gemini_select_pro_model(api_key)
+    parts = [{"fileData": {"mimeType": fu["mime_type"], "fileUri": fu["file_uri"]}} for fu in file_uris]
+    if text: parts.append({"text": text})
+    session = await _get_http_session()
+    async with session.post(f"{GEMINI_BASE_URL}/v1beta/models/{model}:countTokens", headers={**(await _gemini_request_headers(api_key)), "Content-Type": "application/json"}, json={"contents": [{"role": "user", "parts": parts}]}) as resp:
+        data = await resp.json(content_type=None)
+        if resp.status >= 400:
+            raise HTTPException(status_code=500, detail={"message": "countTokens failed", "data": data})
+        return int(data.get("totalTokens") or 0)
+
+async def gemini_cached_contents_create(api_key: str, model: str, system_instruction: str, file_uris: List[Dict[str, str]], ttl_seconds: int, display_name: str = "") -> Dict[str, Any]:
+    payload = {
+        "model": f"models/{model}",
+        "displayName": display_name[:128],
+        "contents": [{"role": "user", "parts": [{"fileData": {"mimeType": fu["mime_type"], "fileUri": fu["file_uri"]}} for fu in file_uris]}],
+        "ttl": f"{int(ttl_seconds)}s",
+    }
+    if system_instruction and system_instruction.strip(): payload["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+    session = await _get_http_session()
+    async with session.post(f"{GEMINI_BASE_URL}/v1beta/cachedContents", headers={**(await _gemini_request_headers(api_key)), "Content-Type": "application/json"}, json=payload) as resp:
+        data = await resp.json(content_type=None)
+        if resp.status >= 400:
+            raise HTTPException(status_code=500, detail={"message": "cachedContents.create failed", "status": resp.status, "data": data})
+        return data
+
+async def gemini_cached_contents_delete(api_key: str, name: str) -> None:
+    session = await _get_http_session()
+    async with session.delete(f"{GEMINI_BASE_URL}/v1beta/{name}", headers=await _gemini_request_headers(api_key)) as resp:
+        if resp.status >= 400 and resp.status != 404:
+            raise HTTPException(status_code=500, detail=f"Gemini cachedContents.delete failed: {await resp.text()}")
+
+@_instrumented("gemini_generate_cached")
+async def gemini_generate_content_cached(api_key: str, cache: Dict[str, Any], user_text: str, estimated_tokens: int = 0) -> Dict[str, Any]:
+    # The cached handle already carries the files and system instruction, and pins the model it was created for.
+    payload = {
+        "cachedContent": cache["name"],
+        "contents": [{"role": "user", "parts": [{"text": user_text}]}],
+        "generationConfig": dict(GEMINI_GENERATION_CONFIG),
+    }
+
+    async def _call() -> Dict[str, Any]:
+        session = await _get_http_session()
+        async with session.post(f"{GEMINI_BASE_URL}/v1beta/models/{cache['model']}:generateContent", headers={**(await _gemini_request_headers(api_key)), "Content-Type": "application/json"}, json=payload) as resp:
+            data = await resp.json(content_type=None)
+            if resp.status == 429 or resp.status >= 500:
+                raise LlmRetryableError(f"Gemini generateContent {resp.status}", resp.status, _gemini_retry_after(resp, data), data)
+            if resp.status >= 400:
+                raise HTTPException(status_code=500, detail={"message": "generateContent with cachedContent failed", "status": resp.status, "data": data})
+            data["__model_used__"] = cache["model"]
+            _record_gemini_usage(data, cache["model"])
+            return data
+    return await _call_llm_with_retry(api_key, cache["model"], estimated_tokens or len(user_text) // 4, _call)
+
+def _parse_rfc3339(value: Optional[str]) -> Optional[datetime]:
+    # Gemini timestamps carry up to nanosecond precision ("2024-01-01T00:00:00.123456789Z"); fromisoformat takes micro.
+    if not value: return None
+    m = re.match(r"^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(\.\d+)?(Z|[+-]\d{2}:\d{2})?$", value)
+    if not m: return None
+    frac = (m.group(2) or "")[:7]
+    tz = m.group(3) or "Z"
+    return datetime.fromisoformat(m.group(1) + frac + ("+00:00" if tz == "Z" else tz))
+
+def _record_gemini_usage(resp: Dict[str, Any], model: Optional[str]) -> None:
+    usage = resp.get("usageMetadata") or {}
+    for kind, field in (("prompt", "promptTokenCount"), ("cached", "cachedContentTokenCount"), ("output", "candidatesTokenCount")):
+        if usage.get(field): metrics.inc("deepdive_llm_tokens_total", usage[field], help="Tokens reported by Gemini usageMetadata", model=model or "unknown", kind=kind)
+
 def _extract_candidate_json_text(resp: Dict[str, Any]) -> str:
     try:
         parts = resp.get("candidates", [])[0].get("content", {}).get("parts", [])
@@ -223,50 +883,201 @@ def _safe_parse_json(text: str) -> Any:
     try: return json.loads(text)
     except Exception: return {"raw": text}
 
-def _estimate_tokens_for_pages(total_pages: int) -> int:
-    return int(total_pages * TOKENS_PER_PAGE_ESTIMATE)
+class StreamingJsonArrayParser:
+    """Pulls complete elements of one top-level array (e.g. "page_results") out of a JSON object as it streams in.
+
+    feed() scans only the new text and returns the elements it completed. Elements are parsed one at a time, so a
+    truncated or malformed tail costs only the element it lands in; result() falls back to the elements seen.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.text = ""
+        self.items: List[Any] = []
+        self._pos, self._depth = 0, 0
+        self._in_string, self._escape = False, False
+        self._string_start, self._last_string, self._current_key = 0, None, None
+        self._array_depth, self._item_start = 0, -1  # _array_depth > 0 while inside the target array
+
+    def feed(self, chunk: str) -> List[Any]:
+        self.text += chunk
+        text, new = self.text, []
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape: self._escape = False
+                elif c == '\\': self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1: self._last_string = text[self._string_start + 1:i]
+            elif c == '"' and self._depth:
+                self._in_string, self._string_start = True, i
+            elif c in '{[':
+                if self._depth == 0 and c != '{': continue  # text before the object (e.g. a ``` fence)
+                if self._array_depth and self._depth == self._array_depth and c == '{': self._item_start = i
+                if self._depth == 1 and c == '[' and self._current_key == self.key and not self.items: self._array_depth = 2
+                self._depth += 1
+            elif c in '}]':
+                if self._depth == 0: continue
+                self._depth -= 1
+                if self._array_depth and self._depth == self._array_depth and self._item_start >= 0:
+                    try:
+                        new.append(json.loads(text[self._item_start:i + 1]))
+                        self.items.append(new[-1])
+                    except ValueError: pass  # one malformed element; keep scanning for the next
+                    self._item_start = -1
+                elif self._array_depth and self._depth < self._array_depth: self._array_depth = 0
+            elif self._depth == 1:
+                if c == ':': self._current_key = self._last_string
+                elif c == ',': self._current_key = None
+        self._pos = len(text)
+        return new
+
+    def result(self) -> Optional[Dict[str, Any]]:
+        # The whole object when it parses; otherwise the elements salvaged so far, flagged as truncated.
+        start, end = self.text.find('{'), self.text.rfind('}') + 1
+        if 0 <= start < end:
+            try:
+                parsed = json.loads(self.text[start:end])
+                if isinstance(parsed, dict): return parsed
+            except ValueError: pass
+        return {self.key: list(self.items), "truncated": True} if self.items else None
+
+def _parse_model_json(text: str, key: str) -> Any:
+    # Like _safe_parse_json, but a response cut off or garbled part-way keeps the complete `key` elements before it.
+    parser = StreamingJsonArrayParser(key)
+    parser.feed(text)
+    return parser.result() or {"raw": text}
+
+def _item_streamer(key: str, on_item, on_reset=None):
+    # Returns a per-attempt factory: each LLM attempt gets a fresh parser. A retry may produce different elements, so
+    # when an earlier (failed) attempt already delivered some, on_reset(count) retracts them and the new attempt's
+    # elements are all delivered: what was streamed always matches the response that is finally returned.
+    delivered = [0]
+
+    def _attempt():
+        if delivered[0] and on_reset: on_reset(delivered[0])
+        delivered[0] = 0
+        parser = StreamingJsonArrayParser(key)
+
+        def _feed(chunk: str) -> None:
+            for item in parser.feed(chunk):
+                delivered[0] += 1
+                on_item(item)
+        return parser, _feed
+    return _attempt
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    if _pdf_pool is None: _pdf_pool = ProcessPoolExecutor(max_workers=PDF_POOL_WORKERS, mp_context=multiprocessing.get_context(PDF_POOL_START_METHOD))
+    return _pdf_pool
+
+async def _run_in_pdf_pool(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_get_pdf_pool(), fn, *args)
+
+def _spawn_background(coro) -> asyncio.Task:
+    # Keep a strong reference so fire-and-forget tasks are not garbage collected mid-flight.
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+@contextlib.contextmanager
+def _open_pdf_reader(file_path: Union[str, Path]):
+    # PyPDF2 reads through a read-only memory map: pages fault in from the page cache on demand instead of the
+    # whole file being copied into the worker's heap (which is what PdfReader(path) does).
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        yield PyPDF2.PdfReader(mm, strict=False)
 
 def _pdf_page_count(file_path: Path) -> int:
-    with open(file_path, "rb") as f:
-        reader = PyPDF2.PdfReader(f, strict=False)
-        return len(reader.pages)
+    with _open_pdf_reader(file_path) as reader: return len(reader.pages)
+
+_SPLIT_SKIP_KEYS = frozenset(["/Parent", "/P", "/Dest", "/B"])  # back-references that would drag in other pages
+
+def _pdf_object_bytes(obj: Any) -> int:
+    buf = io.BytesIO()
+    obj.write_to_stream(buf, None)
+    return buf.tell() + PDF_OBJECT_OVERHEAD_BYTES
+
+def _page_object_sizes(page: Any, size_cache: Dict[Any, int]) -> Dict[Any, int]:
+    # Serialized size of every indirect object reachable from the page; shared objects are cached across pages.
+    from PyPDF2.generic import IndirectObject, DictionaryObject, ArrayObject
+    page_key = (page.indirect_reference.idnum, page.indirect_reference.generation)
+    if page_key not in size_cache: size_cache[page_key] = _pdf_object_bytes(page)
+    sizes = {page_key: size_cache[page_key]}
+    stack = [v for k, v in page.items() if k not in _SPLIT_SKIP_KEYS]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, IndirectObject):
+            key = (item.idnum, item.generation)
+            if key in sizes: continue
+            item = item.get_object()
+            if isinstance(item, DictionaryObject) and item.get("/Type") == "/Page": continue
+            if key not in size_cache: size_cache[key] = _pdf_object_bytes(item)
+            sizes[key] = size_cache[key]
+        if isinstance(item, DictionaryObject): stack.extend(v for k, v in item.items() if k not in _SPLIT_SKIP_KEYS)
+        elif isinstance(item, ArrayObject): stack.extend(item)
+    return sizes
+
+def _plan_pdf_split_reader(reader: Any, max_pages_per_file: int, max_size_mb: int) -> List[List[int]]:
+    # Single pass over the pages: a part closes when the next page would push it past the page or estimated size budget.
+    budget = max_size_mb * 1024 * 1024 * PDF_SPLIT_SIZE_SAFETY - PDF_FILE_OVERHEAD_BYTES
+    total = len(reader.pages)
+    size_cache: Dict[Any, int] = {}
+    ranges: List[List[int]] = []
+    part_keys: set = set()
+    part_bytes = 0
+    start = 1
+    for page_num in range(1, total + 1):
+        sizes = _page_object_sizes(reader.pages[page_num - 1], size_cache)
+        added = sum(sz for k, sz in sizes.items() if k not in part_keys)
+        if page_num > start and (page_num - start >= max_pages_per_file or part_bytes + added > budget):
+            ranges.append([start, page_num - 1])
+            start, part_keys, part_bytes = page_num, set(), 0
+            added = sum(sizes.values())
+        part_keys.update(sizes)
+        part_bytes += added
+    if total: ranges.append([start, total])
+    return ranges
+
+def _write_pdf_part_reader(reader: Any, out_dir: Path, part_idx: int, start: int, end: int, max_size_mb: int) -> List[Dict[str, Any]]:
+    # Pages are 1-indexed and inclusive. Returns one part, or more if the size estimate undershot and the range had to be halved.
+    out_dir.mkdir(parents=True, exist_ok=True)
+    writer = PyPDF2.PdfWriter()
+    for p in range(start - 1, end): writer.add_page(reader.pages[p])
+    out_path = out_dir / f"part_{part_idx}_{start}-{end}.pdf"
+    with open(out_path, "wb") as out_f: writer.write(out_f)
+    actual_size = out_path.stat().st_size
+    if actual_size > max_size_mb * 1024 * 1024 and end > start:
+        out_path.unlink()
+        mid = (start + end) // 2
+        return _write_pdf_part_reader(reader, out_dir, part_idx, start, mid, max_size_mb) + _write_pdf_part_reader(reader, out_dir, part_idx, mid + 1, end, max_size_mb)
+    return [{"part_index": part_idx, "start_page": start, "end_page": end, "local_path": str(out_path), "size_bytes": actual_size}]
+
+def _plan_pdf_split(src_path: Path, max_pages_per_file: int = GEMINI_FILE_MAX_PAGES, max_size_mb: int = GEMINI_FILE_MAX_SIZE_MB) -> List[List[int]]:
+    with _open_pdf_reader(src_path) as reader: return _plan_pdf_split_reader(reader, max_pages_per_file, max_size_mb)
+
+def _write_pdf_part(src_path: Path, out_dir: Path, part_idx: int, start: int, end: int, max_size_mb: int = GEMINI_FILE_MAX_SIZE_MB) -> List[Dict[str, Any]]:
+    with _open_pdf_reader(src_path) as reader: return _write_pdf_part_reader(reader, out_dir, part_idx, start, end, max_size_mb)
+
+def _renumber_parts(parts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [{**p, "part_index": i} for i, p in enumerate(parts, 1)]
 
 def _split_pdf_by_pages(src_path: Path, out_dir: Path, max_pages_per_file: int = GEMINI_FILE_MAX_PAGES, max_size_mb: int = GEMINI_FILE_MAX_SIZE_MB) -> List[Dict[str, Any]]:
-    out_dir.mkdir(parents=True, exist_ok=True)
-    max_size_bytes = max_size_mb * 1024 * 1024
-    with open(src_path, "rb") as f:
-        reader = PyPDF2.PdfReader(f, strict=False)
-        total = len(reader.pages)
+    # Sequential variant: one reader serves both the sizing pass and every part write.
+    with _open_pdf_reader(src_path) as reader:
         parts = []
-        part_idx = 0
-        start = 1
-        while start <= total:
-            writer = PyPDF2.PdfWriter()
-            current_page = start
-            while current_page <= total and (current_page - start + 1) <= max_pages_per_file:
-                writer.add_page(reader.pages[current_page - 1])
-                if len(writer.pages) % 50 == 0 or current_page == total:
-                    buffer = io.BytesIO()
-                    writer.write(buffer)
-                    current_size = buffer.tell()
-                    if current_size >= max_size_bytes and len(writer.pages) > 1:
-                        if current_page > start:
-                            current_page -= 1
-                            writer = PyPDF2.PdfWriter()
-                            for p in range(start - 1, current_page): writer.add_page(reader.pages[p])
-                        break
-                current_page += 1
-            end = current_page if current_page <= total else total
-            if len(writer.pages) == 0:
-                writer.add_page(reader.pages[start - 1])
-                end = start
-            part_idx += 1
-            out_path = out_dir / f"part_{part_idx}_{start}-{end}.pdf"
-            with open(out_path, "wb") as out_f: writer.write(out_f)
-            actual_size = out_path.stat().st_size
-            parts.append({"part_index": part_idx, "start_page": start, "end_page": end, "local_path": str(out_path), "size_bytes": actual_size})
-            start = end + 1
-    return parts
+        for idx, (start, end) in enumerate(_plan_pdf_split_reader(reader, max_pages_per_file, max_size_mb), 1):
+            parts.extend(_write_pdf_part_reader(reader, out_dir, idx, start, end, max_size_mb))
+    return _renumber_parts(parts)
+
+@_instrumented("pdf_split")
+async def split_pdf_by_pages_parallel(src_path: Path, out_dir: Path, max_pages_per_file: int = GEMINI_FILE_MAX_PAGES, max_size_mb: int = GEMINI_FILE_MAX_SIZE_MB) -> List[Dict[str, Any]]:
+    # Plan once, then write the independent parts concurrently in the PDF process pool (each worker re-opens the source).
+    if PDF_POOL_WORKERS <= 1: return await _run_in_pdf_pool(_split_pdf_by_pages, src_path, out_dir, max_pages_per_file, max_size_mb)
+    ranges = await _run_in_pdf_pool(_plan_pdf_split, src_path, max_pages_per_file, max_size_mb)
+    written = await asyncio.gather(*[_run_in_pdf_pool(_write_pdf_part, src_path, out_dir, idx, start, end, max_size_mb) for idx, (start, end) in enumerate(ranges, 1)])
+    return _renumber_parts([p for part in written for p in part])
 
 def _extract_gemini_error_message(obj: Any) -> str:
     try:
@@ -282,18 +1093,211 @@ def _extract_gemini_error_message(obj: Any) -> str:
 def _build_file_uri_parts(parts: List[Dict[str, Any]]) -> List[Dict[str, str]]:
     return [{"mime_type": "application/pdf", "file_uri": p["gemini_file_uri"]} for p in parts]
 
-def extract_pdf_pages(pdf_content: bytes) -> List[dict]:
+def _extract_pdf_page_range(file_path: str, start: int, end: int) -> List[dict]:
+    # Runs inside a pool worker: pages are 1-indexed, inclusive on both ends.
     pages = []
-    try:
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_content))
-        for page_num, page in enumerate(pdf_reader.pages, 1):
-            text = page.extract_text() or ""
+    with _open_pdf_reader(file_path) as pdf_reader:
+        for page_num in range(start, end + 1):
+            text = pdf_reader.pages[page_num - 1].extract_text() or ""
             pages.append({"page_number": page_num, "text": text, "word_count": len(text.split()), "char_count": len(text)})
+    return pages
+
+def _approx_token_count(text: str) -> int:
+    # Stand-in tokenizer: ~4 characters per token for English prose. Deterministic and dependency-free.
+    return (len(text) + 3) // 4
+
+def _text_token_counter(tokenizer: str):
+    # Returns (resolved_name, count_fn). tiktoken needs its BPE file on first use, so offline hosts fall back to approx.
+    if tokenizer == "tiktoken":
+        enc = _text_encoders.get("tiktoken")
+        if enc is None:
+            try:
+                import tiktoken
+                enc = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                logging.warning(f"tiktoken unavailable, using approximate token counts: {e}")
+                enc = False
+            _text_encoders["tiktoken"] = enc
+        if enc: return "tiktoken", lambda text: len(enc.encode(text, disallowed_special=()))
+    return "approx", _approx_token_count
+
+def _extract_pdf_page_tokens(file_path: str, start: int, end: int, tokenizer: str) -> List[dict]:
+    count = _text_token_counter(tokenizer)[1]
+    pages = _extract_pdf_page_range(file_path, start, end)
+    for p in pages: p["tokens"] = count(p["text"])
+    return pages
+
+async def iter_pdf_page_chunks(file_path: Path, tokenizer: Optional[str] = None) -> AsyncIterator[List[dict]]:
+    """Yields extracted pages in page order, PDF_EXTRACT_PAGES_PER_TASK at a time.
+
+    At most PDF_POOL_WORKERS ranges are in flight, so memory stays bounded by the window rather than the page count.
+    """
+    total = await _run_in_pdf_pool(_pdf_page_count, file_path)
+    ranges = [(s, min(s + PDF_EXTRACT_PAGES_PER_TASK - 1, total)) for s in range(1, total + 1, PDF_EXTRACT_PAGES_PER_TASK)]
+    metrics.inc("deepdive_pdf_pages_extracted_total", total, help="Pages run through text extraction")
+    submit = (lambda s, e: _run_in_pdf_pool(_extract_pdf_page_tokens, str(file_path), s, e, tokenizer)) if tokenizer else (lambda s, e: _run_in_pdf_pool(_extract_pdf_page_range, str(file_path), s, e))
+    pending: collections.deque = collections.deque()
+    try:
+        for s, e in ranges:
+            pending.append(asyncio.ensure_future(submit(s, e)))
+            if len(pending) >= max(1, PDF_POOL_WORKERS): yield await pending.popleft()
+        while pending: yield await pending.popleft()
+    finally:
+        for task in pending: task.cancel()
+
+@_instrumented("pdf_extract")
+async def extract_pdf_pages(file_path: Path, tokenizer: Optional[str] = None) -> List[dict]:
+    try: return [p async for chunk in iter_pdf_page_chunks(file_path, tokenizer) for p in chunk]
     except Exception as e:
         logging.error(f"PDF extraction error: {e}")
-    return pages
+        return []
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset("a an and are as at be by for from has have in is it its of on or that the this to was were will with any all".split())
+
+def _tokenize(text: str) -> List[str]:
+    tokens = []
+    for t in _TOKEN_RE.findall((text or "").lower()):
+        if len(t) < 2 or t in _STOPWORDS: continue
+        if len(t) > 3 and t.endswith('s') and not t.endswith('ss'): t = t[:-1]
+        tokens.append(t)
+    return tokens
+
+class PageIndex:
+    """In-process BM25 index over document pages, bounded so worker memory does not grow with the corpus.
+
+    Each document's postings and statistics are kept separately (a document is always scored on its own), built on
+    first use from document_pages and held in an LRU of at most PAGE_INDEX_MAX_PAGES pages; documents unused for
+    PAGE_INDEX_IDLE_SECONDS are dropped. Evicting one document therefore never changes another's scores.
+    """
+
+    def __init__(self, max_pages: int = 0, idle_seconds: float = 0):
+        self.max_pages, self.idle_seconds = max_pages, idle_seconds
+        self.docs: "collections.OrderedDict[str, Dict[str, Any]]" = collections.OrderedDict()  # doc_id -> postings/df/lengths
+        self.total_pages = 0
+
+    @staticmethod
+    def new_entry() -> Dict[str, Any]:
+        # term -> page_number -> tf, term -> pages containing it, page_number -> token count
+        return {"postings": {}, "df": {}, "lengths": {}, "total_length": 0, "used_at": time.monotonic()}
+
+    @staticmethod
+    def add_to_entry(entry: Dict[str, Any], pages: List[dict]) -> None:
+        for p in pages:
+            counts = collections.Counter(_tokenize(p.get('text', '')))
+            entry["lengths"][p['page_number']] = sum(counts.values())
+            entry["total_length"] += entry["lengths"][p['page_number']]
+            for term, tf in counts.items():
+                entry["postings"].setdefault(term, {})[p['page_number']] = tf
+                entry["df"][term] = entry["df"].get(term, 0) + 1
+
+    def has_document(self, doc_id: str) -> bool:
+        return doc_id in self.docs
+
+    def put(self, doc_id: str, entry: Dict[str, Any]) -> None:
+        self.remove_document(doc_id)
+        entry["used_at"] = time.monotonic()
+        self.docs[doc_id] = entry
+        self.total_pages += len(entry["lengths"])
+        self.evict_idle()
+        # Least recently used first; the document just added stays even if it alone exceeds the bound.
+        while self.max_pages and self.total_pages > self.max_pages and len(self.docs) > 1: self.remove_document(next(iter(self.docs)))
+
+    def add_document(self, doc_id: str, pages: List[dict]) -> None:
+        entry = self.new_entry()
+        self.add_to_entry(entry, pages)
+        self.put(doc_id, entry)
+
+    def remove_document(self, doc_id: str) -> None:
+        entry = self.docs.pop(doc_id, None)
+        if entry is not None: self.total_pages -= len(entry["lengths"])
+
+    def evict_idle(self) -> None:
+        if not self.idle_seconds: return
+        cutoff = time.monotonic() - self.idle_seconds
+        for doc_id in [d for d, e in self.docs.items() if e["used_at"] < cutoff]: self.remove_document(doc_id)
+
+    def score(self, doc_id: str, query: str, page_start: Optional[int] = None, page_end: Optional[int] = None) -> Dict[int, float]:
+        entry = self.docs.get(doc_id)
+        if entry is None: return {}
+        entry["used_at"] = time.monotonic()
+        self.docs.move_to_end(doc_id)
+        lengths, pages = entry["lengths"], len(entry["lengths"])
+        avg_length = (entry["total_length"] / pages) if pages else 0
+        scores: Dict[int, float] = {}
+        for term in set(_tokenize(query)):
+            df = entry["df"].get(term, 0)
+            if not df: continue
+            idf = math.log(1 + (pages - df + 0.5) / (df + 0.5))
+            for page_num, tf in entry["postings"][term].items():
+                if (page_start and page_num < page_start) or (page_end and page_num > page_end): continue
+                norm = 1 - BM25_B + BM25_B * (lengths.get(page_num, 0) / avg_length if avg_length else 0)
+                scores[page_num] = scores.get(page_num, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+        return scores
+
+page_index = PageIndex(PAGE_INDEX_MAX_PAGES, PAGE_INDEX_IDLE_SECONDS)
+
+def _select_prefilter_pages(scores: Dict[int, float], candidates: List[int], top_k: int, context_pages: int) -> List[int]:
+    # Top-k hits plus `context_pages` neighbours on each side, restricted to the pages actually in range.
+    available = set(candidates)
+    hits = sorted(scores, key=lambda n: (-scores[n], n))[:max(0, top_k)]
+    selected = set()
+    for n in hits:
+        for m in range(n - context_pages, n + context_pages + 1):
+            if m in available: selected.add(m)
+    return sorted(selected)
+
+def _rubric_cache_key(query: str, model: str) -> str:
+    normalized = " ".join((query or "").lower().split())
+    return hashlib.sha256(f"{model}\x00{normalized}".encode("utf-8")).hexdigest()
+
+def _rubric_lru_get(key: str) -> Optional[dict]:
+    entry = _rubric_lru.get(key)
+    if not entry: return None
+    if entry[0] <= time.monotonic():
+        _rubric_lru.pop(key, None)
+        return None
+    _rubric_lru.move_to_end(key)
+    return entry[1]
+
+def _rubric_lru_put(key: str, rubric: dict) -> None:
+    _rubric_lru[key] = (time.monotonic() + RUBRIC_CACHE_TTL_SECONDS, rubric)
+    _rubric_lru.move_to_end(key)
+    while len(_rubric_lru) > RUBRIC_CACHE_LRU_SIZE: _rubric_lru.popitem(last=False)
 
 async def generate_query_rubric(query: str, model: str = "gemini-2.5-flash") -> dict:
+    key = _rubric_cache_key(query, model)
+    cached = _rubric_lru_get(key)
+    if cached: return dict(cached)
+    # Single-flight: a burst of identical queries shares one Mongo lookup / LLM call.
+    task = _rubric_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_load_query_rubric(key, query, model))
+        _rubric_inflight[key] = task
+        task.add_done_callback(lambda _: _rubric_inflight.pop(key, None))
+    return dict(await asyncio.shield(task))
+
+async def _load_query_rubric(key: str, query: str, model: str) -> dict:
+    try:
+        stored = await db.rubric_cache.find_one({"key": key}, {"_id": 0, "rubric_text": 1, "rubric_json": 1, "created_at": 1})
+    except Exception as e:
+        logging.warning(f"Rubric cache read failed: {e}")
+        stored = None
+    if stored:
+        created_at = stored.get("created_at")
+        if created_at and created_at.tzinfo is None: created_at = created_at.replace(tzinfo=timezone.utc)
+        if created_at and (datetime.now(timezone.utc) - created_at).total_seconds() < RUBRIC_CACHE_TTL_SECONDS:
+            rubric = {"rubric_text": stored.get("rubric_text", ""), "rubric_json": stored.get("rubric_json"), "error": None}
+            _rubric_lru_put(key, rubric)
+            return rubric
+    rubric = await _generate_query_rubric_uncached(query, model)
+    if not rubric.get("error"):
+        _rubric_lru_put(key, rubric)
+        try: await db.rubric_cache.update_one({"key": key}, {"$set": {"model": model, "query": query, "rubric_text": rubric["rubric_text"], "rubric_json": rubric["rubric_json"], "created_at": datetime.now(timezone.utc)}}, upsert=True)
+        except Exception as e: logging.warning(f"Rubric cache write failed: {e}")
+    return rubric
+
+async def _generate_query_rubric_uncached(query: str, model: str = "gemini-2.5-flash") -> dict:
     from emergentintegrations.llm.chat import LlmChat, UserMessage
     # api_key = os.environ.get('EMERGENT_LLM_KEY')
     api_key = os.environ.get('GOOGLE_API_KEY_ASSISTANT')
@@ -306,13 +1310,15 @@ async def generate_query_rubric(query: str, model: str = "gemini-2.5-flash") ->
         "claude-sonnet-4.5": ("anthropic", "claude-sonnet-4-20250514"),
     }
     provider, model_name = model_map.get(model, ("gemini", "gemini-2.5-flash"))
-    chat = LlmChat(
-        api_key=api_key,
-        session_id=f"rubric-{uuid.uuid4()}",
-        system_message="""You convert a user's natural-language search request into a GENERAL-PURPOSE relevance rubric.
+    def _send():
+        chat = LlmChat(
+            api_key=api_key,
+            session_id=f"rubric-{uuid.uuid4()}",
+            system_message="""You convert a user's natural-language search request into a GENERAL-PURPOSE relevance rubric.
 Return STRICT JSON: { "rubric_text": "...", "rubric_json": {...} }"""
-    ).with_model(provider, model_name)
-    resp = await chat.send_message(UserMessage(text=f"User query:\n{query}"))
+        ).with_model(provider, model_name)
+        return chat.send_message(UserMessage(text=f"User query:\n{query}"))
+    resp = await _call_llm_with_retry(api_key, model_name, len(query) // 4 + 200, _send)
     json_start = resp.find('{')
     json_end = resp.rfind('}') + 1
     if json_start < 0 or json_end <= json_start: return {"rubric_text": "", "rubric_json": None, "error": "Could not parse rubric JSON"}
@@ -320,7 +1326,92 @@ Return STRICT JSON: { "rubric_text": "...", "rubric_json": {...} }"""
     except Exception: return {"rubric_text": "", "rubric_json": None, "error": "Could not decode rubric JSON"}
     return {"rubric_text": data.get("rubric_text", ""), "rubric_json": data.get("rubric_json"), "error": None}
 
-async def deep_analyze_stream(pages: List[dict], query: str, doc_name: str, model: str = "gemini-2.5-flash", speed: str = "balanced", rubric_text: Optional[str] = None, relevance_mode: str = "normal"):
+def _batch_cache_key(pages_text: str, query: str, rubric_text: Optional[str], relevance_mode: str, model: str) -> str:
+    h = hashlib.sha256()
+    for part in (str(BATCH_CACHE_VERSION), model, relevance_mode, query, rubric_text or "", pages_text):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+async def _batch_cache_get(key: str) -> Optional[dict]:
+    try:
+        entry = await db.batch_result_cache.find_one_and_update({"key": key}, {"$set": {"last_hit_at": datetime.now(timezone.utc)}, "$inc": {"hits": 1}}, {"_id": 0, "result": 1})
+        return entry.get("result") if entry else None
+    except Exception as e:
+        logging.warning(f"Batch cache read failed: {e}")
+        return None
+
+async def _batch_cache_put(key: str, result: dict) -> None:
+    global _batch_cache_writes
+    now = datetime.now(timezone.utc)
+    try:
+        # created_at/last_hit_at are BSON dates (not ISO strings) so the TTL index can expire them.
+        await db.batch_result_cache.update_one({"key": key}, {"$set": {"result": result, "created_at": now, "last_hit_at": now}, "$setOnInsert": {"hits": 0}}, upsert=True)
+    except Exception as e:
+        logging.warning(f"Batch cache write failed: {e}")
+        return
+    _batch_cache_writes += 1
+    if _batch_cache_writes % BATCH_CACHE_EVICT_EVERY == 0: _spawn_background(_evict_batch_cache())
+
+async def _evict_batch_cache() -> None:
+    # Age-based expiry is handled by the TTL index; this trims the least recently used entries over the size cap.
+    excess = await db.batch_result_cache.estimated_document_count() - BATCH_CACHE_MAX_ENTRIES
+    if excess <= 0: return
+    stale = await db.batch_result_cache.find({}, {"_id": 1}).sort("last_hit_at", 1).limit(excess).to_list(excess)
+    await db.batch_result_cache.delete_many({"_id": {"$in": [e["_id"] for e in stale]}})
+
+async def _aiter_pages(pages: Union[List[dict], AsyncIterator[dict]]) -> AsyncIterator[dict]:
+    if isinstance(pages, list):
+        for p in pages: yield p
+    else:
+        async for p in pages: yield p
+
+def _is_empty_page(page: dict) -> bool:
+    return (page.get('word_count') or 0) < DEEP_SCAN_EMPTY_PAGE_WORDS
+
+def _estimate_page_tokens(page: dict) -> int:
+    char_count = page.get('char_count')
+    if char_count is None: char_count = len(page.get('text') or "")
+    return (char_count + 3) // 4 + DEEP_SCAN_PAGE_OVERHEAD_TOKENS
+
+def _deep_scan_token_budget(provider: str, speed: str) -> int:
+    # Never plan more than half the model's context for page text; the rest is prompt and output.
+    budget = DEEP_SCAN_SPEED_TOKEN_BUDGETS.get(speed, DEEP_SCAN_SPEED_TOKEN_BUDGETS["balanced"])
+    return min(budget, DEEP_SCAN_PROVIDER_CONTEXT_TOKENS.get(provider, 128_000) // 2)
+
+def _plan_token_batches(page_stats: List[dict], budget: int, max_pages: int = DEEP_SCAN_MAX_PAGES_PER_BATCH) -> List[int]:
+    # Returns batch sizes (in pages) over page_stats in order. Empty pages ride along without counting against the
+    # budget; a batch closes when the next non-empty page would overflow `budget` or `max_pages`. A single page
+    # over budget still gets a batch of its own.
+    sizes, size, tokens, filled = [], 0, 0, 0
+    for p in page_stats:
+        if _is_empty_page(p):
+            size += 1
+            continue
+        page_tokens = _estimate_page_tokens(p)
+        if filled and (tokens + page_tokens > budget or filled >= max_pages):
+            sizes.append(size)
+            size, tokens, filled = 0, 0, 0
+        size += 1
+        tokens += page_tokens
+        filled += 1
+    if size: sizes.append(size)
+    return sizes
+
+async def _batch_pages(pages: Union[List[dict], AsyncIterator[dict]], sizes: List[int]) -> AsyncIterator[List[dict]]:
+    batch, sizes = [], iter(sizes)
+    target = next(sizes, None)
+    async for p in _aiter_pages(pages):
+        batch.append(p)
+        if len(batch) == target:
+            yield batch
+            batch, target = [], next(sizes, None)
+    if batch: yield batch
+
+async def deep_analyze_stream(pages: Union[List[dict], AsyncIterator[dict]], query: str, doc_name: str, model: str = "gemini-2.5-flash", speed: str = "balanced", rubric_text: Optional[str] = None, relevance_mode: str = "normal", concurrency: int = 1, total_pages: Optional[int] = None, use_cache: bool = True, page_stats: Optional[List[dict]] = None, start_batch: int = 0):
+    # page_stats: [{"page_number", "word_count", "char_count"}] for the pages about to be streamed, used to plan
+    # token-budgeted batches up front. Defaults to `pages` itself when a list is passed.
+    # start_batch: batches 1..start_batch were completed by an earlier run (checkpoint) and are skipped without a call.
     from emergentintegrations.llm.chat import LlmChat, UserMessage
     # api_key = os.environ.get('EMERGENT_LLM_KEY')
     api_key = os.environ.get('GOOGLE_API_KEY_DEEP_DIVE')
@@ -335,68 +1426,325 @@ async def deep_analyze_stream(pages: List[dict], query: str, doc_name: str, mode
         "claude-sonnet-4.5": ("anthropic", "claude-sonnet-4-20250514"),
     }
     provider, model_name = model_map.get(model, ("gemini", "gemini-2.5-flash"))
-    speed_settings = {"thorough": 10, "balanced": 20, "fast": 30}
-    batch_size = speed_settings.get(speed, 20)
+    if page_stats is None:
+        if not isinstance(pages, list): pages = [p async for p in _aiter_pages(pages)]
+        page_stats = pages
+    token_budget = _deep_scan_token_budget(provider, speed)
+    batch_sizes = _plan_token_batches(page_stats, token_budget)
+    concurrency = max(1, min(int(concurrency or 1), DEEP_SCAN_MAX_CONCURRENCY))
+    if total_pages is None: total_pages = len(page_stats)
     all_findings = []
     page_analysis_log = []
-    total_batches = (len(pages) + batch_size - 1) // batch_size
-    for batch_idx, batch_start in enumerate(range(0, len(pages), batch_size)):
-        batch_pages = pages[batch_start:batch_start + batch_size]
-        batch_num = batch_idx + 1
+    total_batches = max(1, len(batch_sizes))
+    cache_stats = {"hits": 0, "misses": 0}
+    scan_stats = {"empty_pages": 0}
+
+    async def _scan_batch(batch_num: int, batch_pages: List[dict], emit) -> List[dict]:
+        # Emits the batch's events as they happen (page results and findings stream in while the model is still
+        # writing) and returns its page_log; the caller drains batches in page order.
         start_page = batch_pages[0]['page_number']
         end_page = batch_pages[-1]['page_number']
-        yield {"type": "progress", "batch": batch_num, "total_batches": total_batches, "pages": f"{start_page}-{end_page}", "total_pages": len(pages), "percent": round((batch_num / total_batches) * 100), "status": f"Reading pages {start_page}-{end_page} of {len(pages)}...", "model": model, "relevance_mode": relevance_mode}
+        page_log, seen_pages, accepted = [], set(), []
+        empty_pages = [p for p in batch_pages if _is_empty_page(p)]
+        batch_pages = [p for p in batch_pages if not _is_empty_page(p)]
+        for p in empty_pages: page_log.append({"page_number": p['page_number'], "status": "empty", "summary": "No extractable text (not sent to the model)", "document": doc_name})
+        scan_stats["empty_pages"] += len(empty_pages)
+        if not batch_pages: return page_log
+
+        def _on_page(page_result: Any) -> None:
+            # Only the first copy of each page counts (the final parse repeats what already streamed in).
+            if not isinstance(page_result, dict) or page_result.get('page_number') in seen_pages: return
+            page_num = page_result.get('page_number')
+            seen_pages.add(page_num)
+            accepted.append(page_result)
+            status = page_result.get('status', 'no_match')
+            normalized_status = ('found' if status in ['match', 'possible', 'found'] else 'empty' if status == 'empty' else 'no_match')
+            page_log.append({"page_number": page_num, "status": normalized_status, "summary": page_result.get('page_summary', ''), "document": doc_name})
+            emit({"type": "page_result", "batch": batch_num, **page_log[-1]})
+            for finding in page_result.get('findings') or []:
+                if isinstance(finding, dict) and finding.get('text'):
+                    new_finding = {"page_number": page_num, "document": doc_name, "text": finding.get('text'), "relevance": finding.get('relevance', ''), "confidence": finding.get('confidence', 'medium'), "match_type": 'possible' if status == 'possible' else 'match'}
+                    emit({"type": "finding", "batch": batch_num, "finding": new_finding})
+
         try:
-            chat = LlmChat(
-                api_key=api_key,
-                session_id=f"deep-scan-{uuid.uuid4()}",
-                system_message=f"""You are a meticulous document analyst. RELEVANCE RUBRIC: {rubric_text or 'Derive from query'}. Return STRICT JSON: {{ "page_results": [{{ "page_number": int, "status": "match"|"possible"|"no_match"|"empty", "findings": [{{ "text": "quote", "relevance": "why", "confidence": "high"|"medium"|"low" }}], "page_summary": "..." }}], "batch_thinking": "..." }}"""
-            ).with_model(provider, model_name)
             pages_text = ""
             for p in batch_pages: pages_text += f"\n\n{'='*50}\nPAGE {p['page_number']} ({p['word_count']} words)\n{'='*50}\n{p['text']}"
-            user_message = UserMessage(text=f"DOCUMENT: {doc_name}\nSEARCH QUERY: {query}\nRELEVANCE_MODE: {relevance_mode}\nPAGES:\n{pages_text}")
-            response = await chat.send_message(user_message)
-            try:
-                json_start = response.find('{')
-                json_end = response.rfind('}') + 1
-                if json_start >= 0 and json_end > json_start:
-                    result = json.loads(response[json_start:json_end])
-                    if result.get('batch_thinking'): yield {"type": "thinking", "pages": f"{start_page}-{end_page}", "thought": result.get('batch_thinking')}
-                    for page_result in result.get('page_results', []):
-                        page_num = page_result.get('page_number')
-                        status = page_result.get('status', 'no_match')
-                        normalized_status = ('found' if status in ['match', 'possible', 'found'] else 'empty' if status == 'empty' else 'no_match')
-                        page_analysis_log.append({"page_number": page_num, "status": normalized_status, "summary": page_result.get('page_summary', ''), "document": doc_name})
-                        for finding in page_result.get('findings', []):
-                            if finding.get('text'):
-                                new_finding = {"page_number": page_num, "document": doc_name, "text": finding.get('text'), "relevance": finding.get('relevance', ''), "confidence": finding.get('confidence', 'medium'), "match_type": 'possible' if status == 'possible' else 'match'}
-                                all_findings.append(new_finding)
-                                yield {"type": "finding", "finding": new_finding}
-            except json.JSONDecodeError:
-                 for p in batch_pages: page_analysis_log.append({"page_number": p['page_number'], "status": "analyzed", "summary": "Processed", "document": doc_name})
+            cache_key = _batch_cache_key(pages_text, query, rubric_text, relevance_mode, f"{provider}/{model_name}")
+            result = await _batch_cache_get(cache_key) if use_cache else None
+            cached = result is not None
+            if cached: cache_stats["hits"] += 1
+            else:
+                cache_stats["misses"] += 1
+                user_text = f"DOCUMENT: {doc_name}\nSEARCH QUERY: {query}\nRELEVANCE_MODE: {relevance_mode}\nPAGES:\n{pages_text}"
+                system_message = f"""You are a meticulous document analyst. RELEVANCE RUBRIC: {rubric_text or 'Derive from query'}. Return STRICT JSON: {{ "page_results": [{{ "page_number": int, "status": "match"|"possible"|"no_match"|"empty", "findings": [{{ "text": "quote", "relevance": "why", "confidence": "high"|"medium"|"low" }}], "page_summary": "..." }}], "batch_thinking": "..." }}"""
+
+                def _attempt_parser():
+                    if seen_pages:
+                        # Retry after an attempt that failed part-way: retract what it streamed, so the client, the
+                        # saved analysis and the cache all end up with this attempt's pages only.
+                        seen_pages.clear()
+                        accepted.clear()
+                        del page_log[len(empty_pages):]
+                        emit({"type": "batch_reset", "batch": batch_num, "pages": f"{start_page}-{end_page}"})
+                    parser = StreamingJsonArrayParser("page_results")
+
+                    def _feed(chunk: str) -> None:
+                        for item in parser.feed(chunk): _on_page(item)
+                    return parser, _feed
+
+                if provider == "gemini" and LLM_GENERATION_MODE == "stream":
+                    # LlmChat only returns whole responses, so streamed Gemini scans go to the REST API directly.
+                    payload = {"contents": [{"role": "user", "parts": [{"text": user_text}]}], "systemInstruction": {"parts": [{"text": system_message}]}, "generationConfig": dict(GEMINI_GENERATION_CONFIG)}
+
+                    async def _send():
+                        parser, feed = _attempt_parser()
+                        status, data = await _gemini_stream_generate(api_key, model_name, payload, feed)
+                        if status >= 400: raise HTTPException(status_code=500, detail={"message": f"Gemini streamGenerateContent failed: {_extract_gemini_error_message(data)}", "status": status, "data": data})
+                        _record_gemini_usage(data, model_name)
+                        return parser
+                else:
+                    async def _send():
+                        chat = LlmChat(api_key=api_key, session_id=f"deep-scan-{uuid.uuid4()}", system_message=system_message).with_model(provider, model_name)
+                        parser, feed = _attempt_parser()
+                        feed(await chat.send_message(UserMessage(text=user_text)))
+                        return parser
+                parser = await _call_llm_with_retry(api_key, model_name, (len(pages_text) + len(rubric_text or "")) // 4, _send, on_event=lambda ev: emit({**ev, "batch": batch_num, "pages": f"{start_page}-{end_page}"}), scheduled=True)
+                result = parser.result()
+            if result is not None:
+                for page_result in result.get('page_results') or []: _on_page(page_result)
+                if result.get('batch_thinking'): emit({"type": "thinking", "pages": f"{start_page}-{end_page}", "thought": result.get('batch_thinking')})
+                # Cache the pages exactly as they were emitted (and persisted), not the raw response.
+                if not cached and not result.get('truncated'): await _batch_cache_put(cache_key, {**result, "page_results": list(accepted)})
+            if result is None or result.get('truncated'):
+                # Unparseable or cut-off response: the pages it did cover stand, the rest are logged as processed.
+                for p in batch_pages:
+                    if p['page_number'] not in seen_pages: page_log.append({"page_number": p['page_number'], "status": "analyzed", "summary": "Processed", "document": doc_name})
         except Exception as e:
-            yield {"type": "error", "message": str(e), "batch": batch_num}
-            continue
-    yield {"type": "complete", "findings": all_findings, "page_log": page_analysis_log, "total_pages": len(pages), "pages_analyzed": len(page_analysis_log)}
-
-async def chat_with_docs(pages: List[dict], message: str, history: List[dict]) -> str:
+            emit({"type": "error", "message": str(e), "batch": batch_num, "retryable": _classify_llm_error(e)[0]})
+        return page_log
+
+    async def _run_batch(batch_num: int, batch_pages: List[dict], queue: asyncio.Queue) -> List[dict]:
+        try: return await _scan_batch(batch_num, batch_pages, queue.put_nowait)
+        finally: queue.put_nowait(None)
+
+    # Sliding window: at most `concurrency` batches are in flight ahead of the consumer, and results are drained in page order.
+    batch_iter = _batch_pages(pages, batch_sizes)
+    pending = collections.deque()
+    scheduled = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < concurrency:
+                try: next_pages = await batch_iter.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                scheduled += 1
+                if scheduled <= start_batch: continue
+                queue = asyncio.Queue()
+                pending.append((scheduled, next_pages, queue, asyncio.create_task(_run_batch(scheduled, next_pages, queue))))
+            if not pending: break
+            batch_num, batch_pages, queue, task = pending.popleft()
+            start_page = batch_pages[0]['page_number']
+            end_page = batch_pages[-1]['page_number']
+            yield {"type": "progress", "batch": batch_num, "total_batches": total_batches, "pages": f"{start_page}-{end_page}", "total_pages": total_pages, "percent": round((batch_num / total_batches) * 100), "status": f"Reading pages {start_page}-{end_page} of {total_pages}...", "model": model, "relevance_mode": relevance_mode, "concurrency": concurrency, "token_budget": token_budget}
+            # The head batch's events are relayed live; batches behind it buffer in their queues until it completes.
+            batch_mark = len(all_findings)
+            while (event := await queue.get()) is not None:
+                if event['type'] == 'finding': all_findings.append(event['finding'])
+                elif event['type'] == 'batch_reset': del all_findings[batch_mark:]
+                yield event
+            page_log = await task
+            page_analysis_log.extend(page_log)
+            yield {"type": "batch_complete", "batch": batch_num, "pages": f"{start_page}-{end_page}", "page_log": page_log}
+    finally:
+        for _, _, _, task in pending: task.cancel()
+    yield {"type": "complete", "findings": all_findings, "page_log": page_analysis_log, "total_pages": total_pages, "pages_analyzed": len(page_analysis_log), "empty_pages": scan_stats["empty_pages"], "total_batches": total_batches, "cache": cache_stats}
+
+async def chat_with_docs(context: str, message: str, history: List[dict]) -> str:
     from emergentintegrations.llm.chat import LlmChat, UserMessage
     # api_key = os.environ.get('EMERGENT_LLM_KEY')
     api_key = os.environ.get('GOOGLE_API_KEY_ASSISTANT')
     if not api_key: raise HTTPException(status_code=500, detail="EMERGENT_LLM_KEY not configured")
-    doc_text = ""
-    for p in pages: doc_text += f"\n[PAGE {p['page_number']}]\n{p['text']}\n"
     history_text = "\n".join([f"{m['role'].upper()}: {m['content']}" for m in history[-10:]])
-    chat = LlmChat(
-        api_key=api_key,
-        session_id=f"chat-{uuid.uuid4()}",
-        system_message=f"You are analyzing these documents:\n{doc_text[:50000]}\nPrevious conversation:\n{history_text}"
-    ).with_model("gemini", "gemini-2.5-flash")
-    return await chat.send_message(UserMessage(text=message))
+
+    def _send():
+        chat = LlmChat(
+            api_key=api_key,
+            session_id=f"chat-{uuid.uuid4()}",
+            system_message=f"You are analyzing these document pages, retrieved for the current question. Cite pages as [document p.N] and only cite pages shown here:\n{context}\nPrevious conversation:\n{history_text}"
+        ).with_model("gemini", "gemini-2.5-flash")
+        return chat.send_message(UserMessage(text=message))
+    return await _call_llm_with_retry(api_key, "gemini-2.5-flash", (len(context) + len(history_text) + len(message)) // 4, _send)
+
+def _select_chat_pages(ranked: List[Any], page_tokens: Dict[Any, int], budget: int, max_pages: int = CHAT_CONTEXT_MAX_PAGES) -> List[Any]:
+    # ranked: [(doc_id, page_number)] best first. Takes pages while they fit the budget, skipping any that would
+    # overflow so smaller relevant pages further down can still be used. The first page is always taken.
+    selected, used = [], 0
+    for key in ranked:
+        tokens = page_tokens.get(key, 0)
+        if selected and used + tokens > budget: continue
+        selected.append(key)
+        used += tokens
+        if len(selected) >= max_pages or used >= budget: break
+    return selected
+
+async def _chat_context(session_id: str, docs: List[dict], query: str) -> Dict[str, Any]:
+    # Per-session cache of page stats and page texts: each turn only scores the shared BM25 index and fetches the
+    # pages it has not already loaded. An unchanged selection reuses the previous context string verbatim.
+    doc_ids = tuple(d['id'] for d in docs)
+    entry = _chat_context_cache.get(session_id)
+    if entry is None or entry["doc_ids"] != doc_ids:
+        entry = {"doc_ids": doc_ids, "page_tokens": {}, "order": [], "pages": collections.OrderedDict(), "selection": None, "context": ""}
+        for doc in docs:
+            for p in await _document_page_stats(doc):
+                entry["page_tokens"][(doc['id'], p['page_number'])] = _estimate_page_tokens(p)
+                entry["order"].append((doc['id'], p['page_number']))
+        _chat_context_cache[session_id] = entry
+    _chat_context_cache.move_to_end(session_id)
+    while len(_chat_context_cache) > CHAT_CONTEXT_CACHE_SESSIONS: _chat_context_cache.popitem(last=False)
+
+    scored = []
+    for doc in docs:
+        index_key = await _ensure_page_index(doc)
+        scored.extend(((doc['id'], n), score) for n, score in page_index.score(index_key, query).items())
+    scored.sort(key=lambda item: -item[1])
+    # Nothing matched (e.g. "summarise this"): fall back to reading from the start of each document.
+    ranked = [key for key, _ in scored] or entry["order"]
+    if scored:
+        # Spare budget goes to the neighbours of hits, best hit first, so clauses that straddle a page break survive.
+        hits = set(ranked)
+        ranked += list(dict.fromkeys((d, n + delta) for d, n in ranked[:CHAT_CONTEXT_MAX_PAGES] for delta in (-1, 1) if (d, n + delta) in entry["page_tokens"] and (d, n + delta) not in hits))
+    position = {key: i for i, key in enumerate(entry["order"])}
+    selection = sorted(_select_chat_pages(ranked, entry["page_tokens"], CHAT_CONTEXT_TOKEN_BUDGET), key=lambda key: position.get(key, 0))
+    if selection != entry["selection"]:
+        names = {d['id']: d['filename'] for d in docs}
+        for doc in docs:
+            missing = [n for d, n in selection if d == doc['id'] and (d, n) not in entry["pages"]]
+            if missing:
+                async for p in _iter_document_pages(doc, page_numbers=missing): entry["pages"][(doc['id'], p['page_number'])] = p['text']
+        for key in selection: entry["pages"].move_to_end(key)
+        while len(entry["pages"]) > max(CHAT_CONTEXT_CACHE_PAGES, len(selection)): entry["pages"].popitem(last=False)
+        char_limit = CHAT_CONTEXT_TOKEN_BUDGET * 4
+        entry["context"] = "".join(f"\n[{names[d]} p.{n}]\n{entry['pages'].get((d, n), '')[:char_limit]}\n" for d, n in selection)
+        entry["citations"] = [{"document_id": d, "document": names[d], "page_number": n} for d, n in selection]
+        entry["selection"] = selection
+    return {"context": entry["context"], "citations": entry["citations"], "retrieval": "bm25" if scored else "leading_pages"}
+
+async def _pro_map_batches(api_key: str, system_instruction: str, jobs: List[Dict[str, Any]], concurrency: int, total_batches: Optional[int] = None) -> AsyncIterator[Any]:
+    # Runs every job concurrently (bounded) and yields (event, result) as they happen; result is set on batch_done only.
+    # "finding" events stream out of a batch while it generates; its batch_done report is the authoritative copy.
+    # total_batches: size of the whole plan when `jobs` is only the part a resumed analysis still has to run.
+    total_batches = total_batches or len(jobs)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def _run(job):
+        try:
+            async with semaphore:
+                await queue.put(({"type": "batch_start", "batch": job["batch"], "total_batches": total_batches, "pages": job["pages"]}, None))
+                # Text windows build their prompt lazily so only `concurrency` windows are held in memory at once.
+                user_text = job["user_text"]
+                if callable(user_text): user_text = await user_text()
+                resp = await gemini_generate_content_with_files(api_key=api_key, model_preferred="gemini-1.5-pro", system_instruction=system_instruction, user_text=user_text, file_uris=job["file_uris"], estimated_tokens=job.get("tokens", 0), on_event=lambda ev: queue.put_nowait(({**ev, "batch": job["batch"]}, None)), on_item=lambda f: queue.put_nowait(({"type": "finding", "batch": job["batch"], "finding": f}, None)), scheduled=True)
+                parsed = _parse_model_json(_extract_candidate_json_text(resp), "findings")
+                await queue.put(({"type": "batch_done", "batch": job["batch"], "total_batches": total_batches, "pages": job["pages"], "model_used": resp.get('__model_used__')}, parsed))
+        except Exception as e:
+            await queue.put(({"type": "__error__"}, e))
+
+    tasks = [asyncio.create_task(_run(job)) for job in jobs]
+    try:
+        remaining = len(jobs)
+        while remaining:
+            event, result = await queue.get()
+            if event["type"] == "__error__": raise result
+            if event["type"] == "batch_done": remaining -= 1
+            yield event, result
+    finally:
+        for task in tasks: task.cancel()
+
+def _build_token_windows(page_tokens: List[Any], budget: int, max_pages: int = BATCH_TARGET_PAGES, overlap: int = BATCH_OVERLAP_PAGES) -> List[Any]:
+    # page_tokens: [(page_number, tokens)] in page order. Greedily grows each window until the next page would
+    # exceed `budget` or `max_pages`, then starts the next one `overlap` pages back. A single page over budget
+    # still gets a window of its own.
+    windows, i, n = [], 0, len(page_tokens)
+    while i < n:
+        j, total = i, 0
+        while j < n and j - i < max_pages and (j == i or total + page_tokens[j][1] <= budget):
+            total += page_tokens[j][1]
+            j += 1
+        windows.append((page_tokens[i][0], page_tokens[j - 1][0], total))
+        if j >= n: break
+        i = max(j - overlap, i + 1)
+    return windows
+
+def _dedupe_overlap_findings(reports: List[Dict[str, Any]]) -> int:
+    # Overlapping windows report the same quote twice; keep the first (page, quote) seen in page order.
+    seen, removed = set(), 0
+    for r in reports:
+        report = r.get("report")
+        if not isinstance(report, dict) or not isinstance(report.get("findings"), list): continue
+        kept = []
+        for f in report["findings"]:
+            key = (str(f.get("global_page")), " ".join(str(f.get("quote", "")).lower().split())) if isinstance(f, dict) else None
+            if key in seen:
+                removed += 1
+                continue
+            if key: seen.add(key)
+            kept.append(f)
+        report["findings"] = kept
+    return removed
+
+async def _pro_tree_merge(api_key: str, system_instruction: str, query: str, reports: List[Dict[str, Any]], fan_in: int = PRO_MERGE_FAN_IN) -> AsyncIterator[dict]:
+    # reports: [{"pages": {"start", "end"}, "report": ...}] in page order. Each level merges groups of `fan_in`
+    # concurrently, so no merge prompt grows with document size and depth is log_fan_in(n).
+    async def _merge(group):
+        if len(group) == 1: return group[0]
+        pages = {"start": group[0]["pages"]["start"], "end": group[-1]["pages"]["end"]}
+        merge_prompt = {"query": query, "batches": group, "instruction": f"Combine these partial reports (global pages {pages['start']}-{pages['end']}) into one cohesive report. Keep every distinct finding with its global_page."}
+        resp = await gemini_generate_content_with_files(api_key=api_key, model_preferred="gemini-1.5-pro", system_instruction=system_instruction, user_text=json.dumps(merge_prompt), file_uris=[], scheduled=True)
+        return {"pages": pages, "report": _parse_model_json(_extract_candidate_json_text(resp), "findings")}
+
+    level = 0
+    while len(reports) > 1:
+        level += 1
+        groups = [reports[i:i + fan_in] for i in range(0, len(reports), fan_in)]
+        yield {"type": "merge_start", "level": level, "inputs": len(reports), "merges": sum(1 for g in groups if len(g) > 1)}
+        reports = list(await asyncio.gather(*[_merge(g) for g in groups]))
+        yield {"type": "merge_done", "level": level, "outputs": len(reports)}
+    yield {"type": "merged", "result": reports[0]["report"] if reports else {}}
 
 async def _pro_system_instruction() -> str:
     return """You are an expert Lead Auditor. OUTPUT STRICT JSON: { "doc_type": "...", "structure": {...}, "findings": [{ "global_page": 1, "section": "...", "quote": "...", "why_relevant": "...", "confidence": "high|medium|low" }], "notes": "..." }"""
 
+def _encode_list_cursor(value: Any, last_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([value, last_id]).encode("utf-8")).decode("ascii").rstrip("=")
+
+def _decode_list_cursor(cursor: str) -> List[Any]:
+    try:
+        value, last_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return [value, str(last_id)]
+    except Exception: raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def _list_page(collection_name: str, response: Response, query: Dict[str, Any], limit: int, cursor: Optional[str], sort: Optional[str], order: str) -> List[dict]:
+    # Keyset pagination: the cursor carries the last row's (sort value, id), so every page is an index range scan
+    # however deep the caller has paged, unlike skip/offset.
+    spec = LISTINGS[collection_name]
+    sort = sort or spec["sorts"][0]
+    if sort not in spec["sorts"]: raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(spec['sorts'])}")
+    if order not in ("asc", "desc"): raise HTTPException(status_code=400, detail="order must be asc or desc")
+    direction, op = (1, "$gt") if order == "asc" else (-1, "$lt")
+    limit = max(1, min(limit, LIST_MAX_LIMIT))
+    if cursor:
+        value, last_id = _decode_list_cursor(cursor)
+        query = {"$and": [query, {"$or": [{sort: {op: value}}, {sort: value, "id": {op: last_id}}]}]}
+    projection = {"_id": 0, **{f: 1 for f in spec["fields"]}}
+    rows = await db[collection_name].find(query, projection).sort([(sort, direction), ("id", direction)]).limit(limit + 1).to_list(limit + 1)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[LIST_NEXT_CURSOR_HEADER] = _encode_list_cursor(rows[-1].get(sort), rows[-1]["id"])
+    return rows
+
 # Routes
 @api_router.get("/")
 async def root():
@@ -411,44 +1759,202 @@ async def create_status_check(input: StatusCheckCreate):
     _ = await db.status_checks.insert_one(doc)
     return status_obj
 
+@api_router.get("/metrics")
+async def get_metrics():
+    buckets = rate_limiter.snapshot()
+    gauges = [
+        ("deepdive_llm_queue_depth", "Callers waiting on an LLM rate-limit bucket", [({"model": b["model"], "key": b["key"]}, b["queue_depth"]) for b in buckets]),
+        ("deepdive_llm_throttled", "429 pauses applied to an LLM bucket since start-up", [({"model": b["model"], "key": b["key"]}, b["throttled"]) for b in buckets]),
+        ("deepdive_scheduler_queue_depth", "LLM batches waiting for a scheduler slot", [({}, batch_scheduler.queue_depth())]),
+        ("deepdive_scheduler_running", "LLM batches holding a scheduler slot", [({}, batch_scheduler.running)]),
+        ("deepdive_scheduler_lanes", "Analyses with batches running or queued", [({}, len(batch_scheduler.lanes))]),
+        ("deepdive_background_tasks", "Background ingestion and analysis tasks in flight", [({}, len(_background_tasks))]),
+        ("deepdive_analysis_jobs", "Analyses running in this worker", [({"collection": c}, sum(1 for j in _analysis_jobs.values() if j.collection == c)) for c in ANALYSIS_RUNNERS]),
+    ]
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@api_router.get("/llm/limits")
+async def get_llm_limits():
+    # Queue depth and throttle counters per (API key, model) bucket; keys are hashed.
+    return {"buckets": rate_limiter.snapshot()}
+
+@api_router.get("/llm/scheduler")
+async def get_llm_scheduler():
+    # Slots in use, batches queued and per-analysis wait times, for sizing LLM_SCHEDULER_CONCURRENCY.
+    return batch_scheduler.snapshot()
+
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find({}, {"_id": 0}).to_list(1000)
+async def get_status_checks(response: Response, limit: int = STATUS_LIST_DEFAULT_LIMIT, cursor: Optional[str] = None, order: str = "desc"):
+    status_checks = await _list_page("status_checks", response, {}, limit, cursor, None, order)
     for check in status_checks:
         if isinstance(check['timestamp'], str):
             check['timestamp'] = datetime.fromisoformat(check['timestamp'])
     return status_checks
 
+# Content dedup: identical uploads (same SHA-256) share one set of page records (and, for pro documents, Gemini
+# parts). content_refs maps (kind, sha256) to the id the shared data is stored under (`pages_doc_id` on each
+# document) and counts the documents using it. Only finished ingests are registered, so a duplicate is always
+# created ready; identical uploads racing each other simply ingest independently.
+def _pages_key(doc: dict) -> str:
+    return doc.get('pages_doc_id') or doc['id']
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(UPLOAD_STREAM_CHUNK_BYTES): h.update(chunk)
+    return h.hexdigest()
+
+async def _acquire_content(kind: str, sha256: str) -> Optional[dict]:
+    # Takes a reference on already-ingested identical content; None means "ingest it yourself".
+    return await db.content_refs.find_one_and_update({"kind": kind, "sha256": sha256}, {"$inc": {"refs": 1}}, {"_id": 0}, return_document=ReturnDocument.AFTER)
+
+async def _register_content(kind: str, sha256: str, pages_id: str) -> None:
+    # First finished ingest wins; a document that lost the race keeps its own unshared copy.
+    await db.content_refs.update_one({"kind": kind, "sha256": sha256}, {"$setOnInsert": {"pages_id": pages_id, "refs": 1, "created_at": datetime.now(timezone.utc).isoformat()}}, upsert=True)
+
+async def _release_content(kind: str, pages_id: str) -> bool:
+    # Drops one reference; True when the caller held the last one and must delete the shared data.
+    content = await db.content_refs.find_one_and_update({"kind": kind, "pages_id": pages_id}, {"$inc": {"refs": -1}}, {"_id": 0}, return_document=ReturnDocument.AFTER)
+    if content is None: return True
+    if content["refs"] > 0: return False
+    # Guarded on refs so an upload that re-acquired the content in between keeps it alive.
+    return (await db.content_refs.delete_one({"kind": kind, "pages_id": pages_id, "refs": {"$lte": 0}})).deleted_count == 1
+
+async def _release_document_content(pages_id: str) -> None:
+    if await _release_content("document", pages_id):
+        await db.document_pages.delete_many({"doc_id": pages_id})
+        page_index.remove_document(pages_id)
+        (UPLOAD_DIR / f"{pages_id}.pdf").unlink(missing_ok=True)
+
+async def _ingest_document(doc_id: str, file_path: Path, sha256: Optional[str] = None) -> None:
+    # Each extracted chunk is written before the next is awaited, so only the extraction window is in memory. The BM25
+    # index is not fed here: it is built from document_pages when the document is first searched.
+    total_pages, total_words = 0, 0
+    try:
+        with StageTimer("document_ingest"):
+            async for chunk in iter_pdf_page_chunks(file_path):
+                for i in range(0, len(chunk), DOCUMENT_PAGES_INSERT_BATCH):
+                    await db.document_pages.insert_many([{"doc_id": doc_id, **p} for p in chunk[i:i + DOCUMENT_PAGES_INSERT_BATCH]])
+                total_pages += len(chunk)
+                total_words += sum(p['word_count'] for p in chunk)
+                await db.documents.update_one({"id": doc_id}, {"$set": {"ingested_pages": total_pages}})
+        if not total_pages:
+            file_path.unlink(missing_ok=True)
+            await db.documents.update_one({"id": doc_id}, {"$set": {"status": "failed", "error": "Could not extract text from PDF"}})
+            return
+        await db.documents.update_one({"id": doc_id}, {"$set": {"total_pages": total_pages, "total_words": total_words, "status": "ready"}})
+        if sha256: await _register_content("document", sha256, doc_id)
+    except Exception as e:
+        logging.error(f"Document ingestion failed for {doc_id}: {e}")
+        # A failed document is never read again (a retry is a fresh upload), so its copy would only leak disk.
+        file_path.unlink(missing_ok=True)
+        await db.document_pages.delete_many({"doc_id": doc_id})
+        await db.documents.update_one({"id": doc_id}, {"$set": {"status": "failed", "error": str(e)}})
+
+def _page_range_query(doc_id: str, page_start: Optional[int] = None, page_end: Optional[int] = None, page_numbers: Optional[List[int]] = None) -> Dict[str, Any]:
+    query: Dict[str, Any] = {"doc_id": doc_id}
+    page_filter: Dict[str, Any] = {}
+    if page_start: page_filter["$gte"] = page_start
+    if page_end: page_filter["$lte"] = page_end
+    if page_numbers is not None: page_filter["$in"] = page_numbers
+    if page_filter: query["page_number"] = page_filter
+    return query
+
+async def _count_document_pages(doc: dict, page_start: Optional[int] = None, page_end: Optional[int] = None) -> int:
+    if doc.get('pages'): return sum(1 for p in doc['pages'] if (page_start or 1) <= p['page_number'] <= (page_end or p['page_number']))
+    return await db.document_pages.count_documents(_page_range_query(_pages_key(doc), page_start, page_end))
+
+async def _iter_document_pages(doc: dict, page_start: Optional[int] = None, page_end: Optional[int] = None, page_numbers: Optional[List[int]] = None) -> AsyncIterator[dict]:
+    # Documents uploaded before document_pages existed still carry their pages inline.
+    if doc.get('pages'):
+        wanted = set(page_numbers) if page_numbers is not None else None
+        for p in doc['pages']:
+            if (page_start or 1) <= p['page_number'] <= (page_end or p['page_number']) and (wanted is None or p['page_number'] in wanted): yield p
+        return
+    cursor = db.document_pages.find(_page_range_query(_pages_key(doc), page_start, page_end, page_numbers), {"_id": 0, "doc_id": 0}).sort("page_number", 1)
+    async for p in cursor: yield p
+
+async def _document_page_stats(doc: dict, page_start: Optional[int] = None, page_end: Optional[int] = None, page_numbers: Optional[List[int]] = None) -> List[dict]:
+    # Size metadata only (no text), so deep scans can plan their batches before streaming the pages.
+    if doc.get('pages'): return [{k: p.get(k) for k in ("page_number", "word_count", "char_count")} async for p in _iter_document_pages(doc, page_start, page_end, page_numbers)]
+    cursor = db.document_pages.find(_page_range_query(_pages_key(doc), page_start, page_end, page_numbers), {"_id": 0, "page_number": 1, "word_count": 1, "char_count": 1}).sort("page_number", 1)
+    return [p async for p in cursor]
+
+async def _ensure_page_index(doc: dict) -> str:
+    # Builds the document's postings from its stored pages on first use (or after eviction) and returns the key it is
+    # indexed under: deduplicated copies share their source's pages, and so its postings.
+    key = _pages_key(doc)
+    if page_index.has_document(key): return key
+    entry = page_index.new_entry()
+    async for p in _iter_document_pages(doc): page_index.add_to_entry(entry, [p])
+    page_index.put(key, entry)
+    return key
+
+async def _page_numbers_in_range(doc: dict, page_start: Optional[int] = None, page_end: Optional[int] = None) -> List[int]:
+    if doc.get('pages'): return [p['page_number'] async for p in _iter_document_pages(doc, page_start, page_end)]
+    cursor = db.document_pages.find(_page_range_query(_pages_key(doc), page_start, page_end), {"_id": 0, "page_number": 1}).sort("page_number", 1)
+    return [p['page_number'] async for p in cursor]
+
+def _require_ready(doc: dict) -> None:
+    if doc.get('status', 'ready') != 'ready':
+        raise HTTPException(status_code=409, detail=f"Document {doc.get('filename')} is not ready (status: {doc.get('status')})")
+
 @api_router.post("/documents/upload")
 async def upload_document(file: UploadFile = File(...)):
     if not file.filename.lower().endswith('.pdf'): raise HTTPException(status_code=400, detail="Only PDF files supported")
-    content = await file.read()
-    pages = extract_pdf_pages(content)
-    if not pages: raise HTTPException(status_code=400, detail="Could not extract text from PDF")
     doc_id = str(uuid.uuid4())
     file_path = UPLOAD_DIR / f"{doc_id}.pdf"
-    async with aiofiles.open(file_path, 'wb') as f: await f.write(content)
-    total_words = sum(p['word_count'] for p in pages)
-    doc = {"id": doc_id, "filename": file.filename, "total_pages": len(pages), "total_words": total_words, "pages": pages, "uploaded_at": datetime.now(timezone.utc).isoformat(), "status": "ready"}
+    sha = hashlib.sha256()
+    try:
+        # Chunked copy from the spooled upload: memory per request is one chunk whatever the file size.
+        async with aiofiles.open(file_path, 'wb') as f:
+            while chunk := await file.read(UPLOAD_STREAM_CHUNK_BYTES):
+                sha.update(chunk)
+                await f.write(chunk)
+    except Exception:
+        file_path.unlink(missing_ok=True)
+        raise
+    if file_path.stat().st_size == 0:
+        file_path.unlink()
+        raise HTTPException(status_code=400, detail="Empty file")
+    sha256 = sha.hexdigest()
+    doc = {"id": doc_id, "filename": file.filename, "total_pages": 0, "total_words": 0, "uploaded_at": datetime.now(timezone.utc).isoformat(), "status": "processing", "content_sha256": sha256, "pages_doc_id": doc_id}
+    content = await _acquire_content("document", sha256)
+    if content:
+        # Same bytes already ingested: point at its pages instead of extracting them again.
+        file_path.unlink()
+        source = await db.documents.find_one({"pages_doc_id": content["pages_id"], "status": "ready"}, {"_id": 0, "total_pages": 1, "total_words": 1})
+        doc.update({"status": "ready", "pages_doc_id": content["pages_id"], "total_pages": (source or {}).get("total_pages", 0), "total_words": (source or {}).get("total_words", 0)})
+        try:
+            await db.documents.insert_one(doc)
+        except Exception:
+            # No document holds the reference just taken, so give it back or the shared pages are never freed.
+            await _release_document_content(content["pages_id"])
+            raise
+        metrics.inc("deepdive_upload_dedup_total", help="Uploads served from already-ingested identical content", kind="document")
+        return {"id": doc_id, "filename": file.filename, "status": "ready", "deduplicated": True}
     await db.documents.insert_one(doc)
-    return {"id": doc_id, "filename": file.filename, "total_pages": len(pages), "total_words": total_words, "status": "ready"}
+    _spawn_background(_ingest_document(doc_id, file_path, sha256))
+    return {"id": doc_id, "filename": file.filename, "status": "processing", "deduplicated": False}
 
 @api_router.get("/documents")
-async def list_documents():
-    return await db.documents.find({}, {"_id": 0, "pages": 0}).to_list(100)
+async def list_documents(response: Response, limit: int = LIST_DEFAULT_LIMIT, cursor: Optional[str] = None, sort: Optional[str] = None, order: str = "desc", status: Optional[str] = None):
+    return await _list_page("documents", response, {"status": status} if status else {}, limit, cursor, sort, order)
 
 @api_router.get("/documents/{doc_id}")
-async def get_document(doc_id: str):
+async def get_document(doc_id: str, page_start: Optional[int] = None, page_end: Optional[int] = None):
     doc = await db.documents.find_one({"id": doc_id}, {"_id": 0})
     if not doc: raise HTTPException(status_code=404, detail="Document not found")
+    doc['pages'] = [p async for p in _iter_document_pages(doc, page_start, page_end)]
     return doc
 
 @api_router.delete("/documents/{doc_id}")
 async def delete_document(doc_id: str):
-    result = await db.documents.delete_one({"id": doc_id})
-    if result.deleted_count == 0: raise HTTPException(status_code=404, detail="Document not found")
-    file_path = UPLOAD_DIR / f"{doc_id}.pdf"
-    if file_path.exists(): file_path.unlink()
+    doc = await db.documents.find_one_and_delete({"id": doc_id}, {"_id": 0, "id": 1, "pages_doc_id": 1})
+    if not doc: raise HTTPException(status_code=404, detail="Document not found")
+    for session_id in [sid for sid, entry in _chat_context_cache.items() if doc_id in entry["doc_ids"]]: del _chat_context_cache[session_id]
+    # Pages and the stored PDF live under pages_doc_id and may be shared with identical uploads.
+    await _release_document_content(_pages_key(doc))
     return {"message": "Deleted"}
 
 @api_router.post("/pro/upload/init")
@@ -456,22 +1962,255 @@ async def pro_upload_init(req: ProUploadInitRequest):
     upload_id = str(uuid.uuid4())
     tmp_path = PRO_UPLOAD_DIR / f"{upload_id}.pdf"
     tmp_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(tmp_path, "wb"): pass
-    session = {"id": upload_id, "filename": req.filename, "size_bytes": req.size_bytes, "tmp_path": str(tmp_path), "uploaded_bytes": 0, "status": "uploading", "created_at": datetime.now(timezone.utc).isoformat()}
+    chunk_size = req.chunk_size or PRO_UPLOAD_DEFAULT_CHUNK_BYTES
+    # Preallocate so chunks can be written at their offsets in any order.
+    with open(tmp_path, "wb") as f: f.truncate(req.size_bytes)
+    session = {"id": upload_id, "filename": req.filename, "size_bytes": req.size_bytes, "chunk_size": chunk_size, "tmp_path": str(tmp_path), "received_ranges": [], "status": "uploading", "created_at": datetime.now(timezone.utc).isoformat()}
     await db.pro_upload_sessions.insert_one(session)
-    return {"upload_id": upload_id}
+    return {"upload_id": upload_id, "chunk_size": chunk_size, "total_chunks": (req.size_bytes + chunk_size - 1) // chunk_size}
+
+def _merge_ranges(ranges: List[List[int]]) -> List[List[int]]:
+    merged: List[List[int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]: merged[-1][1] = max(merged[-1][1], end)
+        else: merged.append([start, end])
+    return merged
+
+def _missing_ranges(ranges: List[List[int]], size_bytes: int) -> List[List[int]]:
+    missing, cursor = [], 0
+    for start, end in _merge_ranges(ranges):
+        if start > cursor: missing.append([cursor, start])
+        cursor = max(cursor, end)
+    if cursor < size_bytes: missing.append([cursor, size_bytes])
+    return missing
+
+def _upload_status(session: dict) -> dict:
+    merged = _merge_ranges(session.get("received_ranges", []))
+    missing = _missing_ranges(merged, session["size_bytes"])
+    return {"upload_id": session["id"], "size_bytes": session["size_bytes"], "chunk_size": session.get("chunk_size"), "uploaded_bytes": sum(e - s for s, e in merged), "missing_ranges": missing, "complete": not missing, "status": session.get("status")}
 
 @api_router.post("/pro/upload/{upload_id}/chunk")
-async def pro_upload_chunk(upload_id: str, request: Request):
+async def pro_upload_chunk(upload_id: str, request: Request, offset: Optional[int] = None, index: Optional[int] = None):
     session = await db.pro_upload_sessions.find_one({"id": upload_id}, {"_id": 0})
     if not session: raise HTTPException(status_code=404, detail="Upload session not found")
+    if session.get("status") != "uploading": raise HTTPException(status_code=409, detail=f"Upload session is {session.get('status')}")
     tmp_path = Path(session["tmp_path"])
-    chunk = await request.body()
+    checksum = request.headers.get("x-chunk-sha256")
+    if not checksum: raise HTTPException(status_code=400, detail="X-Chunk-Sha256 header is required")
+    # Bounded before and while reading: a chunk never holds more than the session's chunk size in memory.
+    max_bytes = min(session.get("chunk_size") or PRO_UPLOAD_MAX_CHUNK_BYTES, PRO_UPLOAD_MAX_CHUNK_BYTES)
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes: raise HTTPException(status_code=413, detail=f"Chunk exceeds {max_bytes} bytes")
+    chunk, digest = bytearray(), hashlib.sha256()
+    async for piece in request.stream():
+        if len(chunk) + len(piece) > max_bytes: raise HTTPException(status_code=413, detail=f"Chunk exceeds {max_bytes} bytes")
+        chunk += piece
+        digest.update(piece)
     if not chunk: raise HTTPException(status_code=400, detail="Empty chunk")
-    async with aiofiles.open(tmp_path, 'ab') as f: await f.write(chunk)
-    uploaded = session.get("uploaded_bytes", 0) + len(chunk)
-    await db.pro_upload_sessions.update_one({"id": upload_id}, {"$set": {"uploaded_bytes": uploaded}})
-    return {"upload_id": upload_id, "uploaded_bytes": uploaded}
+    if digest.hexdigest() != checksum.lower(): raise HTTPException(status_code=400, detail="Chunk checksum mismatch")
+    if offset is None and index is not None: offset = index * session.get("chunk_size", PRO_UPLOAD_DEFAULT_CHUNK_BYTES)
+    if offset is None:
+        # Legacy clients send chunks in order without an offset: append after the contiguous prefix.
+        merged = _merge_ranges(session.get("received_ranges", []))
+        offset = merged[0][1] if merged and merged[0][0] == 0 else 0
+    if offset < 0 or offset + len(chunk) > session["size_bytes"]: raise HTTPException(status_code=400, detail="Chunk outside declared file size")
+    async with aiofiles.open(tmp_path, 'r+b') as f:
+        await f.seek(offset)
+        await f.write(chunk)
+    # $addToSet makes a retried chunk idempotent; concurrent chunks never clobber each other's ranges.
+    updated = await db.pro_upload_sessions.find_one_and_update({"id": upload_id}, {"$addToSet": {"received_ranges": [offset, offset + len(chunk)]}}, {"_id": 0}, return_document=ReturnDocument.AFTER)
+    status = _upload_status(updated)
+    return {"upload_id": upload_id, "offset": offset, "uploaded_bytes": status["uploaded_bytes"], "complete": status["complete"]}
+
+@api_router.get("/pro/upload/{upload_id}/status")
+async def pro_upload_status(upload_id: str):
+    session = await db.pro_upload_sessions.find_one({"id": upload_id}, {"_id": 0})
+    if not session: raise HTTPException(status_code=404, detail="Upload session not found")
+    return _upload_status(session)
+
+def _gemini_file_state(file_obj: Dict[str, Any]) -> Optional[str]:
+    state = file_obj.get('state')
+    return (state or {}).get('name') if isinstance(state, dict) else state
+
+async def _upload_pro_part(api_key: str, pro_doc_id: str, filename: str, part: Dict[str, Any], doc_filter: Optional[dict] = None) -> None:
+    # Upload one part with retries, then wait for Gemini to report it ACTIVE. Progress is written to parts.<i> of
+    # every document matching doc_filter (default: just pro_doc_id).
+    slot = f"parts.{part['part_index'] - 1}"
+    doc_filter = doc_filter or {"id": pro_doc_id}
+    last_error = None
+    for attempt in range(1, PRO_INGEST_PART_RETRIES + 1):
+        await db.pro_documents.update_many(doc_filter, {"$set": {f"{slot}.state": "UPLOADING", f"{slot}.attempts": attempt}})
+        file_name = None
+        try:
+            file_obj = await gemini_files_resumable_upload(api_key, Path(part["local_path"]), f"{filename} (pages {part['start_page']}-{part['end_page']})")
+            file_name = file_obj.get('name')
+            state = _gemini_file_state(file_obj)
+            await db.pro_documents.update_many(doc_filter, {"$set": {f"{slot}.gemini_file_name": file_obj.get('name'), f"{slot}.gemini_file_uri": file_obj.get('uri'), f"{slot}.expiration_time": file_obj.get('expirationTime'), f"{slot}.state": state, f"{slot}.error": None}})
+            deadline = time.monotonic() + PRO_INGEST_ACTIVE_TIMEOUT_SECONDS
+            while state == "PROCESSING" and time.monotonic() < deadline:
+                await asyncio.sleep(PRO_INGEST_POLL_SECONDS)
+                state = _gemini_file_state(await gemini_files_get(api_key, file_obj.get('name')))
+                await db.pro_documents.update_many(doc_filter, {"$set": {f"{slot}.state": state}})
+            if state == "ACTIVE": return
+            last_error = f"Gemini file state {state}"
+        except Exception as e:
+            last_error = str(getattr(e, 'detail', e))
+        logging.warning(f"Pro part {part['part_index']} of {pro_doc_id} attempt {attempt} failed: {last_error}")
+        if file_name:
+            # The failed attempt's file would otherwise sit against the key's storage quota until Gemini expires it.
+            try: await gemini_files_delete(api_key, file_name)
+            except Exception as e: logging.warning(f"Could not delete Gemini file {file_name} from a failed upload: {getattr(e, 'detail', e)}")
+        await db.pro_documents.update_many(doc_filter, {"$set": {f"{slot}.state": "RETRYING" if attempt < PRO_INGEST_PART_RETRIES else "FAILED", f"{slot}.error": last_error}})
+        if attempt < PRO_INGEST_PART_RETRIES: await asyncio.sleep(PRO_INGEST_RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+    raise RuntimeError(f"Part {part['part_index']} (pages {part['start_page']}-{part['end_page']}): {last_error}")
+
+def _pro_pages_filter(pages_id: str) -> Dict[str, Any]:
+    # Every pro document whose parts and page rows live under pages_id (itself plus deduplicated copies).
+    return {"$or": [{"id": pages_id}, {"pages_doc_id": pages_id}]}
+
+async def _ensure_pro_token_counts(api_key: str, doc: Dict[str, Any]) -> Dict[str, Any]:
+    # Per-content cache: page text + token counts live in pro_document_pages, part totals on each document.
+    if doc.get('token_counts'): return doc['token_counts']
+    doc_id = _pages_key(doc)
+    task = _pro_token_inflight.get(doc_id)
+    if task is None:
+        task = asyncio.ensure_future(_measure_pro_token_counts(api_key, doc_id))
+        _pro_token_inflight[doc_id] = task
+        task.add_done_callback(lambda _: _pro_token_inflight.pop(doc_id, None))
+    return await asyncio.shield(task)
+
+async def _measure_pro_token_counts(api_key: str, doc_id: str) -> Dict[str, Any]:
+    doc = await db.pro_documents.find_one(_pro_pages_filter(doc_id), {"_id": 0, "parts": 1, "token_counts": 1})
+    if not doc: raise HTTPException(status_code=404, detail="Pro document not found")
+    if doc.get('token_counts'): return doc['token_counts']
+    tokenizer = _text_token_counter(PRO_TOKENIZER)[0]
+    await db.pro_document_pages.delete_many({"pro_document_id": doc_id})
+    part_tokens, sources, text_tokens = [], [], []
+    for p in doc.get('parts', []):
+        local_path = Path(p['local_path'])
+        pages = await extract_pdf_pages(local_path, tokenizer=tokenizer) if local_path.exists() else []
+        rows = [{"pro_document_id": doc_id, "page_number": pg["page_number"] + p['start_page'] - 1, "text": pg["text"], "tokens": pg["tokens"]} for pg in pages]
+        for i in range(0, len(rows), DOCUMENT_PAGES_INSERT_BATCH):
+            await db.pro_document_pages.insert_many(rows[i:i + DOCUMENT_PAGES_INSERT_BATCH])
+        measured = None
+        if p.get('gemini_file_uri'):
+            try: measured = await gemini_count_tokens(api_key, [{"mime_type": "application/pdf", "file_uri": p['gemini_file_uri']}])
+            except Exception as e: logging.warning(f"countTokens failed for part {p['part_index']} of {doc_id}: {getattr(e, 'detail', e)}")
+        estimate = sum(r["tokens"] for r in rows) + PDF_PAGE_IMAGE_TOKENS * (p['end_page'] - p['start_page'] + 1)
+        part_tokens.append(measured if measured else estimate)
+        sources.append("gemini" if measured else "estimate")
+        text_tokens.append(sum(r["tokens"] for r in rows) if rows else None)
+    counts = {"tokenizer": tokenizer, "parts": part_tokens, "parts_source": sources, "parts_text_tokens": text_tokens, "total": sum(part_tokens), "computed_at": datetime.now(timezone.utc).isoformat()}
+    await db.pro_documents.update_many(_pro_pages_filter(doc_id), {"$set": {"token_counts": counts}})
+    return counts
+
+def _pro_part_expired(part: Dict[str, Any], horizon: datetime) -> bool:
+    expires_at = _parse_rfc3339(part.get('expiration_time'))
+    return expires_at is not None and expires_at <= horizon
+
+async def _refresh_expired_pro_parts(api_key: str, doc: Dict[str, Any]) -> Dict[str, Any]:
+    # Gemini deletes uploaded files after 48h. Parts past (or about to pass) their expiration_time are re-uploaded
+    # from the local copy just before use, once for all documents sharing them; fresh parts are left alone.
+    horizon = datetime.now(timezone.utc) + timedelta(seconds=PRO_PART_EXPIRY_MARGIN_SECONDS)
+    if not any(_pro_part_expired(p, horizon) for p in doc.get('parts', [])): return doc
+    pages_id = _pages_key(doc)
+    task = _pro_refresh_inflight.get(pages_id)
+    if task is None:
+        task = asyncio.ensure_future(_reupload_expired_pro_parts(api_key, pages_id, doc.get('filename', ''), horizon))
+        _pro_refresh_inflight[pages_id] = task
+        task.add_done_callback(lambda _: _pro_refresh_inflight.pop(pages_id, None))
+    await asyncio.shield(task)
+    return await db.pro_documents.find_one({"id": doc['id']}, {"_id": 0})
+
+async def _reupload_expired_pro_parts(api_key: str, pages_id: str, filename: str, horizon: datetime) -> None:
+    doc = await db.pro_documents.find_one(_pro_pages_filter(pages_id), {"_id": 0, "parts": 1})
+    stale = [p for p in (doc or {}).get('parts', []) if _pro_part_expired(p, horizon)]
+    gone = [p['part_index'] for p in stale if not Path(p['local_path']).exists()]
+    if gone: raise HTTPException(status_code=409, detail=f"Gemini copies of parts {gone} expired and their local files are gone; upload the document again")
+    semaphore = asyncio.Semaphore(PRO_INGEST_UPLOAD_CONCURRENCY)
+
+    async def _bounded(part):
+        async with semaphore: await _upload_pro_part(api_key, pages_id, filename, part, doc_filter=_pro_pages_filter(pages_id))
+    with StageTimer("pro_part_reupload"): await asyncio.gather(*[_bounded(p) for p in stale])
+    metrics.inc("deepdive_pro_parts_reuploaded_total", len(stale), help="Expired Gemini parts uploaded again before use")
+
+async def _pro_page_tokens(doc_id: str, start: int, end: int) -> List[Any]:
+    cursor = db.pro_document_pages.find({"pro_document_id": doc_id, "page_number": {"$gte": start, "$lte": end}}, {"_id": 0, "page_number": 1, "tokens": 1}).sort("page_number", 1)
+    return [(r["page_number"], r["tokens"] + PRO_WINDOW_PAGE_OVERHEAD_TOKENS) async for r in cursor]
+
+async def _pro_window_text(doc_id: str, start: int, end: int) -> str:
+    cursor = db.pro_document_pages.find({"pro_document_id": doc_id, "page_number": {"$gte": start, "$lte": end}}, {"_id": 0, "page_number": 1, "text": 1}).sort("page_number", 1)
+    return "\n\n".join([f"[GLOBAL PAGE {r['page_number']}]\n{r['text']}" async for r in cursor])
+
+async def _build_pro_jobs(doc: Dict[str, Any], query: str, token_counts: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # One job per part that fits the token budget (native PDF); parts over budget become overlapping text windows.
+    parts, jobs = doc.get('parts', []), []
+    budget = PRO_TOKEN_SAFETY_LIMIT - PRO_WINDOW_PROMPT_RESERVE_TOKENS
+    for idx, (p, tokens) in enumerate(zip(parts, token_counts['parts']), 1):
+        b_start, b_end = p['start_page'], p['end_page']
+        page_tokens = await _pro_page_tokens(_pages_key(doc), b_start, b_end) if tokens > PRO_TOKEN_SAFETY_LIMIT else []
+        if not page_tokens:
+            if tokens > PRO_TOKEN_SAFETY_LIMIT: logging.warning(f"No page text for part {idx} of {doc['id']}; sending it whole")
+            user_text = f"PART {idx} of {len(parts)}.\nUSER QUERY:\n{query}\n\nGLOBAL PAGE NOTE:\nThis file contains pages {b_start} to {b_end}.\n\nReturn JSON findings for this part only."
+            jobs.append({"batch": len(jobs) + 1, "pages": {"start": b_start, "end": b_end}, "source": "file", "tokens": tokens, "user_text": user_text, "file_uris": [{"mime_type": "application/pdf", "file_uri": p['gemini_file_uri']}]})
+            continue
+        for w_start, w_end, w_tokens in _build_token_windows(page_tokens, budget, BATCH_TARGET_PAGES, BATCH_OVERLAP_PAGES):
+            async def _window_text(w_start=w_start, w_end=w_end):
+                text = await _pro_window_text(_pages_key(doc), w_start, w_end)
+                return f"TEXT WINDOW: global pages {w_start} to {w_end} (windows overlap by up to {BATCH_OVERLAP_PAGES} pages).\nUSER QUERY:\n{query}\n\nEach page below starts with a [GLOBAL PAGE n] marker; use n as global_page.\n\n{text}\n\nReturn JSON findings for these pages only."
+            jobs.append({"batch": len(jobs) + 1, "pages": {"start": w_start, "end": w_end}, "source": "text", "tokens": w_tokens, "user_text": _window_text, "file_uris": []})
+    return jobs
+
+async def _dedupe_pro_upload(pro_doc_id: str, session: Dict[str, Any], pdf_path: Path) -> Optional[str]:
+    # Fingerprints the assembled file (chunks arrive in any order, so only now) and, when identical bytes were
+    # already ingested, makes the document share that copy's Gemini parts and page rows. Returns the sha256 when the
+    # document still has to be ingested, None when it was served from the shared copy.
+    await db.pro_documents.update_one({"id": pro_doc_id}, {"$set": {"ingest.stage": "hashing"}})
+    with StageTimer("upload_hash"): sha256 = await asyncio.to_thread(_file_sha256, pdf_path)
+    await db.pro_documents.update_one({"id": pro_doc_id}, {"$set": {"content_sha256": sha256}})
+    content = await _acquire_content("pro_document", sha256)
+    source = await db.pro_documents.find_one({**_pro_pages_filter(content["pages_id"]), "status": "ready"}, {"_id": 0, "total_pages": 1, "parts": 1, "token_counts": 1}) if content else None
+    if not source:
+        if content: await _release_content("pro_document", content["pages_id"])
+        return sha256
+    # Same bytes already split and uploaded: share its Gemini parts and page rows (expired parts are re-uploaded on first use).
+    await db.pro_documents.update_one({"id": pro_doc_id}, {"$set": {"status": "ready", "pages_doc_id": content["pages_id"], "total_pages": source.get("total_pages"), "parts": source.get("parts", []), "token_counts": source.get("token_counts"), "ingest.stage": "done", "ingest.finished_at": datetime.now(timezone.utc).isoformat(), "ingest.deduplicated": True}})
+    await db.pro_upload_sessions.update_one({"id": session["id"]}, {"$set": {"status": "complete"}})
+    pdf_path.unlink(missing_ok=True)
+    metrics.inc("deepdive_upload_dedup_total", help="Uploads served from already-ingested identical content", kind="pro_document")
+    return None
+
+async def _ingest_pro_document(api_key: str, pro_doc_id: str, session: Dict[str, Any]) -> None:
+    pdf_path = Path(session["tmp_path"])
+    try:
+        sha256 = await _dedupe_pro_upload(pro_doc_id, session, pdf_path)
+        if sha256 is None: return
+        await db.pro_documents.update_one({"id": pro_doc_id}, {"$set": {"ingest.stage": "splitting"}})
+        total_pages = await _run_in_pdf_pool(_pdf_page_count, pdf_path)
+        file_size_mb = pdf_path.stat().st_size / (1024 * 1024)
+        needs_split = total_pages > GEMINI_FILE_MAX_PAGES or file_size_mb > GEMINI_FILE_MAX_SIZE_MB
+        if needs_split: parts_meta = await split_pdf_by_pages_parallel(pdf_path, PRO_UPLOAD_DIR / session["id"])
+        else: parts_meta = [{"part_index": 1, "start_page": 1, "end_page": total_pages, "local_path": str(pdf_path), "size_bytes": pdf_path.stat().st_size}]
+        parts = [{**p, "gemini_file_name": None, "gemini_file_uri": None, "expiration_time": None, "state": "PENDING", "attempts": 0, "error": None} for p in parts_meta]
+        await db.pro_documents.update_one({"id": pro_doc_id}, {"$set": {"total_pages": total_pages, "parts": parts, "ingest.stage": "uploading"}})
+        semaphore = asyncio.Semaphore(PRO_INGEST_UPLOAD_CONCURRENCY)
+
+        async def _bounded(part):
+            async with semaphore: await _upload_pro_part(api_key, pro_doc_id, session['filename'], part)
+        results = await asyncio.gather(*[_bounded(p) for p in parts], return_exceptions=True)
+        errors = [str(r) for r in results if isinstance(r, Exception)]
+        if errors:
+            await db.pro_documents.update_one({"id": pro_doc_id}, {"$set": {"status": "failed", "error": "; ".join(errors), "ingest.stage": "failed"}})
+            return
+        await db.pro_documents.update_one({"id": pro_doc_id}, {"$set": {"status": "ready", "ingest.stage": "done", "ingest.finished_at": datetime.now(timezone.utc).isoformat()}})
+        await db.pro_upload_sessions.update_one({"id": session["id"]}, {"$set": {"status": "complete"}})
+        await _register_content("pro_document", sha256, pro_doc_id)
+        # Warm the token-count cache now so the first analysis does not pay for text extraction.
+        try: await _ensure_pro_token_counts(api_key, {"id": pro_doc_id})
+        except Exception as e: logging.warning(f"Token counting failed for {pro_doc_id}: {e}")
+    except Exception as e:
+        logging.error(f"Pro ingestion failed for {pro_doc_id}: {e}")
+        await db.pro_documents.update_one({"id": pro_doc_id}, {"$set": {"status": "failed", "error": str(e), "ingest.stage": "failed"}})
 
 @api_router.post("/pro/upload/complete")
 async def pro_upload_complete(req: ProUploadCompleteRequest):
@@ -482,26 +2221,34 @@ async def pro_upload_complete(req: ProUploadCompleteRequest):
 
     session = await db.pro_upload_sessions.find_one({"id": req.upload_id}, {"_id": 0})
     if not session: raise HTTPException(status_code=404, detail="Upload session not found")
+    if session.get("pro_document_id"): return {"pro_document_id": session["pro_document_id"], "status": "processing"}
     pdf_path = Path(session["tmp_path"])
     if not pdf_path.exists(): raise HTTPException(status_code=400, detail="Uploaded file missing")
-    total_pages = _pdf_page_count(pdf_path)
-    file_size_mb = pdf_path.stat().st_size / (1024 * 1024)
-    needs_split = total_pages > GEMINI_FILE_MAX_PAGES or file_size_mb > GEMINI_FILE_MAX_SIZE_MB
-    if needs_split: parts_meta = _split_pdf_by_pages(pdf_path, PRO_UPLOAD_DIR / req.upload_id)
-    else: parts_meta = [{"part_index": 1, "start_page": 1, "end_page": total_pages, "local_path": str(pdf_path), "size_bytes": pdf_path.stat().st_size}]
-    gemini_parts = []
-    for p in parts_meta:
-        file_obj = await gemini_files_resumable_upload(server_api_key, Path(p["local_path"]), f"{session['filename']} (pages {p['start_page']}-{p['end_page']})")
-        gemini_parts.append({**p, "gemini_file_name": file_obj.get('name'), "gemini_file_uri": file_obj.get('uri'), "expiration_time": file_obj.get('expirationTime'), "state": (file_obj.get('state') or {}).get('name') if isinstance(file_obj.get('state'), dict) else file_obj.get('state')})
+    if "received_ranges" in session:
+        missing = _missing_ranges(session["received_ranges"], session["size_bytes"])
+        if missing: raise HTTPException(status_code=409, detail={"message": "Upload incomplete", "missing_ranges": missing})
     pro_doc_id = str(uuid.uuid4())
-    pro_doc = {"id": pro_doc_id, "filename": session['filename'], "total_pages": total_pages, "size_bytes": session.get('size_bytes'), "parts": gemini_parts, "created_at": datetime.now(timezone.utc).isoformat(), "status": "ready"}
+    # Claim the session atomically so a retried /complete cannot start a second ingestion.
+    claimed = await db.pro_upload_sessions.update_one({"id": req.upload_id, "pro_document_id": {"$exists": False}}, {"$set": {"status": "processing", "pro_document_id": pro_doc_id}})
+    if claimed.modified_count == 0:
+        session = await db.pro_upload_sessions.find_one({"id": req.upload_id}, {"_id": 0})
+        return {"pro_document_id": session.get("pro_document_id"), "status": "processing"}
+    # Hashing the assembled file (for dedup) is part of the background ingest, so this returns immediately.
+    pro_doc = {"id": pro_doc_id, "filename": session['filename'], "total_pages": None, "size_bytes": session.get('size_bytes'), "parts": [], "created_at": datetime.now(timezone.utc).isoformat(), "status": "processing", "ingest": {"stage": "queued", "started_at": datetime.now(timezone.utc).isoformat()}, "content_sha256": None, "pages_doc_id": pro_doc_id}
     await db.pro_documents.insert_one(pro_doc)
-    await db.pro_upload_sessions.update_one({"id": req.upload_id}, {"$set": {"status": "complete", "pro_document_id": pro_doc_id}})
-    return {"pro_document_id": pro_doc_id, "total_pages": total_pages, "parts": [{"start_page": p['start_page'], "end_page": p['end_page'], "file_uri": p['gemini_file_uri']} for p in gemini_parts]}
+    _spawn_background(_ingest_pro_document(server_api_key, pro_doc_id, session))
+    return {"pro_document_id": pro_doc_id, "status": "processing"}
+
+@api_router.get("/pro/documents/{pro_document_id}/ingest")
+async def get_pro_ingest_status(pro_document_id: str):
+    doc = await db.pro_documents.find_one({"id": pro_document_id}, {"_id": 0, "status": 1, "error": 1, "ingest": 1, "total_pages": 1, "parts": 1})
+    if not doc: raise HTTPException(status_code=404, detail="Pro document not found")
+    parts = [{k: p.get(k) for k in ("part_index", "start_page", "end_page", "size_bytes", "state", "attempts", "error")} for p in doc.get('parts', [])]
+    return {"pro_document_id": pro_document_id, "status": doc.get('status'), "error": doc.get('error'), "ingest": doc.get('ingest'), "total_pages": doc.get('total_pages'), "parts": parts, "parts_active": sum(1 for p in parts if p['state'] == "ACTIVE")}
 
 @api_router.get("/pro/documents")
-async def list_pro_documents():
-    return await db.pro_documents.find({}, {"_id": 0}).to_list(100)
+async def list_pro_documents(response: Response, limit: int = LIST_DEFAULT_LIMIT, cursor: Optional[str] = None, sort: Optional[str] = None, order: str = "desc", status: Optional[str] = None):
+    return await _list_page("pro_documents", response, {"status": status} if status else {}, limit, cursor, sort, order)
 
 @api_router.get("/pro/documents/{pro_document_id}")
 async def get_pro_document(pro_document_id: str):
@@ -524,14 +2271,92 @@ async def delete_pro_document(pro_document_id: str, gemini_api_key: str):
     gemini_api_key = os.environ.get('GOOGLE_API_KEY_DEEP_DIVE') or gemini_api_key
     doc = await db.pro_documents.find_one({"id": pro_document_id}, {"_id": 0})
     if not doc: raise HTTPException(status_code=404, detail="Pro document not found")
-    for p in doc.get('parts', []):
-        name = p.get('gemini_file_name')
-        if name:
-            try: await gemini_files_delete(gemini_api_key, name)
-            except Exception: pass
+    await _drop_pro_chat_cache(gemini_api_key, pro_document_id, (doc.get('chat_cache') or {}).get('name'))
     await db.pro_documents.delete_one({"id": pro_document_id})
+    # Gemini parts and page rows may be shared with identical uploads; only the last reference removes them.
+    pages_id = _pages_key(doc)
+    if await _release_content("pro_document", pages_id):
+        for p in doc.get('parts', []):
+            name = p.get('gemini_file_name')
+            if name:
+                try: await gemini_files_delete(gemini_api_key, name)
+                except Exception: pass
+        await db.pro_document_pages.delete_many({"pro_document_id": pages_id})
     return {"message": "Deleted"}
 
+async def _run_pro_analysis(job: "AnalysisJob", analysis: dict) -> None:
+    analysis_id = analysis["id"]
+    req = ProAnalyzeRequest(**analysis["params"], gemini_api_key="")
+    server_api_key = os.environ.get('GOOGLE_API_KEY_DEEP_DIVE')
+    if not server_api_key: raise RuntimeError("GOOGLE_API_KEY_DEEP_DIVE not configured")
+    timings = job.timings = _start_analysis_timings("pro_analyze", analysis.get("timings"))
+    _scheduler_lane.set((analysis_id, req.priority))
+    doc = await db.pro_documents.find_one({"id": req.pro_document_id}, {"_id": 0})
+    if not doc: raise RuntimeError("Pro document not found")
+    doc = await _refresh_expired_pro_parts(server_api_key, doc)
+    total_pages = doc.get('total_pages', 0)
+    parts = doc.get('parts', [])
+    batch_mode, token_batch_mode, estimated_tokens = analysis["batch_mode"], analysis["token_batch_mode"], analysis["estimated_tokens"]
+    # Batch reports saved by earlier attempts (checkpoints); only the missing batches are re-run.
+    batch_reports: Dict[int, Dict[str, Any]] = {int(k): v for k, v in (analysis.get("batch_reports") or {}).items()}
+
+    async def _finish(state: Dict[str, Any]) -> None:
+        metrics.inc("deepdive_analyses_total", help="Finished analyses", endpoint="pro_analyze", status=state["status"])
+        result = state.get("result")
+        if isinstance(result, dict): state = {**state, "total_findings": len(result.get("findings") or [])}
+        with StageTimer("mongo_write"): await db.pro_analyses.update_one({"id": analysis_id}, {"$set": {**state, "timings": _analysis_timings_summary(timings)}})
+
+    try:
+        if job.attempt > 1: job.emit({'type': 'resumed', 'analysis_id': analysis_id, 'attempt': job.attempt, 'completed_batches': sorted(batch_reports)})
+        else: job.emit({'type': 'start', 'analysis_id': analysis_id, 'total_pages': total_pages, 'batch_mode': batch_mode, 'estimated_tokens': estimated_tokens, 'parts': [{'start': p['start_page'], 'end': p['end_page']} for p in parts]})
+        system_instruction = await _pro_system_instruction()
+        if not batch_mode:
+            global_page_note = "\n".join([f"- Part {p['part_index']}: this file starts at Global Page {p['start_page']} (ends at {p['end_page']})." for p in parts])
+            user_text = f"USER QUERY:\n{req.query}\n\nGLOBAL PAGE OFFSETS:\n{global_page_note}\n\nNow perform the process and return JSON."
+            def _on_finding(finding: Dict[str, Any]) -> None:
+                _mark_analysis_timing(timings, "first_finding_seconds")
+                job.emit({'type': 'finding', 'finding': finding})
+            resp = await gemini_generate_content_with_files(api_key=server_api_key, model_preferred="gemini-1.5-pro", system_instruction=system_instruction, user_text=user_text, file_uris=_build_file_uri_parts(parts), estimated_tokens=estimated_tokens, on_event=job.emit, on_item=_on_finding, scheduled=True)
+            model_used = resp.get('__model_used__')
+            parsed = _parse_model_json(_extract_candidate_json_text(resp), "findings")
+            if isinstance(parsed, dict) and parsed.get('findings'): _mark_analysis_timing(timings, "first_finding_seconds")
+            await _finish({"model_used": model_used, "status": "complete", "result": parsed})
+            job.emit({'type': 'done', 'analysis_id': analysis_id, 'model_used': model_used, 'result': parsed})
+            return
+
+        with StageTimer("token_count"): token_counts = await _ensure_pro_token_counts(server_api_key, doc)
+        jobs = await _build_pro_jobs(doc, req.query, token_counts)
+        plan = [{k: j[k] for k in ("batch", "pages", "source", "tokens")} for j in jobs]
+        if not analysis.get("batches"):
+            with StageTimer("mongo_write"): await db.pro_analyses.update_one({"id": analysis_id}, {"$set": {"batches": plan}})
+        job.emit({'type': 'batch_plan', 'token_batch_mode': token_batch_mode, 'batches': plan})
+        remaining = [j for j in jobs if j["batch"] not in batch_reports]
+        async for event, result in _pro_map_batches(server_api_key, system_instruction, remaining, req.concurrency or PRO_PART_CONCURRENCY, total_batches=len(jobs)):
+            if event['type'] == 'batch_done':
+                batch_reports[event['batch']] = {"pages": event['pages'], "report": result}
+                if isinstance(result, dict) and result.get('findings'): _mark_analysis_timing(timings, "first_finding_seconds")
+                with StageTimer("mongo_write"): await db.pro_analyses.update_one({"id": analysis_id}, {"$set": {f"batch_reports.{event['batch']}": batch_reports[event['batch']], "timings": _analysis_timings_summary(timings)}})
+                job.emit(event)
+                await job.flush_events()
+            else:
+                if event['type'] == 'finding': _mark_analysis_timing(timings, "first_finding_seconds")
+                job.emit(event)
+        reports = [batch_reports[i] for i in sorted(batch_reports)]
+        if token_batch_mode:
+            removed = _dedupe_overlap_findings(reports)
+            job.emit({'type': 'dedupe', 'removed': removed})
+        merged = {}
+        async for event in _pro_tree_merge(server_api_key, system_instruction, req.query, reports):
+            if event['type'] == 'merged':
+                merged = event['result']
+                continue
+            job.emit(event)
+        await _finish({"status": "complete", "result": merged})
+        job.emit({'type': 'done', 'analysis_id': analysis_id, 'result': merged})
+    except Exception as e:
+        await _finish({"status": "failed", "error": str(e)})
+        job.emit({'type': 'error', 'message': str(e)})
+
 @api_router.post("/pro/analyze/stream")
 async def pro_analyze_stream(req: ProAnalyzeRequest):
     # Use server-side key
@@ -540,59 +2365,31 @@ async def pro_analyze_stream(req: ProAnalyzeRequest):
         # yield f"data: {json.dumps({'type':'error','message':'GOOGLE_API_KEY_DEEP_DIVE not configured'})}\n\n"
         raise HTTPException(status_code=500, detail="GOOGLE_API_KEY_DEEP_DIVE not configured")
 
+    timings = _start_analysis_timings("pro_analyze")
     doc = await db.pro_documents.find_one({"id": req.pro_document_id}, {"_id": 0})
     if not doc: raise HTTPException(status_code=404, detail="Pro document not found")
-    total_pages = doc.get('total_pages', 0)
+    _require_ready(doc)
     parts = doc.get('parts', [])
-    estimated_tokens = _estimate_tokens_for_pages(total_pages)
+    with StageTimer("token_count"): token_counts = await _ensure_pro_token_counts(server_api_key, doc)
+    estimated_tokens = token_counts['total']
     multi_part_mode = len(parts) > 1
-    token_batch_mode = estimated_tokens > PRO_TOKEN_SAFETY_LIMIT
+    token_batch_mode = any(t > PRO_TOKEN_SAFETY_LIMIT for t in token_counts['parts'])
     batch_mode = multi_part_mode or token_batch_mode
     analysis_id = str(uuid.uuid4())
-    analysis = {"id": analysis_id, "pro_document_id": req.pro_document_id, "document_name": doc.get('filename'), "query": req.query, "mode": "pro_native_pdf", "model_preferred": "gemini-1.5-pro", "model_used": None, "batch_mode": batch_mode, "estimated_tokens": estimated_tokens, "status": "in_progress", "findings": [], "structure": None, "created_at": datetime.now(timezone.utc).isoformat()}
-    await db.pro_analyses.insert_one(analysis)
-
-    async def generate():
-        try:
-            yield f"data: {json.dumps({'type':'start','analysis_id':analysis_id,'total_pages':total_pages,'batch_mode':batch_mode,'estimated_tokens':estimated_tokens,'parts': [{'start':p['start_page'],'end':p['end_page']} for p in parts]})}\n\n"
-            system_instruction = await _pro_system_instruction()
-            if not batch_mode:
-                global_page_note = "\n".join([f"- Part {p['part_index']}: this file starts at Global Page {p['start_page']} (ends at {p['end_page']})." for p in parts])
-                user_text = f"USER QUERY:\n{req.query}\n\nGLOBAL PAGE OFFSETS:\n{global_page_note}\n\nNow perform the process and return JSON."
-                resp = await gemini_generate_content_with_files(api_key=server_api_key, model_preferred="gemini-1.5-pro", system_instruction=system_instruction, user_text=user_text, file_uris=_build_file_uri_parts(parts))
-                model_used = resp.get('__model_used__')
-                parsed = _safe_parse_json(_extract_candidate_json_text(resp))
-                await db.pro_analyses.update_one({"id": analysis_id}, {"$set": {"model_used": model_used, "status": "complete", "result": parsed}})
-                yield f"data: {json.dumps({'type':'done','analysis_id':analysis_id,'model_used':model_used,'result':parsed})}\n\n"
-                return
-
-            batch_results = []
-            if multi_part_mode:
-                for idx, p in enumerate(parts, 1):
-                    b_start, b_end = p['start_page'], p['end_page']
-                    yield f"data: {json.dumps({'type':'batch_start','batch': idx,'total_batches': len(parts),'pages': {'start': b_start, 'end': b_end}})}\n\n"
-                    user_text = f"PART {idx} of {len(parts)}.\nUSER QUERY:\n{req.query}\n\nGLOBAL PAGE NOTE:\nThis file contains pages {b_start} to {b_end}.\n\nReturn JSON findings for this part only."
-                    resp = await gemini_generate_content_with_files(api_key=server_api_key, model_preferred="gemini-1.5-pro", system_instruction=system_instruction, user_text=user_text, file_uris=[{"mime_type": "application/pdf", "file_uri": p['gemini_file_uri']}])
-                    batch_results.append(_safe_parse_json(_extract_candidate_json_text(resp)))
-                    yield f"data: {json.dumps({'type':'batch_done','batch': idx})}\n\n"
-            else:
-                 # Token batch mode logic (omitted for brevity, can be added if needed, but strict 1 file limit usually avoids this)
-                 pass
-
-            merge_prompt = {"batches": batch_results, "instruction": "Combine into one cohesive report."}
-            resp_merge = await gemini_generate_content_with_files(api_key=server_api_key, model_preferred="gemini-1.5-pro", system_instruction=system_instruction, user_text=json.dumps(merge_prompt), file_uris=[])
-            merged = _safe_parse_json(_extract_candidate_json_text(resp_merge))
-            await db.pro_analyses.update_one({"id": analysis_id}, {"$set": {"status": "complete", "result": merged}})
-            yield f"data: {json.dumps({'type':'done','analysis_id':analysis_id,'result':merged})}\n\n"
-        except Exception as e:
-            await db.pro_analyses.update_one({"id": analysis_id}, {"$set": {"status": "failed", "error": str(e)}})
-            yield f"data: {json.dumps({'type':'error','message':str(e)})}\n\n"
-
-    return StreamingResponse(generate(), media_type="text/event-stream")
+    # The client's key is never stored; jobs (including resumed ones) use the server-side key.
+    params = req.model_dump(exclude={"gemini_api_key"})
+    analysis = {"id": analysis_id, "pro_document_id": req.pro_document_id, "document_name": doc.get('filename'), "query": req.query, "mode": "pro_native_pdf", "model_preferred": "gemini-1.5-pro", "model_used": None, "batch_mode": batch_mode, "token_batch_mode": token_batch_mode, "estimated_tokens": estimated_tokens, "token_source": token_counts['parts_source'], "status": "queued", "lease": _analysis_lease(), "params": params, "findings": [], "structure": None, "timings": _analysis_timings_summary(timings), "created_at": datetime.now(timezone.utc).isoformat()}
+    with StageTimer("mongo_write"): await db.pro_analyses.insert_one(analysis)
+    return await _start_analysis_stream("pro_analyses", analysis_id)
 
 @api_router.get("/pro/analyses")
-async def list_pro_analyses():
-    return await db.pro_analyses.find({}, {"_id": 0}).to_list(100)
+async def list_pro_analyses(response: Response, limit: int = LIST_DEFAULT_LIMIT, cursor: Optional[str] = None, order: str = "desc", pro_document_id: Optional[str] = None, status: Optional[str] = None):
+    query = {k: v for k, v in (("pro_document_id", pro_document_id), ("status", status)) if v}
+    return await _list_page("pro_analyses", response, query, limit, cursor, None, order)
+
+@api_router.get("/pro/analyses/{analysis_id}/events")
+async def pro_analysis_events(analysis_id: str, request: Request, last_event_id: Optional[str] = None):
+    return await _analysis_events_response("pro_analyses", analysis_id, request, last_event_id)
 
 @api_router.get("/pro/analyses/{analysis_id}")
 async def get_pro_analysis(analysis_id: str):
@@ -600,6 +2397,52 @@ async def get_pro_analysis(analysis_id: str):
     if not a: raise HTTPException(status_code=404, detail="Pro analysis not found")
     return a
 
+def _pro_chat_cache_key(doc: Dict[str, Any], system_instruction: str) -> str:
+    # A handle is only reusable while the system instruction and the uploaded parts are the ones it was built from.
+    raw = json.dumps([system_instruction, [p.get('gemini_file_uri') for p in doc.get('parts', [])]])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+async def _pro_chat_cache(api_key: str, doc: Dict[str, Any], system_instruction: str) -> Optional[Dict[str, Any]]:
+    # Returns a live cachedContents handle for the document, creating or refreshing it as needed; None means
+    # "send the files inline this time".
+    cache = doc.get('chat_cache') or {}
+    key = _pro_chat_cache_key(doc, system_instruction)
+    now = datetime.now(timezone.utc)
+    expires_at = _parse_rfc3339(cache.get('expire_time'))
+    if cache.get('name') and cache.get('key') == key and expires_at and (expires_at - now).total_seconds() > PRO_CHAT_CACHE_REFRESH_MARGIN_SECONDS: return cache
+    failed_at = cache.get('failed_at')
+    if failed_at and cache.get('key') == key and (now - datetime.fromisoformat(failed_at)).total_seconds() < PRO_CHAT_CACHE_RETRY_SECONDS: return None
+    task = _pro_chat_cache_inflight.get(doc['id'])
+    if task is None:
+        task = asyncio.ensure_future(_create_pro_chat_cache(api_key, doc, system_instruction, key))
+        _pro_chat_cache_inflight[doc['id']] = task
+        task.add_done_callback(lambda _: _pro_chat_cache_inflight.pop(doc['id'], None))
+    return await asyncio.shield(task)
+
+async def _create_pro_chat_cache(api_key: str, doc: Dict[str, Any], system_instruction: str, key: str) -> Optional[Dict[str, Any]]:
+    previous = (doc.get('chat_cache') or {}).get('name')
+    now = datetime.now(timezone.utc)
+    try:
+        model = await gemini_select_pro_model(api_key)
+        created = await gemini_cached_contents_create(api_key, model, system_instruction, _build_file_uri_parts(doc.get('parts', [])), PRO_CHAT_CACHE_TTL_SECONDS, display_name=f"pro-chat {doc.get('filename', '')}")
+    except Exception as e:
+        error = str(getattr(e, 'detail', e))
+        logging.warning(f"Context cache create failed for {doc['id']}, sending files inline: {error}")
+        await db.pro_documents.update_one({"id": doc['id']}, {"$set": {"chat_cache": {"name": None, "key": key, "failed_at": now.isoformat(), "error": error[:500]}}})
+        return None
+    cache = {"name": created.get('name'), "model": model, "key": key, "expire_time": created.get('expireTime') or (now + timedelta(seconds=PRO_CHAT_CACHE_TTL_SECONDS)).isoformat(), "created_at": now.isoformat()}
+    await db.pro_documents.update_one({"id": doc['id']}, {"$set": {"chat_cache": cache}})
+    if previous and previous != cache['name']:
+        try: await gemini_cached_contents_delete(api_key, previous)
+        except Exception: pass
+    return cache
+
+async def _drop_pro_chat_cache(api_key: str, doc_id: str, name: Optional[str]) -> None:
+    if not name: return
+    await db.pro_documents.update_one({"id": doc_id, "chat_cache.name": name}, {"$set": {"chat_cache": None}})
+    try: await gemini_cached_contents_delete(api_key, name)
+    except Exception: pass
+
 @api_router.post("/pro/chat")
 async def pro_chat(req: ProChatRequest):
     # Use server-side key
@@ -609,6 +2452,8 @@ async def pro_chat(req: ProChatRequest):
 
     doc = await db.pro_documents.find_one({"id": req.pro_document_id}, {"_id": 0})
     if not doc: raise HTTPException(status_code=404, detail="Pro document not found")
+    _require_ready(doc)
+    doc = await _refresh_expired_pro_parts(server_api_key, doc)
     session = None
     if req.session_id: session = await db.pro_chat_sessions.find_one({"id": req.session_id}, {"_id": 0})
     if not session:
@@ -618,63 +2463,371 @@ async def pro_chat(req: ProChatRequest):
     global_note = "\n".join([f"- Part {p['part_index']}: this file starts at Global Page {p['start_page']} (ends at {p['end_page']})." for p in parts])
     system_instruction = await _pro_system_instruction()
     user_text = f"FOLLOW-UP QUESTION:\n{req.message}\n\nGLOBAL PAGE OFFSETS:\n{global_note}\n\nAnswer with quotes + global page citations in JSON."
-    resp = await gemini_generate_content_with_files(api_key=server_api_key, model_preferred="gemini-1.5-pro", system_instruction=system_instruction, user_text=user_text, file_uris=_build_file_uri_parts(parts))
+    resp = None
+    doc_tokens = (doc.get('token_counts') or {}).get('total', 0)
+    cache = await _pro_chat_cache(server_api_key, doc, system_instruction)
+    if cache:
+        try: resp = await gemini_generate_content_cached(server_api_key, cache, user_text, estimated_tokens=doc_tokens)
+        except Exception as e:
+            # Expired or evicted server-side before our TTL said so: forget the handle and answer inline.
+            logging.warning(f"Cached pro chat failed for {doc['id']}, falling back to inline files: {getattr(e, 'detail', e)}")
+            await _drop_pro_chat_cache(server_api_key, doc['id'], cache.get('name'))
+    cached_context = resp is not None
+    if resp is None: resp = await gemini_generate_content_with_files(api_key=server_api_key, model_preferred="gemini-1.5-pro", system_instruction=system_instruction, user_text=user_text, file_uris=_build_file_uri_parts(parts), estimated_tokens=doc_tokens)
     parsed = _safe_parse_json(_extract_candidate_json_text(resp))
     await db.pro_chat_sessions.update_one({"id": session['id']}, {"$push": {"history": {"role": "user", "content": req.message, "at": datetime.now(timezone.utc).isoformat()}}})
     await db.pro_chat_sessions.update_one({"id": session['id']}, {"$push": {"history": {"role": "assistant", "content": parsed, "at": datetime.now(timezone.utc).isoformat()}}})
-    return {"session_id": session['id'], "answer": parsed}
+    return {"session_id": session['id'], "answer": parsed, "cached_context": cached_context}
+
+class AnalysisWriter:
+    """Buffers findings, page logs and coverage counters for one analysis and flushes them in one update.
+
+    Flushes happen every ANALYSIS_FLUSH_MAX_ITEMS buffered items or ANALYSIS_FLUSH_INTERVAL_SECONDS, and only at
+    batch boundaries: each flush writes the buffered results together with the checkpoint they lead up to, so a
+    resumed analysis restarts exactly after the last flushed batch without duplicating or losing findings.
+    """
+
+    def __init__(self, analysis_id: str, total_pages: int):
+        self.analysis_id = analysis_id
+        self.total_pages = total_pages
+        self.findings: List[dict] = []
+        self.page_log: List[dict] = []
+        self.total_findings = 0
+        self.pages_analyzed = 0
+        self.pages_skipped = 0
+        self.match_pages: set = set()
+        self.cache = {"hits": 0, "misses": 0}
+        self.progress: Optional[dict] = None
+        self.checkpoint = {"document_index": 0, "batches_done": 0}
+        self.pending_state: dict = {}  # extra $set fields that must land with the next checkpoint
+        self.last_flush = time.monotonic()
+
+    def restore(self, analysis: dict) -> None:
+        # Counters as of the analysis' last checkpoint (a resumed run continues from there).
+        coverage = analysis.get("page_coverage") or {}
+        self.pages_analyzed, self.pages_skipped = coverage.get("pages_analyzed", 0), coverage.get("pages_skipped", 0)
+        self.total_findings = analysis.get("total_findings", 0)
+        self.cache.update({k: (analysis.get("batch_cache") or {}).get(k, 0) for k in ("hits", "misses")})
+        self.match_pages = {(f.get('document'), f.get('page_number')) for f in analysis.get("findings", []) if f.get('match_type') != 'possible'}
+        self.checkpoint = analysis.get("checkpoint") or self.checkpoint
+
+    def add_finding(self, finding: dict) -> None:
+        self.findings.append(finding)
+        self.total_findings += 1
+        if finding.get('match_type') != 'possible': self.match_pages.add((finding.get('document'), finding.get('page_number')))
+
+    def discard_findings(self, mark: int) -> None:
+        # Drops the findings buffered since `mark`: a retried batch retracted them. Flushes only happen at batch
+        # boundaries, so they have not been written yet.
+        dropped, self.findings = self.findings[mark:], self.findings[:mark]
+        self.total_findings -= len(dropped)
+        self.match_pages -= {(f.get('document'), f.get('page_number')) for f in dropped}
+
+    def add_page_log(self, entries: List[dict], skipped: bool = False) -> None:
+        self.page_log.extend(entries)
+        if skipped: self.pages_skipped += len(entries)
+        else: self.pages_analyzed += len(entries)
+
+    def coverage(self) -> dict:
+        return {"total_pages": self.total_pages, "pages_analyzed": self.pages_analyzed, "pages_skipped": self.pages_skipped, "pages_with_findings": len(self.match_pages), "coverage_percent": round((self.pages_analyzed / self.total_pages * 100) if self.total_pages > 0 else 0, 1)}
+
+    async def maybe_flush(self) -> bool:
+        if len(self.findings) + len(self.page_log) >= ANALYSIS_FLUSH_MAX_ITEMS or time.monotonic() - self.last_flush >= ANALYSIS_FLUSH_INTERVAL_SECONDS:
+            await self.flush()
+            return True
+        return False
+
+    async def flush(self, extra_set: Optional[dict] = None) -> None:
+        state = {"page_coverage": self.coverage(), "total_findings": self.total_findings, "batch_cache.hits": self.cache["hits"], "batch_cache.misses": self.cache["misses"], "checkpoint": self.checkpoint, **self.pending_state, **(extra_set or {})}
+        timings = _analysis_timings.get()
+        if timings is not None and "timings" not in state: state["timings"] = _analysis_timings_summary(timings)
+        if self.progress: state["progress"] = self.progress
+        update: Dict[str, Any] = {"$set": state}
+        pushes = {k: {"$each": v} for k, v in (("findings", self.findings), ("page_log", self.page_log)) if v}
+        if pushes: update["$push"] = pushes
+        with StageTimer("mongo_write"): await db.analyses.update_one({"id": self.analysis_id}, update)
+        self.findings, self.page_log, self.pending_state = [], [], {}
+        self.last_flush = time.monotonic()
+
+class AnalysisJob:
+    """An analysis running in this worker: numbers its events, fans them out to SSE subscribers and persists them.
+
+    Event ids are "attempt:seq". Events are written to analysis_events when the analysis checkpoints, so after a
+    crash the log ends exactly where the resumed attempt picks up; the new attempt's ids sort after every id the
+    dead one handed out, persisted or not, so a client's Last-Event-ID never skips events.
+    """
+
+    def __init__(self, collection: str, analysis_id: str, attempt: int):
+        self.collection, self.analysis_id, self.attempt = collection, analysis_id, attempt
+        self.seq = 0
+        self.events: List[Tuple[int, dict]] = []  # this attempt's events, for subscribers that attach mid-run
+        self.unflushed: List[dict] = []
+        self.subscribers: set = set()
+        self.done = False
+        self.task: Optional[asyncio.Task] = None
+        self.timings: Optional[Dict[str, Any]] = None  # set by the runner; restored from the record on resume
+
+    def emit(self, event: dict, stored: Optional[dict] = None) -> None:
+        # stored: lighter copy for the event log when the live event carries bulky payloads already on the analysis.
+        self.seq += 1
+        self.events.append((self.seq, event))
+        self.unflushed.append({"analysis_id": self.analysis_id, "attempt": self.attempt, "seq": self.seq, "event": stored or event, "created_at": datetime.now(timezone.utc)})
+        for queue in self.subscribers: queue.put_nowait((self.attempt, self.seq, event))
+
+    async def flush_events(self) -> None:
+        if not self.unflushed: return
+        batch, self.unflushed = self.unflushed, []
+        with StageTimer("mongo_write"): await db.analysis_events.insert_many(batch)
+
+    def finish(self) -> None:
+        self.done = True
+        for queue in self.subscribers: queue.put_nowait(None)
+
+def _parse_event_id(value: Optional[str]) -> Tuple[int, int]:
+    if not value: return (0, 0)
+    try:
+        attempt, seq = value.split(":")
+        return (int(attempt), int(seq))
+    except ValueError: raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+
+def _sse_event(attempt: int, seq: int, event: dict) -> str:
+    return f"id: {attempt}:{seq}\ndata: {json.dumps(event)}\n\n"
+
+def _analysis_lease() -> dict:
+    return {"owner": WORKER_ID, "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ANALYSIS_LEASE_SECONDS)}
+
+async def _claim_analysis(collection: str, analysis_id: str) -> Optional[dict]:
+    # Takes (or renews) the lease on a queued/in-progress analysis; None when another live worker holds it.
+    now = datetime.now(timezone.utc)
+    return await db[collection].find_one_and_update(
+        {"id": analysis_id, "status": {"$in": ["queued", "in_progress"]}, "$or": [{"lease": {"$exists": False}}, {"lease.expires_at": {"$lt": now}}, {"lease.owner": WORKER_ID}]},
+        {"$set": {"status": "in_progress", "lease": _analysis_lease()}, "$inc": {"attempts": 1}},
+        projection={"_id": 0, "page_log": 0}, return_document=ReturnDocument.AFTER)
+
+async def _analysis_lease_heartbeat(job: AnalysisJob) -> None:
+    while True:
+        await asyncio.sleep(ANALYSIS_LEASE_SECONDS / 3)
+        renewed = await db[job.collection].update_one({"id": job.analysis_id, "lease.owner": WORKER_ID}, {"$set": {"lease.expires_at": datetime.now(timezone.utc) + timedelta(seconds=ANALYSIS_LEASE_SECONDS)}})
+        if renewed.matched_count == 0:
+            # Stalled past the lease and another worker resumed it: stop rather than run it twice.
+            logging.warning(f"Lost the lease on analysis {job.analysis_id}; stopping this attempt")
+            job.task.cancel()
+            return
+
+async def _run_analysis_job(job: AnalysisJob, analysis: dict) -> None:
+    heartbeat = asyncio.create_task(_analysis_lease_heartbeat(job))
+    try:
+        if not analysis.get("params"): raise RuntimeError("Analysis was interrupted and cannot be resumed")
+        await ANALYSIS_RUNNERS[job.collection](job, analysis)
+    except asyncio.CancelledError:
+        # Shutdown or lost lease: events past the last checkpoint describe work the next attempt redoes, so the
+        # log stops at the checkpoint and the analysis stays in_progress for the next claim.
+        job.unflushed = []
+        raise
+    except Exception as e:
+        # Runners record their own expected failures; this catches anything that escaped them.
+        logging.exception(f"Analysis {job.analysis_id} failed")
+        await db[job.collection].update_one({"id": job.analysis_id, "status": "in_progress"}, {"$set": {"status": "failed", "error": str(e)}})
+        job.emit({"type": "error", "message": str(e)})
+    finally:
+        heartbeat.cancel()
+        try:
+            await job.flush_events()
+            await db[job.collection].update_one({"id": job.analysis_id, "lease.owner": WORKER_ID}, {"$unset": {"lease": ""}})
+        except Exception as e: logging.warning(f"Could not release analysis {job.analysis_id}: {e}")
+        _analysis_jobs.pop(job.analysis_id, None)
+        job.finish()
+
+async def _start_analysis_job(collection: str, analysis_id: str) -> Optional[AnalysisJob]:
+    if analysis_id in _analysis_jobs: return _analysis_jobs[analysis_id]
+    analysis = await _claim_analysis(collection, analysis_id)
+    if not analysis: return None
+    job = AnalysisJob(collection, analysis_id, analysis.get("attempts", 1))
+    _analysis_jobs[analysis_id] = job
+    job.task = _spawn_background(_run_analysis_job(job, analysis))
+    if job.attempt > 1: logging.info(f"Resuming analysis {analysis_id} (attempt {job.attempt})")
+    return job
+
+async def _resume_orphaned_analyses() -> None:
+    # Analyses whose worker died (lease lapsed) or that never got claimed are picked up by whoever sweeps first.
+    now = datetime.now(timezone.utc)
+    for collection in ANALYSIS_RUNNERS:
+        async for row in db[collection].find({"status": {"$in": ["queued", "in_progress"]}, "$or": [{"lease": {"$exists": False}}, {"lease.expires_at": {"$lt": now}}]}, {"_id": 0, "id": 1}):
+            if row["id"] not in _analysis_jobs: await _start_analysis_job(collection, row["id"])
+
+async def _resume_analyses_loop() -> None:
+    while True:
+        try: await _resume_orphaned_analyses()
+        except Exception as e: logging.warning(f"Analysis resume sweep failed: {e}")
+        page_index.evict_idle()  # the sweep doubles as idle eviction for the BM25 index
+        await asyncio.sleep(ANALYSIS_RESUME_SWEEP_SECONDS)
+
+async def _analysis_event_stream(collection: str, analysis_id: str, after: Tuple[int, int]) -> AsyncIterator[str]:
+    # Replays the event log after `after`, then tails the job live (same worker) or by polling the log (other worker).
+    job = _analysis_jobs.get(analysis_id)
+    queue: asyncio.Queue = asyncio.Queue()
+    if job: job.subscribers.add(queue)
+    last = after
+    try:
+        query = {"analysis_id": analysis_id, "$or": [{"attempt": {"$gt": last[0]}}, {"attempt": last[0], "seq": {"$gt": last[1]}}]}
+        async for row in db.analysis_events.find(query, {"_id": 0, "attempt": 1, "seq": 1, "event": 1}).sort([("attempt", 1), ("seq", 1)]):
+            if job and row["attempt"] >= job.attempt: break  # the running attempt is served from memory below
+            yield _sse_event(row["attempt"], row["seq"], row["event"])
+            last = (row["attempt"], row["seq"])
+        if job:
+            for seq, event in list(job.events):
+                if (job.attempt, seq) > last:
+                    yield _sse_event(job.attempt, seq, event)
+                    last = (job.attempt, seq)
+            while not (job.done and queue.empty()):
+                item = await queue.get()
+                if item is None: break
+                if item[:2] > last:
+                    yield _sse_event(*item)
+                    last = item[:2]
+            return
+        terminal_polls = 0
+        while terminal_polls < 2:
+            # Status is read before the log so a job that just finished gets one more poll to flush its last events.
+            analysis = await db[collection].find_one({"id": analysis_id}, {"_id": 0, "status": 1})
+            terminal_polls = terminal_polls + 1 if not analysis or analysis["status"] not in ("queued", "in_progress") else 0
+            query = {"analysis_id": analysis_id, "$or": [{"attempt": {"$gt": last[0]}}, {"attempt": last[0], "seq": {"$gt": last[1]}}]}
+            async for row in db.analysis_events.find(query, {"_id": 0, "attempt": 1, "seq": 1, "event": 1}).sort([("attempt", 1), ("seq", 1)]):
+                yield _sse_event(row["attempt"], row["seq"], row["event"])
+                last = (row["attempt"], row["seq"])
+                if row["event"].get("type") == "done": return
+            if analysis_id in _analysis_jobs:
+                # Resumed in this worker meanwhile: switch to tailing it live.
+                async for chunk in _analysis_event_stream(collection, analysis_id, last): yield chunk
+                return
+            if terminal_polls < 2: await asyncio.sleep(ANALYSIS_EVENTS_POLL_SECONDS)
+    finally:
+        if job: job.subscribers.discard(queue)
+
+async def _timed_event_stream(job: AnalysisJob, stream: AsyncIterator[str]) -> AsyncIterator[str]:
+    # first_event_seconds is measured once the first event has been handed to the client (the generator resumes
+    # only after the response wrote it), and saved right away since the job may already have written its summary.
+    async for chunk in stream:
+        yield chunk
+        if job.timings is not None and _mark_analysis_timing(job.timings, "first_event_seconds"):
+            with StageTimer("mongo_write"): await db[job.collection].update_one({"id": job.analysis_id}, {"$set": {"timings.first_event_seconds": round(job.timings["first_event_seconds"], 4)}})
+
+async def _analysis_events_response(collection: str, analysis_id: str, request: Request, last_event_id: Optional[str]) -> StreamingResponse:
+    after = _parse_event_id(request.headers.get("last-event-id") or last_event_id)
+    analysis = await db[collection].find_one({"id": analysis_id}, {"_id": 0, "status": 1})
+    if not analysis: raise HTTPException(status_code=404, detail="Analysis not found")
+    # A client reconnecting to an orphaned analysis resumes it here instead of waiting for the sweep.
+    if analysis["status"] in ("queued", "in_progress"): await _start_analysis_job(collection, analysis_id)
+    return StreamingResponse(_analysis_event_stream(collection, analysis_id, after), media_type="text/event-stream")
+
+async def _start_analysis_stream(collection: str, analysis_id: str) -> StreamingResponse:
+    # The row is inserted already leased to this worker, so the claim normally succeeds; should another worker still
+    # win it, the client just tails that worker's event log.
+    job = await _start_analysis_job(collection, analysis_id)
+    stream = _analysis_event_stream(collection, analysis_id, (0, 0))
+    return StreamingResponse(_timed_event_stream(job, stream) if job else stream, media_type="text/event-stream")
+
+async def _run_text_analysis(job: AnalysisJob, analysis: dict) -> None:
+    analysis_id = analysis["id"]
+    request = AnalyzeRequest(**analysis["params"])
+    timings = job.timings = _start_analysis_timings("analyze", analysis.get("timings"))
+    _scheduler_lane.set((analysis_id, request.priority))
+    effective_rubric_text = analysis["rubric_text"]
+    total_pages = analysis["page_coverage"]["total_pages"]
+    writer = AnalysisWriter(analysis_id, total_pages)
+    writer.restore(analysis)
+    checkpoint = dict(writer.checkpoint)
+    if job.attempt > 1: job.emit({'type': 'resumed', 'analysis_id': analysis_id, 'attempt': job.attempt, 'checkpoint': checkpoint, 'total_findings': writer.total_findings, 'coverage': writer.coverage()})
+    else: job.emit({'type': 'start', 'analysis_id': analysis_id, 'total_pages': total_pages, 'documents': analysis["document_names"], 'rubric_text': effective_rubric_text, 'relevance_mode': request.relevance_mode})
+    for index, planned in enumerate(analysis["plan"]):
+        if index < checkpoint["document_index"]: continue
+        start_batch = checkpoint["batches_done"] if index == checkpoint["document_index"] else 0
+        doc = await db.documents.find_one({"id": planned["document_id"]}, {"_id": 0})
+        if not doc: raise RuntimeError(f"Document {planned['document_id']} was deleted during the analysis")
+        doc = {**doc, 'total_pages': planned['total_pages']}
+        job.emit({'type': 'document_start', 'document': doc['filename'], 'pages': doc['total_pages']})
+        scan_pages = doc['total_pages']
+        if request.prefilter == 'bm25':
+            selected = (analysis.get("prefilter_selected") or {}).get(doc['id']) if start_batch else None
+            if selected is None:
+                index_key = await _ensure_page_index(doc)
+                in_range = await _page_numbers_in_range(doc, request.page_start, request.page_end)
+                scores = page_index.score(index_key, request.query, request.page_start, request.page_end)
+                selected = _select_prefilter_pages(scores, in_range, request.prefilter_top_k, request.prefilter_context_pages)
+                if not selected:
+                    # No page shares a term with the query (synonyms, OCR noise): scanning nothing would look like a
+                    # clean "no findings", so scan the whole range instead and say why.
+                    selected = in_range
+                    job.emit({'type': 'warning', 'code': 'prefilter_no_hits', 'document': doc['filename'], 'message': 'bm25 prefilter matched no pages; scanning every page in range'})
+                selected_set = set(selected)
+                skipped_log = [{"page_number": n, "status": "skipped", "summary": "Skipped by bm25 prefilter", "document": doc['filename']} for n in in_range if n not in selected_set]
+                writer.add_page_log(skipped_log, skipped=True)
+                writer.pending_state[f"prefilter_selected.{doc['id']}"] = selected
+                job.emit({'type': 'prefilter', 'document': doc['filename'], 'mode': 'bm25', 'selected_pages': selected, 'skipped_pages': len(skipped_log)})
+            scan_pages = len(selected)
+            doc_pages = _iter_document_pages(doc, request.page_start, request.page_end, page_numbers=selected)
+            page_stats = await _document_page_stats(doc, request.page_start, request.page_end, page_numbers=selected)
+        else:
+            doc_pages = _iter_document_pages(doc, request.page_start, request.page_end)
+            page_stats = await _document_page_stats(doc, request.page_start, request.page_end)
+        async for update in deep_analyze_stream(doc_pages, request.query, doc['filename'], request.model, request.speed, effective_rubric_text, request.relevance_mode, request.concurrency or DEEP_SCAN_DEFAULT_CONCURRENCY, total_pages=scan_pages, use_cache=not request.bypass_cache, page_stats=page_stats, start_batch=start_batch):
+            stored = None
+            if update['type'] == 'finding':
+                writer.add_finding(update['finding'])
+                _mark_analysis_timing(timings, "first_finding_seconds")
+            elif update['type'] == 'batch_complete':
+                writer.add_page_log(update.get('page_log', []))
+                writer.checkpoint = {"document_index": index, "batches_done": update['batch']}
+            elif update['type'] == 'progress':
+                writer.progress = {"document": doc['filename'], "batch": update['batch'], "total_batches": update['total_batches'], "pages": update['pages']}
+                batch_mark = len(writer.findings)
+            elif update['type'] == 'batch_reset': writer.discard_findings(batch_mark)
+            elif update['type'] == 'complete':
+                cache = update.get('cache', {})
+                writer.cache["hits"] += cache.get('hits', 0)
+                writer.cache["misses"] += cache.get('misses', 0)
+                writer.checkpoint = {"document_index": index + 1, "batches_done": 0}
+                stored = {k: v for k, v in update.items() if k not in ("findings", "page_log")}  # already on the analysis
+            job.emit(update, stored)
+            if update['type'] in ('batch_complete', 'complete') and await writer.maybe_flush(): await job.flush_events()
+    metrics.inc("deepdive_pages_scanned_total", writer.pages_analyzed, help="Pages analysed by text deep scans")
+    metrics.inc("deepdive_analyses_total", help="Finished analyses", endpoint="analyze", status="complete")
+    await writer.flush({"status": "complete", "timings": _analysis_timings_summary(timings)})
+    job.emit({'type': 'done', 'analysis_id': analysis_id, 'total_findings': writer.total_findings, 'coverage': writer.coverage()})
+
+ANALYSIS_RUNNERS = {"analyses": _run_text_analysis, "pro_analyses": _run_pro_analysis}
 
 @api_router.post("/analyze/stream")
 async def analyze_documents_stream(request: AnalyzeRequest):
+    # The scan runs as a background job; this response is just its first subscriber (see /analyses/{id}/events).
     if not request.document_ids: raise HTTPException(status_code=400, detail="No documents selected")
     if not request.query.strip(): raise HTTPException(status_code=400, detail="Query is required")
+    timings = _start_analysis_timings("analyze")
     effective_rubric_text = request.rubric_text
     if not effective_rubric_text or not effective_rubric_text.strip():
-        rubric = await generate_query_rubric(request.query, request.model)
+        with StageTimer("rubric"): rubric = await generate_query_rubric(request.query, request.model)
         if rubric.get('error'): raise HTTPException(status_code=500, detail=rubric['error'])
         effective_rubric_text = rubric.get('rubric_text', '')
     analysis_id = str(uuid.uuid4())
     doc_names = []
     total_pages = 0
-    docs_to_process = []
+    plan = []
     for doc_id in request.document_ids:
         doc = await db.documents.find_one({"id": doc_id}, {"_id": 0})
         if doc:
-            pages = doc.get('pages', [])
-            if request.page_start or request.page_end:
-                start = (request.page_start or 1) - 1
-                end = request.page_end or len(pages)
-                pages = [p for p in pages if start < p['page_number'] <= end]
-                doc = {**doc, 'pages': pages, 'total_pages': len(pages)}
-            docs_to_process.append(doc)
+            _require_ready(doc)
+            doc_pages = await _count_document_pages(doc, request.page_start, request.page_end)
+            plan.append({"document_id": doc_id, "total_pages": doc_pages})
             doc_names.append(doc['filename'])
-            total_pages += len(pages)
-    analysis = {"id": analysis_id, "document_ids": request.document_ids, "document_names": doc_names, "query": request.query, "model": request.model, "speed": request.speed, "relevance_mode": request.relevance_mode, "rubric_text": effective_rubric_text, "findings": [], "page_coverage": {"total_pages": total_pages, "pages_analyzed": 0, "pages_with_findings": 0, "coverage_percent": 0}, "page_log": [], "status": "in_progress", "analyzed_at": datetime.now(timezone.utc).isoformat()}
-    await db.analyses.insert_one(analysis)
-    
-    async def generate():
-        yield f"data: {json.dumps({'type': 'start', 'analysis_id': analysis_id, 'total_pages': total_pages, 'documents': doc_names, 'rubric_text': effective_rubric_text, 'relevance_mode': request.relevance_mode})}\n\n"
-        for doc in docs_to_process:
-            yield f"data: {json.dumps({'type': 'document_start', 'document': doc['filename'], 'pages': doc['total_pages']})}\n\n"
-            doc_page_logs = []
-            async for update in deep_analyze_stream(doc.get('pages', []), request.query, doc['filename'], request.model, request.speed, effective_rubric_text, request.relevance_mode):
-                if update['type'] == 'finding':
-                    await db.analyses.update_one({"id": analysis_id}, {"$push": {"findings": update['finding']}})
-                    if update['finding'].get('match_type') == 'match': await db.analyses.update_one({"id": analysis_id}, {"$inc": {"page_coverage.pages_with_findings": 1}})
-                elif update['type'] == 'complete':
-                    page_log = update.get('page_log', [])
-                    doc_page_logs.extend(page_log)
-                    await db.analyses.update_one({"id": analysis_id}, {"$push": {"page_log": {"$each": page_log}}, "$inc": {"page_coverage.pages_analyzed": len(page_log)}})
-                elif update['type'] == 'progress': await db.analyses.update_one({"id": analysis_id}, {"$set": {"status": "in_progress"}})
-                try: yield f"data: {json.dumps(update)}\n\n"
-                except Exception: pass
-        final_analysis = await db.analyses.find_one({"id": analysis_id}, {"_id": 0})
-        pages_with_findings = len(set(f['page_number'] for f in final_analysis.get('findings', []) if f.get('match_type') != 'possible'))
-        pages_analyzed = final_analysis.get('page_coverage', {}).get('pages_analyzed', 0)
-        await db.analyses.update_one({"id": analysis_id}, {"$set": {"status": "complete", "page_coverage.pages_with_findings": pages_with_findings, "page_coverage.coverage_percent": round((pages_analyzed / total_pages * 100) if total_pages > 0 else 0, 1)}})
-        yield f"data: {json.dumps({'type': 'done', 'analysis_id': analysis_id, 'total_findings': len(final_analysis.get('findings', [])), 'coverage': final_analysis.get('page_coverage', {})})}\n\n"
-    
-    return StreamingResponse(generate(), media_type="text/event-stream")
+            total_pages += doc_pages
+    analysis = {"id": analysis_id, "document_ids": request.document_ids, "document_names": doc_names, "query": request.query, "model": request.model, "speed": request.speed, "relevance_mode": request.relevance_mode, "rubric_text": effective_rubric_text, "prefilter": request.prefilter, "findings": [], "page_coverage": {"total_pages": total_pages, "pages_analyzed": 0, "pages_skipped": 0, "pages_with_findings": 0, "coverage_percent": 0}, "page_log": [], "batch_cache": {"hits": 0, "misses": 0, "bypassed": request.bypass_cache}, "status": "queued", "lease": _analysis_lease(), "params": request.model_dump(), "plan": plan, "checkpoint": {"document_index": 0, "batches_done": 0}, "timings": _analysis_timings_summary(timings), "analyzed_at": datetime.now(timezone.utc).isoformat()}
+    with StageTimer("mongo_write"): await db.analyses.insert_one(analysis)
+    return await _start_analysis_stream("analyses", analysis_id)
+
+@api_router.get("/analyses/{analysis_id}/events")
+async def analysis_events(analysis_id: str, request: Request, last_event_id: Optional[str] = None):
+    # Reconnect point for /analyze/stream: replays everything after Last-Event-ID (header or query), then tails.
+    return await _analysis_events_response("analyses", analysis_id, request, last_event_id)
 
 @api_router.post("/rubric", response_model=RubricResponse)
 async def build_rubric(request: RubricRequest):
@@ -684,8 +2837,9 @@ async def build_rubric(request: RubricRequest):
     return RubricResponse(rubric_text=rubric.get('rubric_text', ''), rubric_json=rubric.get('rubric_json'))
 
 @api_router.get("/analyses")
-async def list_analyses():
-    return await db.analyses.find({}, {"_id": 0, "page_log": 0}).to_list(100)
+async def list_analyses(response: Response, limit: int = LIST_DEFAULT_LIMIT, cursor: Optional[str] = None, order: str = "desc", document_id: Optional[str] = None, status: Optional[str] = None):
+    query = {k: v for k, v in (("document_ids", document_id), ("status", status)) if v}
+    return await _list_page("analyses", response, query, limit, cursor, None, order)
 
 @api_router.get("/analyses/{analysis_id}")
 async def get_analysis(analysis_id: str):
@@ -700,16 +2854,22 @@ async def chat(request: ChatRequest):
         session = {"id": str(uuid.uuid4()), "document_ids": request.document_ids, "messages": [], "created_at": datetime.now(timezone.utc).isoformat()}
         await db.chat_sessions.insert_one(session)
     if not session: raise HTTPException(status_code=404, detail="Session not found")
-    all_pages = []
+    docs = []
     for doc_id in request.document_ids:
         doc = await db.documents.find_one({"id": doc_id}, {"_id": 0})
         if doc:
-            for p in doc.get('pages', []): all_pages.append({**p, "document": doc['filename']})
+            _require_ready(doc)
+            docs.append(doc)
+
+    history = session.get('messages', [])
+    # Follow-ups ("what about the second one?") lean on the previous question's terms for retrieval.
+    previous_question = next((m['content'] for m in reversed(history) if m.get('role') == 'user'), "")
+    context = await _chat_context(session["id"], docs, f"{request.message} {previous_question}")
     user_msg = {"role": "user", "content": request.message, "timestamp": datetime.now(timezone.utc).isoformat()}
-    response = await chat_with_docs(all_pages, request.message, session.get('messages', []))
-    assistant_msg = {"role": "assistant", "content": response, "timestamp": datetime.now(timezone.utc).isoformat()}
+    response = await chat_with_docs(context["context"], request.message, history)
+    assistant_msg = {"role": "assistant", "content": response, "citations": context["citations"], "retrieval": context["retrieval"], "timestamp": datetime.now(timezone.utc).isoformat()}
     await db.chat_sessions.update_one({"id": session["id"]}, {"$push": {"messages": {"$each": [user_msg, assistant_msg]}}})
-    return {"session_id": session["id"], "response": response}
+    return {"session_id": session["id"], "response": response, "citations": context["citations"]}
 
 @api_router.get("/chat/{session_id}")
 async def get_chat(session_id: str):
@@ -725,10 +2885,45 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[LIST_NEXT_CURSOR_HEADER],
 )
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
+@app.on_event("startup")
+async def ensure_indexes():
+    for name in ("documents", "analyses", "pro_documents", "pro_analyses", "status_checks", "chat_sessions", "pro_chat_sessions", "pro_upload_sessions"):
+        await db[name].create_index("id", unique=True)
+    for name, spec in LISTINGS.items():
+        for field in spec["sorts"]: await db[name].create_index([(field, 1), ("id", 1)])
+    await db.analyses.create_index([("document_ids", 1), ("analyzed_at", 1), ("id", 1)])
+    await db.pro_analyses.create_index([("pro_document_id", 1), ("status", 1), ("created_at", 1), ("id", 1)])
+    await db.document_pages.create_index([("doc_id", 1), ("page_number", 1)], unique=True)
+    await db.batch_result_cache.create_index("key", unique=True)
+    await db.batch_result_cache.create_index("created_at", expireAfterSeconds=BATCH_CACHE_TTL_SECONDS)
+    await db.batch_result_cache.create_index("last_hit_at")
+    await db.rubric_cache.create_index("key", unique=True)
+    await db.rubric_cache.create_index("created_at", expireAfterSeconds=RUBRIC_CACHE_TTL_SECONDS)
+    await db.pro_document_pages.create_index([("pro_document_id", 1), ("page_number", 1)], unique=True)
+    for name in ANALYSIS_RUNNERS: await db[name].create_index([("status", 1), ("lease.expires_at", 1)])
+    await db.analysis_events.create_index([("analysis_id", 1), ("attempt", 1), ("seq", 1)], unique=True)
+    await db.analysis_events.create_index("created_at", expireAfterSeconds=ANALYSIS_EVENTS_TTL_SECONDS)
+    await db.content_refs.create_index([("kind", 1), ("sha256", 1)], unique=True)
+    await db.content_refs.create_index([("kind", 1), ("pages_id", 1)])
+    for name in ("documents", "pro_documents"): await db[name].create_index("pages_doc_id")
+
+@app.on_event("startup")
+async def resume_analyses():
+    global _analysis_resume_task
+    _analysis_resume_task = asyncio.create_task(_resume_analyses_loop())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # Stop running analyses first: each flushes its events and releases its lease so the next start resumes it.
+    if _analysis_resume_task is not None: _analysis_resume_task.cancel()
+    running = [job.task for job in _analysis_jobs.values()]
+    for task in running: task.cancel()
+    await asyncio.gather(*running, return_exceptions=True)
     client.close()
+    if _pdf_pool is not None: _pdf_pool.shutdown(wait=False, cancel_futures=True)
+    if _http_session is not None: await _http_session.close()
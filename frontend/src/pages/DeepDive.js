@@ -41,6 +41,18 @@ import {
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// List endpoints are paginated: keep following X-Next-Cursor until the server has no further page.
+const fetchAllPages = async (url, params = {}) => {
+  const items = [];
+  let cursor = null;
+  do {
+    const res = await axios.get(url, { params: cursor ? { ...params, cursor } : params });
+    items.push(...(res.data || []));
+    cursor = res.headers["x-next-cursor"];
+  } while (cursor);
+  return items;
+};
+
 // Simplified Model Options
 const AI_MODELS = [
   {
@@ -214,25 +226,43 @@ const DocumentUpload = ({ onUploadSuccess }) => {
         });
         const uploadId = init.data.upload_id;
 
-        // Step 2: Chunk upload
-        const chunkSize = 5 * 1024 * 1024; // 5MB
-        let offset = 0;
-        while (offset < file.size) {
-          const end = Math.min(offset + chunkSize, file.size);
-          const blob = file.slice(offset, end);
-          await fetch(`${API}/pro/upload/${uploadId}/chunk`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/octet-stream' },
-            body: blob,
-          });
-          offset = end;
-        }
-
-        // Step 3: Complete
-        await axios.post(`${API}/pro/upload/complete`, {
+        // Step 2: Chunk upload (offset-addressed, checksummed, a few in flight at once)
+        const chunkSize = init.data.chunk_size || 5 * 1024 * 1024; // 5MB
+        const offsets = [];
+        for (let offset = 0; offset < file.size; offset += chunkSize) offsets.push(offset);
+        const sendChunk = async (offset) => {
+          const buf = await file.slice(offset, Math.min(offset + chunkSize, file.size)).arrayBuffer();
+          const digest = await crypto.subtle.digest('SHA-256', buf);
+          const sha256 = Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+          for (let attempt = 0; attempt < 3; attempt++) {
+            const res = await fetch(`${API}/pro/upload/${uploadId}/chunk?offset=${offset}`, {
+              method: 'POST',
+              headers: { 'Content-Type': 'application/octet-stream', 'X-Chunk-Sha256': sha256 },
+              body: buf,
+            });
+            if (res.ok) return;
+          }
+          throw new Error(`Chunk at ${offset} failed`);
+        };
+        const queue = [...offsets];
+        await Promise.all(Array.from({ length: Math.min(4, queue.length) }, async () => {
+          while (queue.length) await sendChunk(queue.shift());
+        }));
+
+        // Step 3: Complete (ingestion runs in the background; poll until every part is ACTIVE)
+        const complete = await axios.post(`${API}/pro/upload/complete`, {
           upload_id: uploadId,
           gemini_api_key: "SERVER_ENV_KEY",
         });
+        const proDocId = complete.data.pro_document_id;
+        onUploadSuccess?.();
+        // Identical content already on the server comes back ready straight away.
+        while (complete.data.status !== 'ready') {
+          await new Promise(r => setTimeout(r, 2000));
+          const ingest = await axios.get(`${API}/pro/documents/${proDocId}/ingest`);
+          if (ingest.data.status === 'ready') break;
+          if (ingest.data.status === 'failed') throw new Error(ingest.data.error || 'Ingestion failed');
+        }
 
         toast.success(`Processed: ${file.name}`);
         onUploadSuccess?.();
@@ -416,6 +446,7 @@ const DeepDive = () => {
   const [analyzing, setAnalyzing] = useState(false);
   const [analysisResult, setAnalysisResult] = useState(null);
   const [progress, setProgress] = useState({ percent: 0, status: '' });
+  const [liveFindings, setLiveFindings] = useState([]);
   
   // Settings
   const [selectedModel, setSelectedModel] = useState("gemini-1.5-pro");
@@ -426,8 +457,7 @@ const DeepDive = () => {
 
   const loadDocuments = async () => {
     try {
-      const res = await axios.get(`${API}/pro/documents`);
-      setProDocuments(res.data || []);
+      setProDocuments(await fetchAllPages(`${API}/pro/documents`));
     } catch (e) {
       console.error(e);
     }
@@ -435,8 +465,7 @@ const DeepDive = () => {
 
   const loadHistory = async () => {
     try {
-      const res = await axios.get(`${API}/pro/analyses`);
-      setHistory(res.data || []);
+      setHistory(await fetchAllPages(`${API}/pro/analyses`));
     } catch (e) {
       console.error(e);
     }
@@ -449,20 +478,30 @@ const DeepDive = () => {
 
   // Restore latest analysis when a document is selected
   useEffect(() => {
-    if (selectedDocs.length === 1 && !analyzing) {
-      const docId = selectedDocs[0];
-      // Find the most recent analysis for this document
-      const lastAnalysis = history.find(h => h.pro_document_id === docId && h.status === 'complete');
-      
-      if (lastAnalysis && lastAnalysis.result) {
-        setAnalysisResult(lastAnalysis.result);
-        setQuery(lastAnalysis.query || "");
-        toast.info("Restored previous analysis", { duration: 2000 });
-      } else {
-        setAnalysisResult(null);
-        setQuery("");
+    if (selectedDocs.length !== 1 || analyzing) return;
+    const docId = selectedDocs[0];
+    let cancelled = false;
+    const restore = async () => {
+      try {
+        // The list returns summaries (newest first); the result itself comes from the analysis' own route
+        const res = await axios.get(`${API}/pro/analyses`, { params: { pro_document_id: docId, status: 'complete', limit: 1 } });
+        const lastAnalysis = (res.data || [])[0];
+        const full = lastAnalysis ? (await axios.get(`${API}/pro/analyses/${lastAnalysis.id}`)).data : null;
+        if (cancelled) return;
+        if (full && full.result) {
+          setAnalysisResult(full.result);
+          setQuery(full.query || "");
+          toast.info("Restored previous analysis", { duration: 2000 });
+        } else {
+          setAnalysisResult(null);
+          setQuery("");
+        }
+      } catch (e) {
+        console.error(e);
       }
-    }
+    };
+    restore();
+    return () => { cancelled = true; };
   }, [selectedDocs, history, analyzing]);
 
   const toggleDoc = (id) => {
@@ -484,10 +523,11 @@ const DeepDive = () => {
     
     setAnalyzing(true);
     setAnalysisResult(null);
+    setLiveFindings([]);
     setProgress({ percent: 5, status: 'Initializing...' });
 
     try {
-      const response = await fetch(`${API}/pro/analyze/stream`, {
+      let response = await fetch(`${API}/pro/analyze/stream`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -498,34 +538,68 @@ const DeepDive = () => {
         })
       });
 
-      const reader = response.body.getReader();
-      const decoder = new TextDecoder();
-
+      // The analysis runs server-side regardless of this connection; if the stream drops before the job
+      // finishes, reconnect to its event log and resume after the last event we saw.
+      let analysisId = null;
+      let lastEventId = null;
+      let finished = false;
+      let reconnects = 0;
       while (true) {
-        const { done, value } = await reader.read();
-        if (done) break;
-        const chunk = decoder.decode(value);
-        const lines = chunk.split('\n');
-        
-        for (const line of lines) {
-          if (!line.startsWith('data: ')) continue;
-          try {
-            const data = JSON.parse(line.slice(6));
-            if (data.type === 'batch_start' || data.type === 'progress') {
-              setProgress({ percent: 50, status: 'Analyzing document content...' });
-            }
-            if (data.type === 'done') {
-              setAnalysisResult(data.result);
-              setProgress({ percent: 100, status: 'Complete' });
-              setAnalyzing(false);
-              loadHistory(); // Refresh history after new analysis
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        try {
+          while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+
+            for (const line of lines) {
+              if (line.startsWith('id: ')) { lastEventId = line.slice(4); continue; }
+              if (!line.startsWith('data: ')) continue;
+              try {
+                const data = JSON.parse(line.slice(6));
+                if (data.analysis_id) analysisId = data.analysis_id;
+                if (data.type === 'batch_start' || data.type === 'progress' || data.type === 'resumed') {
+                  setProgress({ percent: 50, status: 'Analyzing document content...' });
+                }
+                if (data.type === 'finding') {
+                  // Streamed while the model is still writing; a resumed batch may repeat a quote, so key on page + text.
+                  setLiveFindings(prev => prev.some(f => f.global_page === data.finding.global_page && f.quote === data.finding.quote) ? prev : [...prev, { ...data.finding, _batch: data.batch }]);
+                }
+                if (data.type === 'stream_reset') {
+                  // The model call failed part-way and is being retried: drop what that attempt streamed.
+                  setLiveFindings(prev => prev.filter(f => f._batch !== data.batch));
+                }
+                if (data.type === 'done') {
+                  finished = true;
+                  setAnalysisResult(data.result);
+                  setProgress({ percent: 100, status: 'Complete' });
+                  setAnalyzing(false);
+                  loadHistory(); // Refresh history after new analysis
+                }
+                if (data.type === 'error') {
+                  finished = true;
+                  toast.error(data.message);
+                  setAnalyzing(false);
+                }
+              } catch (e) {}
             }
-            if (data.type === 'error') {
-              toast.error(data.message);
-              setAnalyzing(false);
-            }
-          } catch (e) {}
-        }
+          }
+        } catch (e) {}
+        if (finished || !analysisId || reconnects >= 5) break;
+        reconnects += 1;
+        setProgress({ percent: 50, status: 'Reconnecting...' });
+        await new Promise(resolve => setTimeout(resolve, 1000 * reconnects));
+        response = await fetch(`${API}/pro/analyses/${analysisId}/events`, {
+          headers: lastEventId ? { 'Last-Event-ID': lastEventId } : {},
+        });
+      }
+      if (!finished) {
+        toast.error("Lost connection to the analysis");
+        setAnalyzing(false);
       }
     } catch (e) {
       toast.error("Analysis failed");
@@ -614,6 +688,14 @@ const DeepDive = () => {
                       <p className="text-[#a1a1aa] text-sm mt-1">{progress.status}</p>
                     </div>
                     <Progress value={progress.percent} className="w-[300px] h-2" />
+                    {liveFindings.length > 0 && (
+                      <div className="w-full max-w-3xl space-y-4 pt-4">
+                        <h4 className="text-sm font-medium text-[#a1a1aa] uppercase tracking-wide">{liveFindings.length} findings so far</h4>
+                        {liveFindings.map((f, i) => (
+                          <FindingCard key={i} finding={f} />
+                        ))}
+                      </div>
+                    )}
                   </div>
                 ) : analysisResult ? (
                   <div className="space-y-6 max-w-3xl mx-auto pb-10">
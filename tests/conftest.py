@@ -0,0 +1,9 @@
+import os
+import sys
+from pathlib import Path
+
+# server.py reads these at import time; the tests below never open a real Mongo connection.
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "deepdive_test")
+os.environ.setdefault("PRO_TOKENIZER", "approx")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
@@ -0,0 +1,26 @@
+import pytest
+
+import server
+from benchmarks.memory_mongo import MemoryClient
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+async def test_new_analysis_is_not_swept_before_its_handler_claims_it(monkeypatch):
+    monkeypatch.setattr(server, "db", MemoryClient()["jobs_test"])
+    await server.db.analyses.insert_one({"id": "fresh", "status": "queued", "lease": server._analysis_lease()})
+    await server.db.analyses.insert_one({"id": "orphan", "status": "queued"})
+    swept = []
+
+    async def _start(collection, analysis_id):
+        swept.append(analysis_id)
+    monkeypatch.setattr(server, "_start_analysis_job", _start)
+    await server._resume_orphaned_analyses()
+    assert swept == ["orphan"]
+    claimed = await server._claim_analysis("analyses", "fresh")
+    assert claimed["status"] == "in_progress" and claimed["attempts"] == 1
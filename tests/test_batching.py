@@ -0,0 +1,27 @@
+import server
+
+
+def _page(n, chars, words=50):
+    return {"page_number": n, "char_count": chars, "word_count": words}
+
+
+def test_plan_token_batches_fills_budget_exactly():
+    # 280 chars -> 70 tokens + 30 banner = 100 tokens per page.
+    pages = [_page(n, 280) for n in range(1, 6)]
+    assert server._plan_token_batches(pages, budget=200) == [2, 2, 1]
+    assert server._plan_token_batches(pages, budget=199) == [1, 1, 1, 1, 1]
+
+
+def test_plan_token_batches_oversized_page_gets_its_own_batch():
+    pages = [_page(1, 280), _page(2, 40_000), _page(3, 280)]
+    assert server._plan_token_batches(pages, budget=200) == [1, 1, 1]
+
+
+def test_plan_token_batches_empty_pages_ride_along():
+    pages = [_page(1, 280), _page(2, 0, words=0), _page(3, 280), _page(4, 280)]
+    assert server._plan_token_batches(pages, budget=200) == [3, 1]
+
+
+def test_plan_token_batches_caps_pages_per_batch():
+    pages = [_page(n, 4) for n in range(1, 8)]
+    assert server._plan_token_batches(pages, budget=10_000, max_pages=3) == [3, 3, 1]
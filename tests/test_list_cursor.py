@@ -0,0 +1,41 @@
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import server
+from benchmarks.memory_mongo import MemoryClient
+
+
+@pytest.mark.parametrize("value", ["2024-01-01T00:00:00+00:00", 42, None])
+def test_cursor_round_trip(value):
+    cursor = server._encode_list_cursor(value, "doc-1")
+    assert "=" not in cursor
+    assert server._decode_list_cursor(cursor) == [value, "doc-1"]
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "", server._encode_list_cursor("x", "y")[:-3], "WzFd"])
+def test_malformed_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as exc:
+        server._decode_list_cursor(cursor)
+    assert exc.value.status_code == 400
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.mark.anyio
+async def test_following_next_cursor_walks_every_item(monkeypatch):
+    monkeypatch.setattr(server, "db", MemoryClient()["list_test"])
+    for n in range(5): await server.db.pro_analyses.insert_one({"id": f"a-{n}", "status": "complete", "created_at": f"2024-01-0{n + 1}T00:00:00+00:00"})
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as client:
+        everything = await client.get("/api/pro/analyses")
+        assert len(everything.json()) == 5 and server.LIST_NEXT_CURSOR_HEADER not in everything.headers
+        seen, params = [], {"limit": 2}
+        while True:
+            r = await client.get("/api/pro/analyses", params=params)
+            seen += [a["id"] for a in r.json()]
+            if server.LIST_NEXT_CURSOR_HEADER not in r.headers: break
+            params = {"limit": 2, "cursor": r.headers[server.LIST_NEXT_CURSOR_HEADER]}
+    assert seen == [f"a-{n}" for n in range(4, -1, -1)]
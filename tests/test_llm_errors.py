@@ -0,0 +1,43 @@
+import asyncio
+
+import aiohttp
+import pytest
+from fastapi import HTTPException
+from yarl import URL
+
+import server
+
+
+class _SdkError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _response_error(status):
+    url = URL("https://generativelanguage.googleapis.com/v1beta/models")
+    return aiohttp.ClientResponseError(request_info=aiohttp.RequestInfo(url, "POST", {}, url), history=(), status=status, message="error")
+
+
+@pytest.mark.parametrize("error, retryable, status", [
+    (server.LlmRetryableError("quota", 429, 3.0), True, 429),
+    (asyncio.TimeoutError(), True, None),
+    (aiohttp.ServerDisconnectedError(), True, None),
+    (_response_error(503), True, 503),
+    (_response_error(400), False, 400),
+    (_SdkError("Rate limit reached, retry in 2s", 429), True, 429),
+    # 4xx text that happens to mention quotas or rates is a client error, not something to retry.
+    (_SdkError("Invalid request: quota project not set", 400), False, 400),
+    (_SdkError("Unsupported sampling rate", 422), False, 422),
+    (HTTPException(status_code=500, detail={"message": "generateContent failed", "status": 403, "data": {"error": {"code": 403, "message": "quota exceeded for key"}}}), False, 403),
+    (HTTPException(status_code=500, detail={"preferred_error": {"status": 404}, "fallback_error": {"__error__": True, "status": 503, "data": {}}}), True, 503),
+    (HTTPException(status_code=500, detail={"message": "failed", "data": {"error": {"code": 429, "message": "retryDelay: 7s"}}}), True, 429),
+])
+def test_classified_by_type_or_status(error, retryable, status):
+    assert server._classify_llm_error(error)[:2] == (retryable, status)
+
+
+def test_text_is_the_last_resort():
+    assert server._classify_llm_error(Exception("503 Service Unavailable"))[:2] == (True, 503)
+    assert server._classify_llm_error(Exception("model is overloaded, retry in 4s")) == (True, None, 4.0)
+    assert server._classify_llm_error(ValueError("bad JSON"))[0] is False
@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+async def test_backoff_releases_the_scheduler_slot(monkeypatch):
+    monkeypatch.setattr(server, "batch_scheduler", server.BatchScheduler(1))
+    order = []
+
+    def _flaky():
+        calls = [0]
+
+        async def _call():
+            calls[0] += 1
+            order.append(f"a{calls[0]}")
+            if calls[0] == 1: raise server.LlmRetryableError("503", 503, 0.2)
+            return "a"
+        return _call
+
+    async def _other():
+        order.append("b")
+        return "b"
+
+    async def _later():
+        await asyncio.sleep(0.05)  # a's first attempt has failed and it is backing off
+        return await server._call_llm_with_retry("k", "m-other", 10, _other, scheduled=True)
+
+    results = await asyncio.gather(server._call_llm_with_retry("k", "m-flaky", 10, _flaky(), scheduled=True), _later())
+    assert results == ["a", "b"]
+    assert order == ["a1", "b", "a2"]
+    assert server.batch_scheduler.running == 0
@@ -0,0 +1,65 @@
+import server
+
+_PAGES_A = [
+    {"page_number": 1, "text": "The indemnification clause covers indemnification of each party."},
+    {"page_number": 2, "text": "Payment terms and the schedule of payments."},
+    {"page_number": 3, "text": "Indemnification is mentioned once among many other unrelated words about notices and courts."},
+]
+
+
+def _index(**bounds):
+    index = server.PageIndex(**bounds)
+    index.add_document("a", _PAGES_A)
+    index.add_document("b", [{"page_number": 1, "text": "Payment payment payment."}])
+    return index
+
+
+def test_bm25_ranks_term_frequency_and_length():
+    scores = _index().score("a", "indemnification")
+    assert set(scores) == {1, 3}
+    assert scores[1] > scores[3]
+
+
+def test_bm25_rarer_term_outweighs_common_one():
+    index = _index()
+    index.add_document("a", _PAGES_A + [{"page_number": 4, "text": "payment warranty"}])
+    scores = index.score("a", "payment warranty")
+    assert max(scores, key=scores.get) == 4
+
+
+def test_bm25_scores_are_per_document_and_respect_page_range():
+    index = _index()
+    assert index.score("b", "indemnification") == {}
+    assert set(index.score("a", "indemnification", page_start=2)) == {3}
+    assert set(index.score("a", "indemnification", page_end=2)) == {1}
+
+
+def test_scores_do_not_depend_on_other_documents():
+    alone = server.PageIndex()
+    alone.add_document("a", _PAGES_A)
+    assert alone.score("a", "payment indemnification") == _index().score("a", "payment indemnification")
+
+
+def test_remove_document_drops_its_postings():
+    index = _index()
+    index.remove_document("a")
+    assert not index.has_document("a")
+    assert index.score("a", "indemnification") == {}
+    assert index.total_pages == 1
+
+
+def test_least_recently_used_documents_are_evicted_past_the_page_bound():
+    index = _index(max_pages=4)
+    index.score("a", "payment")  # a is now more recently used than b
+    index.add_document("c", [{"page_number": 1, "text": "warranty"}])
+    assert not index.has_document("b") and index.has_document("a") and index.has_document("c")
+    assert index.total_pages == 4
+    index.add_document("d", [{"page_number": n, "text": "big"} for n in range(1, 10)])
+    assert list(index.docs) == ["d"]  # kept alone even though it exceeds the bound
+
+
+def test_idle_documents_are_evicted():
+    index = _index(idle_seconds=60)
+    index.docs["b"]["used_at"] -= 120
+    index.evict_idle()
+    assert index.has_document("a") and not index.has_document("b")
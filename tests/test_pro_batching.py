@@ -0,0 +1,44 @@
+import server
+from benchmarks.synthetic_pdf import make_pdf
+
+
+def test_build_token_windows_budget_boundary():
+    pages = [(1, 100), (2, 100), (3, 100)]
+    assert server._build_token_windows(pages, budget=200, overlap=0) == [(1, 2, 200), (3, 3, 100)]
+    assert server._build_token_windows(pages, budget=300, overlap=0) == [(1, 3, 300)]
+
+
+def test_build_token_windows_overlap_steps_back():
+    pages = [(n, 100) for n in range(1, 6)]
+    assert server._build_token_windows(pages, budget=300, overlap=1) == [(1, 3, 300), (3, 5, 300)]
+
+
+def test_build_token_windows_oversized_page():
+    pages = [(1, 50), (2, 500), (3, 50)]
+    assert server._build_token_windows(pages, budget=100, overlap=0) == [(1, 1, 50), (2, 2, 500), (3, 3, 50)]
+    # Overlap never makes a window start where the previous one did.
+    assert server._build_token_windows([(1, 500), (2, 500)], budget=100, overlap=5) == [(1, 1, 500), (2, 2, 500)]
+
+
+def test_dedupe_overlap_findings_keeps_first_occurrence():
+    reports = [
+        {"pages": {"start": 1, "end": 60}, "report": {"findings": [{"global_page": 10, "quote": "The Party shall  indemnify"}, {"global_page": 55, "quote": "notice"}]}},
+        {"pages": {"start": 50, "end": 100}, "report": {"findings": [{"global_page": 55, "quote": "NOTICE"}, {"global_page": 55, "quote": "other"}, {"global_page": "10", "quote": "the party shall indemnify"}]}},
+        {"pages": {"start": 90, "end": 120}, "report": {"raw": "unparseable"}},
+    ]
+    assert server._dedupe_overlap_findings(reports) == 2
+    assert [f["quote"] for f in reports[0]["report"]["findings"]] == ["The Party shall  indemnify", "notice"]
+    assert [f["quote"] for f in reports[1]["report"]["findings"]] == ["other"]
+
+
+def test_approx_tokenizer():
+    name, count = server._text_token_counter("approx")
+    assert name == "approx"
+    assert [count(""), count("abcd"), count("abcde")] == [0, 1, 2]
+
+
+def test_page_tokens_with_stand_in_tokenizer(tmp_path):
+    pdf = make_pdf(tmp_path / "doc.pdf", pages=3, words_per_page=40)
+    pages = server._extract_pdf_page_tokens(str(pdf), 1, 3, "approx")
+    assert [p["page_number"] for p in pages] == [1, 2, 3]
+    assert all(p["tokens"] == (len(p["text"]) + 3) // 4 > 0 for p in pages)
@@ -0,0 +1,89 @@
+"""Pro chat follow-ups against the local FakeGemini: cachedContents create, reuse, expiry and inline fallbacks."""
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+import server
+from benchmarks.fakes import FakeGemini
+from benchmarks.memory_mongo import MemoryClient
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def env(monkeypatch):
+    monkeypatch.setenv("GOOGLE_API_KEY_DEEP_DIVE", "test-key")
+    monkeypatch.setattr(server, "db", MemoryClient()["pro_chat_test"])
+    monkeypatch.setattr(server, "_http_session", None)
+    server._gemini_models_cache.clear()
+    server._gemini_pro_model_cache.clear()
+    async with FakeGemini(generate_latency=0) as fake:
+        # fake.patch() rebinds the Gemini URLs on the module; registering them first lets monkeypatch restore them.
+        for name in ("GEMINI_BASE_URL", "GEMINI_FILES_UPLOAD_URL", "GEMINI_FILES_URL"): monkeypatch.setattr(server, name, getattr(server, name))
+        fake.patch(server)
+        await server.db.pro_documents.insert_one({"id": "doc-1", "filename": "contract.pdf", "status": "ready", "total_pages": 20,
+                                                  "parts": [{"part_index": 0, "start_page": 1, "end_page": 20, "gemini_file_uri": f"{fake.base}/v1beta/files/f1"}]})
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as client:
+            yield client, fake
+    await server._http_session.close()
+
+
+async def _ask(client, message="What about indemnification?"):
+    r = await client.post("/api/pro/chat", json={"pro_document_id": "doc-1", "message": message, "gemini_api_key": "SERVER_ENV_KEY"})
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+async def _chat_cache():
+    return (await server.db.pro_documents.find_one({"id": "doc-1"}))["chat_cache"]
+
+
+async def test_cache_is_created_once_and_reused(env):
+    client, fake = env
+    first, second = await _ask(client), await _ask(client, "And termination?")
+    assert first["cached_context"] and second["cached_context"]
+    assert fake.calls["cache_create"] == 1
+    assert fake.calls["generate_cached"] == 2
+    assert fake.calls["generate"] == 2
+    assert (await _chat_cache())["name"] in fake.caches
+
+
+async def test_handle_near_expiry_is_recreated_and_old_one_deleted(env):
+    client, fake = env
+    await _ask(client)
+    old = await _chat_cache()
+    soon = (datetime.now(timezone.utc) + timedelta(seconds=server.PRO_CHAT_CACHE_REFRESH_MARGIN_SECONDS / 2)).isoformat()
+    await server.db.pro_documents.update_one({"id": "doc-1"}, {"$set": {"chat_cache.expire_time": soon}})
+    assert (await _ask(client))["cached_context"]
+    assert fake.calls["cache_create"] == 2
+    assert fake.calls["cache_delete"] == 1
+    assert old["name"] not in fake.caches
+    assert (await _chat_cache())["name"] in fake.caches
+
+
+async def test_failed_create_falls_back_inline_and_backs_off(env):
+    client, fake = env
+    fake.cache_create_status = 400
+    first, second = await _ask(client), await _ask(client)
+    assert not first["cached_context"] and not second["cached_context"]
+    assert fake.calls["cache_create"] == 1  # the failure is remembered for PRO_CHAT_CACHE_RETRY_SECONDS
+    assert fake.calls["generate_cached"] == 0
+    assert fake.calls["generate"] == 2
+    cache = await _chat_cache()
+    assert cache["name"] is None and cache["failed_at"]
+
+
+async def test_handle_evicted_server_side_falls_back_inline(env):
+    client, fake = env
+    await _ask(client)
+    fake.caches.clear()
+    answer = await _ask(client)
+    assert not answer["cached_context"]
+    assert answer["answer"].get("findings")
+    assert await _chat_cache() is None
@@ -0,0 +1,50 @@
+import pytest
+
+import server
+from benchmarks.memory_mongo import MemoryClient
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    monkeypatch.setattr(server, "db", MemoryClient()["pro_ingest_test"])
+    monkeypatch.setattr(server, "PRO_INGEST_RETRY_BASE_SECONDS", 0)
+    calls = {"uploaded": [], "deleted": [], "states": []}
+
+    async def _upload(api_key, path, display_name):
+        name = f"files/f{len(calls['uploaded']) + 1}"
+        calls["uploaded"].append(name)
+        return {"name": name, "uri": f"https://gemini/{name}", "state": calls["states"].pop(0)}
+
+    async def _delete(api_key, name):
+        calls["deleted"].append(name)
+    monkeypatch.setattr(server, "gemini_files_resumable_upload", _upload)
+    monkeypatch.setattr(server, "gemini_files_delete", _delete)
+    return calls
+
+
+async def _upload_part():
+    await server.db.pro_documents.insert_one({"id": "p-1", "parts": [{"part_index": 1}]})
+    await server._upload_pro_part("k", "p-1", "a.pdf", {"part_index": 1, "start_page": 1, "end_page": 10, "local_path": "/tmp/a.pdf"})
+
+
+async def test_failed_attempt_file_is_deleted_before_retrying(gemini):
+    gemini["states"] = ["FAILED", "ACTIVE"]
+    await _upload_part()
+    assert gemini["uploaded"] == ["files/f1", "files/f2"]
+    assert gemini["deleted"] == ["files/f1"]
+    part = (await server.db.pro_documents.find_one({"id": "p-1"}))["parts"][0]
+    assert part["gemini_file_name"] == "files/f2" and part["state"] == "ACTIVE"
+
+
+async def test_every_attempt_file_is_deleted_when_giving_up(gemini):
+    gemini["states"] = ["FAILED"] * server.PRO_INGEST_PART_RETRIES
+    with pytest.raises(RuntimeError):
+        await _upload_part()
+    assert gemini["deleted"] == gemini["uploaded"] and len(gemini["deleted"]) == server.PRO_INGEST_PART_RETRIES
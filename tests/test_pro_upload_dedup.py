@@ -0,0 +1,57 @@
+"""Pro uploads of identical bytes: /complete returns at once and the dedup happens in the background ingest."""
+import asyncio
+import hashlib
+
+import httpx
+import pytest
+
+import server
+from benchmarks.fakes import FakeGemini
+from benchmarks.memory_mongo import MemoryClient
+from benchmarks.synthetic_pdf import make_pdf
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def env(monkeypatch, tmp_path):
+    monkeypatch.setenv("GOOGLE_API_KEY_DEEP_DIVE", "test-key")
+    monkeypatch.setattr(server, "db", MemoryClient()["pro_dedup_test"])
+    monkeypatch.setattr(server, "PRO_UPLOAD_DIR", tmp_path)
+    monkeypatch.setattr(server, "_http_session", None)
+    server._gemini_models_cache.clear()
+    server._gemini_pro_model_cache.clear()
+    async with FakeGemini(generate_latency=0, upload_latency=0) as fake:
+        for name in ("GEMINI_BASE_URL", "GEMINI_FILES_UPLOAD_URL", "GEMINI_FILES_URL"): monkeypatch.setattr(server, name, getattr(server, name))
+        fake.patch(server)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as client:
+            yield client, fake, make_pdf(tmp_path / "src.pdf", pages=3, words_per_page=40).read_bytes()
+    await server._http_session.close()
+
+
+async def _upload(client, body):
+    init = (await client.post("/api/pro/upload/init", json={"filename": "a.pdf", "size_bytes": len(body)})).json()
+    await client.post(f"/api/pro/upload/{init['upload_id']}/chunk", params={"offset": 0}, content=body, headers={"X-Chunk-Sha256": hashlib.sha256(body).hexdigest()})
+    done = (await client.post("/api/pro/upload/complete", json={"upload_id": init["upload_id"], "gemini_api_key": "SERVER_ENV_KEY"})).json()
+    assert done["status"] == "processing"
+    for _ in range(200):
+        status = (await client.get(f"/api/pro/documents/{done['pro_document_id']}/ingest")).json()
+        if status["status"] != "processing": return status
+        await asyncio.sleep(0.02)
+    raise AssertionError("ingest did not finish")
+
+
+async def test_identical_upload_is_deduplicated_in_the_background(env):
+    client, fake, body = env
+    first = await _upload(client, body)
+    second = await _upload(client, body)
+    assert first["status"] == second["status"] == "ready"
+    assert not first["ingest"].get("deduplicated") and second["ingest"]["deduplicated"]
+    assert fake.calls["upload_start"] == 1
+    shared = await server.db.content_refs.find_one({"kind": "pro_document"})
+    assert shared["refs"] == 2 and shared["pages_id"] == first["pro_document_id"]
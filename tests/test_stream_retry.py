@@ -0,0 +1,93 @@
+"""Streamed LLM attempts that fail part-way and are retried: what was streamed must match what is kept."""
+import json
+import sys
+
+import pytest
+
+import server
+from benchmarks.fakes import install_fake_llm
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def test_item_streamer_retracts_a_failed_attempt():
+    delivered, resets = [], []
+    next_attempt = server._item_streamer("findings", delivered.append, resets.append)
+    _, feed = next_attempt()
+    feed('{"findings": [{"n": 1}, {"n": 2}, {"n"')
+    _, feed = next_attempt()
+    feed('{"findings": [{"n": 10}, {"n": 20}, {"n": 30}]}')
+    assert resets == [2]
+    assert delivered == [{"n": 1}, {"n": 2}, {"n": 10}, {"n": 20}, {"n": 30}]
+
+
+def test_item_streamer_without_a_failure_never_resets():
+    delivered, resets = [], []
+    _, feed = server._item_streamer("findings", delivered.append, resets.append)()
+    feed('{"findings": [{"n": 1}, ')
+    feed('{"n": 2}]}')
+    assert resets == [] and delivered == [{"n": 1}, {"n": 2}]
+
+
+def _page_result(n, quote):
+    return {"page_number": n, "status": "match", "findings": [{"text": quote, "relevance": "r", "confidence": "high"}], "page_summary": f"page {n}"}
+
+
+async def test_deep_scan_retry_resets_the_batch_and_caches_what_was_emitted(monkeypatch):
+    for name in ("emergentintegrations", "emergentintegrations.llm", "emergentintegrations.llm.chat"): monkeypatch.setitem(sys.modules, name, None)
+    install_fake_llm()
+    monkeypatch.setenv("GOOGLE_API_KEY_DEEP_DIVE", "test-key")
+    monkeypatch.setattr(server, "LLM_GENERATION_MODE", "stream")
+    cached = {}
+
+    async def _cache_get(key):
+        return None
+
+    async def _cache_put(key, result):
+        cached[key] = result
+
+    attempts = []
+
+    async def _stream(api_key, model, payload, on_text):
+        # First attempt streams page 1 and dies mid-response; the retry answers differently.
+        attempts.append(model)
+        assert payload["generationConfig"] == server.GEMINI_GENERATION_CONFIG
+        if len(attempts) == 1:
+            on_text(json.dumps({"page_results": [_page_result(1, "first attempt")]})[:-2] + ', {"page_number": 2')
+            raise server.LlmRetryableError("Gemini streamGenerateContent 503 mid-stream", 503, 0)
+        text = json.dumps({"page_results": [_page_result(1, "retry quote"), _page_result(2, "retry page two")], "batch_thinking": "t"})
+        on_text(text)
+        return 200, {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+
+    monkeypatch.setattr(server, "_batch_cache_get", _cache_get)
+    monkeypatch.setattr(server, "_batch_cache_put", _cache_put)
+    monkeypatch.setattr(server, "_gemini_stream_generate", _stream)
+    pages = [{"page_number": n, "text": "word " * 50, "word_count": 50, "char_count": 250} for n in (1, 2)]
+    events = [e async for e in server.deep_analyze_stream(pages, "q", "doc.pdf", "gemini-2.5-flash", rubric_text="r")]
+    types = [e["type"] for e in events]
+
+    assert len(attempts) == 2
+    assert types.index("batch_reset") < types.index("batch_complete")
+    streamed = [e["finding"]["text"] for e in events if e["type"] == "finding"]
+    assert streamed[0] == "first attempt" and streamed[-2:] == ["retry quote", "retry page two"]
+    complete = events[-1]
+    assert [f["text"] for f in complete["findings"]] == ["retry quote", "retry page two"]
+    batch_log = next(e for e in events if e["type"] == "batch_complete")["page_log"]
+    assert [(p["page_number"], p["summary"]) for p in batch_log] == [(1, "page 1"), (2, "page 2")]
+    (result,) = cached.values()
+    assert [p["findings"][0]["text"] for p in result["page_results"]] == ["retry quote", "retry page two"]
+
+
+async def test_writer_discards_findings_of_a_reset_batch():
+    writer = server.AnalysisWriter("a-1", total_pages=4)
+    writer.add_finding({"document": "d", "page_number": 1, "match_type": "match"})
+    mark = len(writer.findings)
+    writer.add_finding({"document": "d", "page_number": 3, "match_type": "match"})
+    writer.add_finding({"document": "d", "page_number": 4, "match_type": "possible"})
+    writer.discard_findings(mark)
+    assert writer.total_findings == 1 and writer.match_pages == {("d", 1)} and len(writer.findings) == 1
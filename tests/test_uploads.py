@@ -0,0 +1,64 @@
+import hashlib
+
+import httpx
+import pytest
+
+import server
+from benchmarks.memory_mongo import MemoryClient
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "db", MemoryClient()["uploads_test"])
+    monkeypatch.setattr(server, "PRO_UPLOAD_DIR", tmp_path)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as c:
+        yield c
+
+
+def test_missing_ranges_merges_overlapping_chunks():
+    assert server._missing_ranges([[0, 5], [10, 15], [3, 8]], 20) == [[8, 10], [15, 20]]
+
+
+def test_missing_ranges_empty_and_complete():
+    assert server._missing_ranges([], 10) == [[0, 10]]
+    assert server._missing_ranges([[5, 10], [0, 5]], 10) == []
+    assert server._missing_ranges([[0, 10], [0, 10]], 10) == []
+
+
+@pytest.mark.anyio
+async def test_chunk_over_session_chunk_size_is_rejected_before_buffering(client):
+    upload_id = (await client.post("/api/pro/upload/init", json={"filename": "a.pdf", "size_bytes": 64, "chunk_size": 16})).json()["upload_id"]
+    body = b"x" * 32
+    headers = {"X-Chunk-Sha256": hashlib.sha256(body).hexdigest()}
+    r = await client.post(f"/api/pro/upload/{upload_id}/chunk", params={"offset": 0}, content=body, headers=headers)
+    assert r.status_code == 413
+
+    async def _chunked():
+        # No Content-Length: the cap has to hold while the body streams in.
+        for _ in range(4): yield b"x" * 8
+    r = await client.post(f"/api/pro/upload/{upload_id}/chunk", params={"offset": 0}, content=_chunked(), headers=headers)
+    assert r.status_code == 413
+    ok = b"y" * 16
+    r = await client.post(f"/api/pro/upload/{upload_id}/chunk", params={"offset": 16}, content=ok, headers={"X-Chunk-Sha256": hashlib.sha256(ok).hexdigest()})
+    assert r.status_code == 200 and r.json()["uploaded_bytes"] == 16
+
+
+@pytest.mark.anyio
+async def test_failed_dedup_insert_gives_the_content_reference_back(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "UPLOAD_DIR", tmp_path)
+    body = b"%PDF-1.4 same bytes"
+    sha256 = hashlib.sha256(body).hexdigest()
+    await server.db.content_refs.insert_one({"kind": "document", "sha256": sha256, "pages_id": "src", "refs": 1})
+    await server.db.documents.insert_one({"id": "src", "pages_doc_id": "src", "status": "ready", "total_pages": 3, "total_words": 30})
+
+    async def _insert_fails(doc):
+        raise RuntimeError("insert failed")
+    monkeypatch.setattr(server.db.documents, "insert_one", _insert_fails)
+    with pytest.raises(RuntimeError):
+        await client.post("/api/documents/upload", files={"file": ("a.pdf", body, "application/pdf")})
+    assert (await server.db.content_refs.find_one({"pages_id": "src"}))["refs"] == 1